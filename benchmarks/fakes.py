@@ -0,0 +1,57 @@
+"""
+Offline stand-ins for Telegram, used by the benchmarks: builders for the JSON updates Telegram would post.
+The bot is the FakeBot of the tests, counting what it sends without keeping it.
+"""
+import time
+from itertools import count
+
+_message_ids = count(1)
+
+
+def message_update(update_id: int, chat_id: int, text: str = None, location: tuple = None) -> dict:
+    """
+    Build the JSON of a private chat message update.
+    Args:
+        location: (latitude, longitude) of a location message.
+    """
+    message = {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private', 'first_name': f'user{chat_id}'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}'},
+    }
+    if text is not None:
+        message['text'] = text
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    if location is not None:
+        message['location'] = {'latitude': location[0], 'longitude': location[1]}
+
+    return {'update_id': update_id, 'message': message}
+
+
+def search_script(chat_id: int, categories: list, address: str = None) -> list:
+    """
+    The steps of a full /search conversation: two categories, a location, and no new search.
+    Args:
+        address: typed in instead of sending the location, when given.
+    Return: list of message_update keyword arguments
+    """
+    first, second = categories[chat_id % len(categories)], categories[(chat_id + 1) % len(categories)]
+    if address is None:
+        location = [{'location': (49.84 + chat_id / 10000, 24.03)}]
+    else:
+        location = [{'text': '/skip'}, {'text': address}]
+    return [
+        {'text': '/search'},
+        {'text': first},
+        {'text': 'Yes'},
+        {'text': second},
+        {'text': 'No'},
+        *location,
+        {'text': 'No'},
+    ]
+
+
+# Messages the bot sends for each step of search_script
+SEARCH_SCRIPT_REPLIES = 8
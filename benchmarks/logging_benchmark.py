@@ -0,0 +1,169 @@
+"""
+Micro-benchmark of the logging overhead of an update.
+
+Logs the records of a location update of the search conversation (the location, the API request params and
+the API call) from several handler threads, and measures the time the handler threads spend logging them:
+- sync-text: eagerly formatted INFO f-strings, written by the handler threads, like the logs used to be;
+- queue-json: every record, as JSON, through the background writer of the LogPipeline;
+- queue-json-sampled: the records of LOG_SAMPLE_RATE of the updates through the writer;
+- disabled: the DEBUG records of the sampled loggers when DEBUG is off, the default.
+
+Prints one JSON line per mode: per-update overhead percentiles in microseconds, and the time the writer took
+to write the queued records after the last update. Without --rate, the updates are logged as fast as possible,
+more than the writer can keep up with: the records beyond LOG_QUEUE_SIZE are dropped.
+
+    python -m benchmarks.logging_benchmark --updates 20000 --threads 4 --rate 2000
+    python -m benchmarks.logging_benchmark --modes sync-text queue-json --log-file /tmp/bot.log
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from src.services.logging_service import (
+    TEXT_FORMAT,
+    JsonFormatter,
+    LogPipeline,
+    SampledLogger,
+    TextFormatter,
+    correlated,
+)
+from src.services.metrics_service import MetricsService
+
+MODES = ('sync-text', 'queue-json', 'queue-json-sampled', 'disabled')
+
+# A location update: the user, the location and the API request it makes
+FIRST_NAME = 'Taras'
+LATITUDE, LONGITUDE = 49.842345, 24.031234
+API_URL = 'https://safe-refuge.example/poi/search'
+
+
+class BenchmarkUpdate:
+    __slots__ = ('update_id',)
+
+    def __init__(self, update_id: int):
+        self.update_id = update_id
+
+
+def request_params() -> dict:
+    return {
+        "skip": 0, "limit": 100, "latitude": LATITUDE, "longitude": LONGITUDE, "min_distance": 0,
+        "max_distance": 500000, "categories": "Food, Medical", "add_distance": True, "fields": "compact"
+    }
+
+
+def sync_update(logger: logging.Logger) -> None:
+    logger.info(f'Location of {FIRST_NAME}: {LATITUDE} / {LONGITUDE}')
+    logger.info(f'Request params: {request_params()}')
+    logger.info(f'Calling API: {API_URL}')
+
+
+def structured_update(sampled: SampledLogger) -> None:
+    sampled.debug('Location received', latitude=LATITUDE, longitude=LONGITUDE)
+    sampled.debug('Request params', params=request_params())
+    sampled.debug('Calling API: %s', API_URL)
+
+
+def create_logger(mode: str, path: str, sample_rate: float):
+    """
+    Return: (function logging the records of an update, LogPipeline or None)
+    """
+    logger = logging.getLogger(f'benchmarks.logging.{mode}')
+    logger.propagate = False
+    logger.handlers[:] = []
+
+    if mode == 'sync-text':
+        stream = logging.FileHandler(path, encoding='utf-8')
+        stream.setFormatter(TextFormatter(TEXT_FORMAT))
+        logger.addHandler(stream)
+        logger.setLevel(logging.INFO)
+        return lambda update: sync_update(logger), None
+
+    stream = logging.FileHandler(path, encoding='utf-8')
+    stream.setFormatter(JsonFormatter())
+    pipeline = LogPipeline(stream).start()
+    logger.addHandler(pipeline.handler)
+    logger.setLevel(logging.INFO if mode == 'disabled' else logging.DEBUG)
+    sampled = SampledLogger(logger, rate=sample_rate if mode == 'queue-json-sampled' else 1)
+    return correlated(lambda update: structured_update(sampled)), pipeline
+
+
+def run(mode: str, updates: int, threads: int, path: str, sample_rate: float, rate: float = 0) -> dict:
+    open(path, 'w').close()
+    log_update, pipeline = create_logger(mode, path, sample_rate)
+    dropped = MetricsService.log_dropped._values.get((), 0)
+
+    latencies = [[] for _ in range(threads)]
+
+    def handle(index: int) -> None:
+        for update_id in range(index, updates, threads):
+            if rate:
+                # Paced like updates arriving at `rate` per second
+                delay = started_at + update_id / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            update = BenchmarkUpdate(update_id)
+            logging_at = time.perf_counter()
+            log_update(update)
+            latencies[index].append(time.perf_counter() - logging_at)
+
+    workers = [threading.Thread(target=handle, args=(index,)) for index in range(threads)]
+    started_at = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - started_at
+
+    drained_at = time.perf_counter()
+    if pipeline is not None:
+        pipeline.stop()
+    drain_seconds = time.perf_counter() - drained_at
+
+    latencies = sorted(latency for thread_latencies in latencies for latency in thread_latencies)
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    with open(path, encoding='utf-8') as file:
+        records = sum(1 for _ in file)
+    return {
+        "mode": mode,
+        "updates": updates,
+        "threads": threads,
+        "rate": rate,
+        "seconds": round(seconds, 3),
+        "overhead_p50_us": round(percentiles[49] * 1e6, 2),
+        "overhead_p99_us": round(percentiles[98] * 1e6, 2),
+        "overhead_mean_us": round(statistics.fmean(latencies) * 1e6, 2),
+        "writer_drain_seconds": round(drain_seconds, 3),
+        "records_written": records,
+        "records_dropped": MetricsService.log_dropped._values.get((), 0) - dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help='logging setups to measure')
+    parser.add_argument('--updates', type=int, default=20000, help='updates logged per mode')
+    parser.add_argument('--threads', type=int, default=4, help='handler threads logging at once')
+    parser.add_argument('--rate', type=float, default=0, help='updates per second, default: as fast as possible')
+    parser.add_argument('--sample-rate', type=float, default=0.1, help='share of the updates logged in queue-json-sampled')
+    parser.add_argument('--log-file', help='file the records are written to. Default: a temporary file')
+    args = parser.parse_args()
+
+    path = args.log_file
+    if path is None:
+        descriptor, path = tempfile.mkstemp(prefix='logging_benchmark', suffix='.log')
+        os.close(descriptor)
+    try:
+        for mode in args.modes:
+            print(json.dumps(run(mode, args.updates, args.threads, path, args.sample_rate, args.rate)), flush=True)
+    finally:
+        if args.log_file is None:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
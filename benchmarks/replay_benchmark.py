@@ -0,0 +1,221 @@
+"""
+Offline replay benchmark of the search conversation.
+
+Replays synthetic /search conversations, or a recorded stream of Telegram updates, through the
+handlers of get_search_conv_handler() with 1 to N dispatcher worker threads. Telegram is replaced by
+a fake bot, the Safe Refuge API and the Google Geocoding API by local stub servers with a
+configurable latency. Prints one JSON line per worker count: throughput, p50/p99 handler latency,
+memory per conversation and the upstream requests made.
+
+    python -m benchmarks.replay_benchmark --workers 1 2 4 8 --chats 500 --latency 0.02
+    python -m benchmarks.replay_benchmark --updates recorded_updates.jsonl
+
+A recorded stream is a file of Telegram update JSON objects, one per line, in the order received.
+Updates of the same chat are replayed in order, by the same worker.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import statistics
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from queue import Queue
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from benchmarks.fakes import message_update, search_script
+from benchmarks.stub_servers import CATEGORIES, GeocodeStub, SafeRefugeStub
+from tests.fakes import FakeBot
+
+
+def synthetic_updates(chats: int, address_share: float) -> list:
+    """
+    Build the updates of full /search conversations, a share of them typing an address instead of sending a location.
+    Return: list of Telegram update JSON objects, conversations interleaved as they would arrive
+    """
+    update_ids = count(1)
+    addressed = int(chats * address_share)
+    scripts = [
+        deque(search_script(chat_id, CATEGORIES, f'{chat_id % 50} Shevchenka street, Lviv' if chat_id <= addressed else None))
+        for chat_id in range(1, chats + 1)
+    ]
+
+    updates = []
+    while any(scripts):
+        for chat_id, script in enumerate(scripts, start=1):
+            if script:
+                updates.append(message_update(next(update_ids), chat_id, **script.popleft()))
+    return updates
+
+
+def recorded_updates(path: str) -> list:
+    """
+    Read a recorded stream of Telegram updates, one JSON object per line.
+    """
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def group_by_chat(updates: list, bot: FakeBot) -> list:
+    """
+    Split the updates in per chat streams, keeping their order.
+    Return: list of lists of Update
+    """
+    streams = OrderedDict()
+    for data in updates:
+        update = Update.de_json(data, bot)
+        chat = update.effective_chat
+        streams.setdefault(chat.id if chat else update.update_id, []).append(update)
+    return list(streams.values())
+
+
+def create_dispatcher(bot: FakeBot) -> Dispatcher:
+    """
+    Dispatcher with the real handlers. Updates are processed in the calling thread, its own worker stays idle.
+    """
+    import main
+    from config.settings import Settings
+
+    dispatcher = Dispatcher(bot, Queue(), workers=1, use_context=True)
+    main.add_handlers(dispatcher, Settings(_env_file=None, run_async_handlers=False))
+    return dispatcher
+
+
+def reset_caches() -> None:
+    """
+    Start a run with cold search and geocode caches, and a warm categories cache.
+    """
+    from src.services.cache_service import SingleFlightCache
+    from src.services.geocode_cache_service import GeocodeCache
+    from src.services.geocode_service import GeocodeService
+    from src.services.safe_refuge_api_service import SafeRefugeApiService
+
+    settings = SafeRefugeApiService.settings
+    SafeRefugeApiService.search_cache = SingleFlightCache(
+        ttl=settings.search_cache_ttl, max_size=settings.search_cache_size, name="search_cache"
+    )
+    GeocodeService.cache = GeocodeCache(
+        max_size=settings.geocode_cache_size, ttl=settings.geocode_cache_ttl, negative_ttl=settings.geocode_cache_negative_ttl
+    )
+    SafeRefugeApiService.get_category_list()
+
+
+def replay_streams(dispatcher: Dispatcher, streams: list) -> list:
+    """
+    Process the streams round-robin, one update of each chat in turn, like interleaved users.
+    Return: handler latency of every update, in seconds
+    """
+    latencies = []
+    pending = deque(iter(stream) for stream in streams)
+    while pending:
+        stream = pending.popleft()
+        update = next(stream, None)
+        if update is None:
+            continue
+        started_at = time.perf_counter()
+        dispatcher.process_update(update)
+        latencies.append(time.perf_counter() - started_at)
+        pending.append(stream)
+    return latencies
+
+
+def measure_memory(updates: list) -> int:
+    """
+    Replay every conversation but its last update, and measure the memory the open conversations hold.
+    Return: bytes per conversation
+    """
+    bot = FakeBot(record=False)
+    dispatcher = create_dispatcher(bot)
+    streams = [stream[:-1] for stream in group_by_chat(updates, bot)]
+    reset_caches()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    replay_streams(dispatcher, streams)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) // max(len(streams), 1)
+
+
+def run(workers: int, updates: list, stubs: tuple) -> dict:
+    bot = FakeBot(record=False)
+    dispatcher = create_dispatcher(bot)
+    streams = group_by_chat(updates, bot)
+    reset_caches()
+    for stub in stubs:
+        stub.requests.clear()
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        runs = [executor.submit(replay_streams, dispatcher, streams[index::workers]) for index in range(workers)]
+        latencies = [latency for replay in runs for latency in replay.result()]
+    seconds = time.perf_counter() - started_at
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    safe_refuge, geocode = stubs
+    safe_refuge_requests, geocode_requests = dict(safe_refuge.requests), sum(geocode.requests.values())
+    return {
+        "workers": workers,
+        "chats": len(streams),
+        "updates": len(latencies),
+        "messages_sent": bot.sent_count,
+        "upstream_latency": safe_refuge.latency,
+        "seconds": round(seconds, 3),
+        "updates_per_second": round(len(latencies) / seconds, 1),
+        "latency_p50_ms": round(percentiles[49] * 1000, 3),
+        "latency_p99_ms": round(percentiles[98] * 1000, 3),
+        "memory_per_conversation_bytes": measure_memory(updates),
+        "safe_refuge_requests": safe_refuge_requests,
+        "geocode_requests": geocode_requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='dispatcher worker thread counts to measure')
+    parser.add_argument('--chats', type=int, default=200, help='synthetic conversations per run')
+    parser.add_argument('--address-share', type=float, default=0.5, help='share of synthetic conversations typing an address')
+    parser.add_argument('--updates', help='JSON lines file of recorded Telegram updates, replayed instead of synthetic ones')
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated Safe Refuge API latency, in seconds')
+    parser.add_argument('--geocode-latency', type=float, default=0.05, help='simulated Geocoding API latency, in seconds')
+    parser.add_argument('--output', help='also append the JSON results to this file')
+    args = parser.parse_args()
+
+    stubs = (SafeRefugeStub(args.latency).start(), GeocodeStub(args.geocode_latency).start())
+
+    # The services read the settings on first use
+    os.environ['SAFE_REFUGE_ROOT_URL'] = stubs[0].url
+    os.environ.setdefault('GOOGLE_API_KEY', 'AIza-benchmark-key')
+    from googlemaps import Client
+    from src.services.geocode_service import GeocodeService
+
+    GeocodeService.gmaps = Client(
+        key=os.environ['GOOGLE_API_KEY'], base_url=stubs[1].url.rstrip('/'), queries_per_second=100000
+    )
+
+    # Per-update logs would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+
+    updates = recorded_updates(args.updates) if args.updates else synthetic_updates(args.chats, args.address_share)
+    try:
+        for workers in args.workers:
+            line = json.dumps(run(workers, updates, stubs))
+            print(line, flush=True)
+            if args.output:
+                with open(args.output, 'a', encoding='utf-8') as output:
+                    output.write(line + '\n')
+    finally:
+        for stub in stubs:
+            stub.stop()
+
+
+if __name__ == '__main__':
+    main()
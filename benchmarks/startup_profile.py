@@ -0,0 +1,106 @@
+"""
+Cold-start profile of the bot.
+
+Imports the bot in fresh interpreters with `python -X importtime`, and reports as JSON the import wall time
+(median of the runs), the packages and modules taking the longest to import, and the time the lazily built
+services take on first use.
+
+    python -m benchmarks.startup_profile
+    python -m benchmarks.startup_profile --module main --runs 5 --top 15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+
+# Run in the child interpreter: import the module, then build the lazy services as the first update would
+CHILD = '''
+import importlib, json, time
+started_at = time.perf_counter()
+import {module}
+imported_at = time.perf_counter()
+
+from src.services.container_service import ServiceContainer
+for service, attribute in {services!r}:
+    owner, name = attribute.split('.')
+    getattr(getattr(importlib.import_module(service), owner), name)
+print(json.dumps({{"import_seconds": imported_at - started_at, "services": ServiceContainer.built()}}))
+'''
+
+# Services built by the first search, without calling the upstream APIs
+SERVICES = [
+    ('src.services.safe_refuge_api_service', 'SafeRefugeApiService.http'),
+    ('src.services.safe_refuge_api_service', 'SafeRefugeApiService.breaker'),
+    ('src.services.safe_refuge_api_service', 'SafeRefugeApiService.search_cache'),
+    ('src.services.safe_refuge_api_service', 'SafeRefugeApiService.category_cache'),
+    ('src.services.geocode_service', 'GeocodeService.cache'),
+    ('src.services.geocode_service', 'GeocodeService.breaker'),
+    ('src.services.geocode_service', 'GeocodeService.gmaps'),
+]
+
+
+def parse_importtime(stderr: str) -> list:
+    """
+    Parse the `-X importtime` lines.
+    Return: list of (module, self seconds, cumulative seconds)
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return modules
+
+
+def profile_once(module: str) -> tuple:
+    """
+    Import the module in a fresh interpreter.
+    Return: (child report dict, list of (module, self seconds, cumulative seconds))
+    """
+    env = dict(os.environ)
+    env.setdefault('GOOGLE_API_KEY', 'AIza-profile-key')
+    child = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD.format(module=module, services=SERVICES)],
+        capture_output=True, text=True, env=env, check=True
+    )
+    return json.loads(child.stdout.strip().splitlines()[-1]), parse_importtime(child.stderr)
+
+
+def report(module: str, runs: int, top: int) -> dict:
+    reports = sorted((profile_once(module) for _ in range(runs)), key=lambda run: run[0]["import_seconds"])
+    child, modules = reports[len(reports) // 2]
+
+    packages = Counter()
+    for name, self_seconds, _ in modules:
+        packages[name.split('.')[0]] += self_seconds
+    own = {'main', 'src', 'config'}
+
+    return {
+        "module": module,
+        "runs": runs,
+        "import_ms": round(child["import_seconds"] * 1000, 1),
+        "modules_imported": len(modules),
+        "own_modules_self_ms": round(sum(seconds for name, seconds, _ in modules if name.split('.')[0] in own) * 1000, 1),
+        "top_packages_ms": {name: round(seconds * 1000, 1) for name, seconds in packages.most_common(top)},
+        "top_modules_cumulative_ms": {
+            name: round(cumulative * 1000, 1) for name, _, cumulative in sorted(modules, key=lambda m: -m[2])[:top]
+        },
+        "first_use_services_ms": {name: round(seconds * 1000, 2) for name, seconds in child["services"].items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='main', help='module to import')
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters to import it in; the median run is reported')
+    parser.add_argument('--top', type=int, default=10, help='packages and modules listed')
+    args = parser.parse_args()
+
+    print(json.dumps(report(args.module, args.runs, args.top), indent=2))
+
+
+if __name__ == '__main__':
+    main()
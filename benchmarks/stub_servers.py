@@ -0,0 +1,136 @@
+"""
+Local stand-ins for the upstream APIs, used by the benchmarks: minimal HTTP servers answering like the
+Safe Refuge API and the Google Geocoding API, after a configurable latency.
+"""
+import json
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CATEGORIES = ['Clothes', 'Food', 'Legal', 'Medical', 'Shelter', 'Transport']
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        stub.count(url.path)
+        time.sleep(stub.latency)
+
+        status, body = stub.answer(url.path, {key: values[0] for key, values in parse_qs(url.query).items()})
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """
+    Threaded HTTP server on a free localhost port, counting the requests per path.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Args:
+            latency: seconds every request waits before being answered.
+        """
+        self.latency = latency
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.request_queue_size = 128
+        self.httpd.stub = self
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}/'
+
+    def count(self, path: str) -> None:
+        with self._lock:
+            self.requests[path] += 1
+
+    def answer(self, path: str, params: dict) -> tuple:
+        """
+        Return: (HTTP status, JSON body) of a GET request.
+        """
+        raise NotImplementedError
+
+    def start(self) -> "StubServer":
+        threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class SafeRefugeStub(StubServer):
+    """
+    Safe Refuge API stand-in: the categories list and a nearby search returning points around the location.
+    """
+
+    def __init__(self, latency: float = 0.0, points: int = 60):
+        """
+        Args:
+            latency: seconds every request waits before being answered.
+            points: number of points a search finds, over all its pages.
+        """
+        super().__init__(latency)
+        self.points = points
+
+    def answer(self, path: str, params: dict) -> tuple:
+        if path == '/common':
+            return 200, {'items': [{'category': category} for category in CATEGORIES]}
+        if path != '/poi/search':
+            return 404, {'detail': 'Not Found'}
+
+        latitude, longitude = float(params.get('latitude', 0)), float(params.get('longitude', 0))
+        categories = [category.strip() for category in params.get('categories', '').split(',') if category.strip()]
+        skip, limit = int(params.get('skip', 0)), int(params.get('limit', 20))
+
+        items = [
+            {
+                'id': f'{latitude:.4f}:{longitude:.4f}:{index}',
+                'name': f'Point {index}',
+                'categories': [categories[index % len(categories)]] if categories else [CATEGORIES[index % len(CATEGORIES)]],
+                'geo': {'type': 'Point', 'coordinates': [longitude + index * 0.001, latitude]},
+                'distance': index * 73.0,
+            }
+            for index in range(skip, min(skip + limit, self.points))
+        ]
+        return 200, {'items': items, 'count': len(items)}
+
+
+class GeocodeStub(StubServer):
+    """
+    Google Geocoding API stand-in: every address is found, at a location derived from its text,
+    except the addresses containing "nowhere".
+    """
+
+    def answer(self, path: str, params: dict) -> tuple:
+        if path != '/maps/api/geocode/json':
+            return 404, {'status': 'INVALID_REQUEST', 'results': []}
+
+        address = params.get('address', '')
+        if 'nowhere' in address.lower():
+            return 200, {'status': 'ZERO_RESULTS', 'results': []}
+
+        offset = zlib.crc32(address.encode()) % 1000 / 10000
+        return 200, {
+            'status': 'OK',
+            'results': [{
+                'formatted_address': address.title(),
+                'geometry': {'location': {'lat': 49.84 + offset, 'lng': 24.03 + offset}},
+            }],
+        }
@@ -0,0 +1,124 @@
+"""
+Local load test of the webhook serving mode.
+
+Starts a WebhookServer with N worker processes, posts synthetic /search conversations to it over
+HTTP on localhost, and measures how fast they are accepted and processed. Telegram and the Safe
+Refuge API are replaced by offline fakes, with a configurable upstream latency.
+
+    python -m benchmarks.webhook_load_test --workers 1 2 4 --chats 200 --latency 0.02
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from queue import Queue
+
+from telegram.ext import Dispatcher
+
+from benchmarks.fakes import SEARCH_SCRIPT_REPLIES, message_update, search_script
+from config.settings import Settings
+from tests.fakes import FakeBot
+
+CATEGORIES = ['Clothes', 'Food', 'Legal', 'Medical', 'Shelter', 'Transport']
+URL_PATH = '/telegram'
+
+
+def create_benchmark_dispatcher(sent_counter, latency: float, worker: int = 0) -> Dispatcher:
+    """
+    Dispatcher factory of the webhook workers: the real handlers, with the upstream API faked.
+    """
+    import main
+    from src.services.poi_stream_service import PoiRecord
+    from src.services.safe_refuge_api_service import SafeRefugeApiService
+
+    # Per-update INFO logs would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+
+    def get_points_of_interest(chat_id, latitude=None, longitude=None, skip=0, limit=20, categories=None, **kwargs):
+        time.sleep(latency)
+        return iter([
+            PoiRecord(index, f'Point {index}', tuple(categories or ()), (longitude, latitude), index * 250)
+            for index in range(skip, skip + limit)
+        ])
+
+    SafeRefugeApiService.get_category_list = staticmethod(lambda: list(CATEGORIES))
+    SafeRefugeApiService.get_points_of_interest = staticmethod(get_points_of_interest)
+
+    settings = Settings(_env_file=None, run_async_handlers=False)
+    dispatcher = Dispatcher(FakeBot(sent_counter, record=False), Queue(), workers=1, use_context=True)
+    main.add_handlers(dispatcher, settings)
+    return dispatcher
+
+
+def post_conversation(port: int, chat_id: int, first_update_id: int) -> None:
+    """
+    Post the updates of one conversation in order, over a keep-alive connection.
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    for offset, step in enumerate(search_script(chat_id, CATEGORIES)):
+        body = json.dumps(message_update(first_update_id + offset, chat_id, **step))
+        while True:
+            connection.request('POST', URL_PATH, body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 503:
+                break
+    connection.close()
+
+
+def run(workers: int, chats: int, latency: float, concurrency: int) -> dict:
+    from src.services.webhook_service import WebhookServer
+
+    sent_counter = multiprocessing.Value('i', 0)
+    server = WebhookServer(
+        listen='127.0.0.1',
+        port=0,
+        url_path=URL_PATH,
+        workers=workers,
+        dispatcher_factory=partial(create_benchmark_dispatcher, sent_counter, latency)
+    )
+    server.start()
+
+    expected = chats * SEARCH_SCRIPT_REPLIES
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        posts = [executor.submit(post_conversation, server.port, chat_id, chat_id * 100) for chat_id in range(1, chats + 1)]
+        for post in posts:
+            post.result()
+    accepted_at = time.perf_counter()
+
+    while sent_counter.value < expected:
+        time.sleep(0.005)
+    finished_at = time.perf_counter()
+    server.stop()
+
+    updates = chats * len(search_script(0, CATEGORIES))
+    return {
+        "workers": workers,
+        "chats": chats,
+        "updates": updates,
+        "upstream_latency": latency,
+        "seconds": round(finished_at - started_at, 3),
+        "accepted_per_second": round(updates / (accepted_at - started_at), 1),
+        "processed_per_second": round(updates / (finished_at - started_at), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker process counts to measure')
+    parser.add_argument('--chats', type=int, default=200, help='conversations per run')
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated Safe Refuge API latency, in seconds')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent HTTP clients')
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        print(json.dumps(run(workers, args.chats, args.latency, args.concurrency)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
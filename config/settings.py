@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from pydantic import BaseSettings, Field
 
 
@@ -7,7 +9,161 @@ class Settings(BaseSettings):
     safe_refuge_root_url: str = Field("", env="SAFE_REFUGE_ROOT_URL")
     google_api_key: str = Field("", env="GOOGLE_API_KEY")
 
+    # Categories cache (seconds)
+    category_cache_ttl: int = Field(300, env="CATEGORY_CACHE_TTL")
+    category_cache_error_ttl: int = Field(30, env="CATEGORY_CACHE_ERROR_TTL")
+
+    # Safe Refuge API HTTP client
+    http_pool_connections: int = Field(4, env="HTTP_POOL_CONNECTIONS")
+    http_pool_maxsize: int = Field(16, env="HTTP_POOL_MAXSIZE")
+    http_connect_timeout: float = Field(3.05, env="HTTP_CONNECT_TIMEOUT")
+    http_read_timeout: float = Field(10, env="HTTP_READ_TIMEOUT")
+    http_max_retries: int = Field(2, env="HTTP_MAX_RETRIES")
+    http_backoff_factor: float = Field(0.2, env="HTTP_BACKOFF_FACTOR")
+    http_backoff_max: float = Field(2, env="HTTP_BACKOFF_MAX")
+
+    # Concurrency
+    dispatcher_workers: int = Field(32, env="DISPATCHER_WORKERS")
+    run_async_handlers: bool = Field(True, env="RUN_ASYNC_HANDLERS")
+    safe_refuge_max_concurrency: int = Field(16, env="SAFE_REFUGE_MAX_CONCURRENCY")
+    geocode_max_concurrency: int = Field(8, env="GEOCODE_MAX_CONCURRENCY")
+    upstream_acquire_timeout: float = Field(5, env="UPSTREAM_ACQUIRE_TIMEOUT")
+
+    # Admission control of the handlers run on the worker threads: updates wait in one queue per priority class
+    # (commands, replies in a conversation, then new searches) of admission_queue_size at most, and get a "busy"
+    # reply if their queue is full or they waited admission_deadline seconds. New searches leave
+    # admission_reserved_workers workers free for the other classes
+    admission_enabled: bool = Field(True, env="ADMISSION_ENABLED")
+    admission_queue_size: int = Field(200, env="ADMISSION_QUEUE_SIZE")
+    admission_deadline: float = Field(10, env="ADMISSION_DEADLINE")
+    admission_reserved_workers: int = Field(4, env="ADMISSION_RESERVED_WORKERS")
+
+    # Geocode cache (TTLs in seconds, empty path keeps the cache in memory only)
+    geocode_cache_size: int = Field(10000, env="GEOCODE_CACHE_SIZE")
+    geocode_cache_ttl: int = Field(604800, env="GEOCODE_CACHE_TTL")
+    geocode_cache_negative_ttl: int = Field(3600, env="GEOCODE_CACHE_NEGATIVE_TTL")
+    geocode_cache_path: str = Field("", env="GEOCODE_CACHE_PATH")
+    geocode_cache_purge_interval: int = Field(3600, env="GEOCODE_CACHE_PURGE_INTERVAL")
+
+    # Offline gazetteer of place names, built by src.jobs.build_gazetteer (empty path: every address goes to Google).
+    # Typed names of gazetteer_min_prefix letters or more also match by prefix or with typos
+    gazetteer_path: str = Field("", env="GAZETTEER_PATH")
+    gazetteer_min_prefix: int = Field(4, env="GAZETTEER_MIN_PREFIX")
+    gazetteer_countries: str = Field("UA,PL,MD,RO,SK,HU", env="GAZETTEER_COUNTRIES")
+
+    # Outbound messages (Telegram allows about 30 msg/s overall and 1 msg/s per chat)
+    scheduler_global_rate: float = Field(30, env="SCHEDULER_GLOBAL_RATE")
+    scheduler_global_burst: int = Field(30, env="SCHEDULER_GLOBAL_BURST")
+    scheduler_chat_rate: float = Field(1, env="SCHEDULER_CHAT_RATE")
+    scheduler_chat_burst: int = Field(3, env="SCHEDULER_CHAT_BURST")
+    scheduler_send_workers: int = Field(8, env="SCHEDULER_SEND_WORKERS")
+    scheduler_max_retries: int = Field(3, env="SCHEDULER_MAX_RETRIES")
+
+    # Serving: "polling" or "webhook"
+    serving_mode: str = Field("polling", env="SERVING_MODE")
+    webhook_url: str = Field("", env="WEBHOOK_URL")
+    webhook_path: str = Field("telegram", env="WEBHOOK_PATH")
+    webhook_listen: str = Field("0.0.0.0", env="WEBHOOK_LISTEN")
+    webhook_port: int = Field(8443, env="WEBHOOK_PORT")
+    webhook_workers: int = Field(4, env="WEBHOOK_WORKERS")
+    webhook_secret_token: str = Field("", env="WEBHOOK_SECRET_TOKEN")
+
+    # Local replica of the points of interest
+    poi_index_enabled: bool = Field(False, env="POI_INDEX_ENABLED")
+    poi_index_sync_interval: int = Field(900, env="POI_INDEX_SYNC_INTERVAL")
+    poi_index_page_size: int = Field(500, env="POI_INDEX_PAGE_SIZE")
+    poi_index_cell_degrees: float = Field(0.25, env="POI_INDEX_CELL_DEGREES")
+
+    # Nearby searches cache: identical searches within the TTL share one API call.
+    # Locations are snapped to a grid of search_cache_grid_degrees (0: exact locations)
+    search_cache_ttl: float = Field(30, env="SEARCH_CACHE_TTL")
+    search_cache_size: int = Field(1000, env="SEARCH_CACHE_SIZE")
+    search_cache_grid_degrees: float = Field(0.001, env="SEARCH_CACHE_GRID_DEGREES")
+    # While the Safe Refuge API is unavailable, expired searches are still served for this long
+    search_cache_stale_ttl: float = Field(3600, env="SEARCH_CACHE_STALE_TTL")
+
+    # Search results
+    results_page_size: int = Field(10, env="RESULTS_PAGE_SIZE")
+
+    # Ranking of the results: ranking_candidates points are fetched per search and ranked in-process. Points within
+    # ranking_tie_meters of each other are ordered to vary the categories, points of the same name within
+    # ranking_dedup_meters are shown once. NumPy, if installed, computes the distances of large candidate sets
+    ranking_candidates: int = Field(100, env="RANKING_CANDIDATES")
+    ranking_tie_meters: float = Field(50, env="RANKING_TIE_METERS")
+    ranking_dedup_meters: float = Field(30, env="RANKING_DEDUP_METERS")
+    ranking_numpy_min_items: int = Field(256, env="RANKING_NUMPY_MIN_ITEMS")
+
+    # Speculative searches: the points of interest are searched in the background as soon as the location and some
+    # categories are known (the location of the last search of the chat, until a new one is sent), on prefetch_workers
+    # threads. Each category added only searches the new one. Prefetched searches are kept prefetch_ttl seconds
+    prefetch_enabled: bool = Field(True, env="PREFETCH_ENABLED")
+    prefetch_workers: int = Field(8, env="PREFETCH_WORKERS")
+    prefetch_ttl: float = Field(120, env="PREFETCH_TTL")
+    prefetch_max_chats: int = Field(10000, env="PREFETCH_MAX_CHATS")
+
+    # Inline mode: Telegram caches the answers for inline_cache_time seconds, the bot for inline_results_cache_ttl.
+    # Queries typed within inline_debounce_seconds of each other only answer the last one
+    inline_cache_time: int = Field(300, env="INLINE_CACHE_TIME")
+    inline_results_cache_ttl: float = Field(120, env="INLINE_RESULTS_CACHE_TTL")
+    inline_results_cache_size: int = Field(1000, env="INLINE_RESULTS_CACHE_SIZE")
+    inline_results_limit: int = Field(20, env="INLINE_RESULTS_LIMIT")
+    inline_debounce_seconds: float = Field(0.4, env="INLINE_DEBOUNCE_SECONDS")
+
+    # /subscribe alerts of new points of interest, fed by the syncs of the local replica (see POI_INDEX_*).
+    # Alerts are sent at most subscription_fanout_rate per second, in batches of subscription_batch_size.
+    # With webhook workers, set subscription_path so they share the subscriptions; the first worker sends the alerts
+    subscriptions_enabled: bool = Field(False, env="SUBSCRIPTIONS_ENABLED")
+    subscription_path: str = Field("", env="SUBSCRIPTION_PATH")
+    subscription_radius: float = Field(10000, env="SUBSCRIPTION_RADIUS")
+    subscription_cell_degrees: float = Field(0.25, env="SUBSCRIPTION_CELL_DEGREES")
+    subscription_fanout_rate: float = Field(10, env="SUBSCRIPTION_FANOUT_RATE")
+    subscription_batch_size: int = Field(50, env="SUBSCRIPTION_BATCH_SIZE")
+    subscription_max_items: int = Field(5, env="SUBSCRIPTION_MAX_ITEMS")
+
+    # Conversation persistence, disabled when the path is empty
+    persistence_path: str = Field("", env="PERSISTENCE_PATH")
+    persistence_flush_interval: float = Field(5, env="PERSISTENCE_FLUSH_INTERVAL")
+    persistence_session_ttl: int = Field(86400, env="PERSISTENCE_SESSION_TTL")
+
+    # Store shared by the bot replicas, like redis://localhost:6379/0 (empty: every process keeps its own state).
+    # It holds the conversations (instead of PERSISTENCE_PATH), and the categories and geocode caches
+    shared_store_url: str = Field("", env="SHARED_STORE_URL")
+    shared_store_prefix: str = Field("safe_refuge:", env="SHARED_STORE_PREFIX")
+    shared_store_timeout: float = Field(2, env="SHARED_STORE_TIMEOUT")
+    shared_store_pool_size: int = Field(16, env="SHARED_STORE_POOL_SIZE")
+
+    # Metrics endpoint (webhook workers serve it on metrics_port + worker index)
+    metrics_enabled: bool = Field(False, env="METRICS_ENABLED")
+    metrics_listen: str = Field("127.0.0.1", env="METRICS_LISTEN")
+    metrics_port: int = Field(9100, env="METRICS_PORT")
+
+    # Upstream circuit breakers: calls fail fast for circuit_open_seconds once, over the last
+    # circuit_window seconds (and at least circuit_min_calls calls), enough calls failed or were slow
+    circuit_window: float = Field(30, env="CIRCUIT_WINDOW")
+    circuit_min_calls: int = Field(10, env="CIRCUIT_MIN_CALLS")
+    circuit_error_rate: float = Field(0.5, env="CIRCUIT_ERROR_RATE")
+    circuit_slow_call_seconds: float = Field(3, env="CIRCUIT_SLOW_CALL_SECONDS")
+    circuit_slow_call_rate: float = Field(0.8, env="CIRCUIT_SLOW_CALL_RATE")
+    circuit_open_seconds: float = Field(15, env="CIRCUIT_OPEN_SECONDS")
+
+    # Logs: written by a background thread, as JSON lines (or "text") from log_level on.
+    # Records waiting beyond log_queue_size are dropped
+    log_format: str = Field("json", env="LOG_FORMAT")
+    log_level: str = Field("INFO", env="LOG_LEVEL")
+    log_queue_size: int = Field(10000, env="LOG_QUEUE_SIZE")
+    # Share of the verbose per-request DEBUG logs that are emitted, and the rates of given loggers
+    # and their children, like "src.services.safe_refuge_api_service=0.01,src.conversations=0.5"
+    log_sample_rate: float = Field(0.1, env="LOG_SAMPLE_RATE")
+    log_sample_rates: str = Field("", env="LOG_SAMPLE_RATES")
+
     class Config:
         env_file = "config/.env"
         env_file_encoding = "utf-8"
-        
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    The settings of the bot, read from the environment and config/.env on first use, and shared by every service.
+    """
+    return Settings(_env_file="config/.env")
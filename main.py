@@ -1,30 +1,119 @@
-import logging
+import signal
+import threading
+from functools import partial
+from queue import Queue
 
-from config.settings import Settings
-from telegram.ext import Updater
+from config.settings import Settings, get_settings
+from telegram import Bot
+from telegram.ext import Dispatcher, JobQueue, Updater
+from telegram.utils.request import Request
 
-from src.conversations.search_conversation import get_search_conv_handler
-from src.conversations.start_conversation_exam import get_start_conv_handler
-from src.conversations.nestedconversationbot import get_nested_conv
+from src.conversations.quick_search import get_quick_search_handlers
+from src.conversations.search_conversation import get_search_conv_handler, get_search_results_handler
+from src.conversations.start_conversation import get_start_handler
+from src.conversations.subscribe_conversation import get_subscribe_handlers
+from src.services.admission_service import AdmissionDispatcher
+from src.services.logging_service import LoggingService
+from src.services.message_scheduler_service import MessageScheduler, ScheduledBot
+from src.services.metrics_service import MetricsServer, MetricsService
+from src.services.persistence_service import SessionPersistence
+from src.services.poi_index_service import PoiIndexService
+from src.services.subscription_service import SubscriptionService
+from src.services.webhook_service import WebhookServer
 
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
-)
+def create_bot(settings: Settings) -> ScheduledBot:
+    """Creates the bot; its outgoing messages are queued and sent within Telegram's rate limits."""
+    scheduler = MetricsService.register_scheduler(MessageScheduler.from_settings(settings))
+    scheduler.start()
 
+    # The worker threads run the async handlers; the connection pool is sized to match.
+    con_pool_size = settings.dispatcher_workers + settings.scheduler_send_workers + 4
+    return ScheduledBot(settings.telegram_key, scheduler=scheduler, request=Request(con_pool_size=con_pool_size))
+
+
+def create_persistence(settings: Settings) -> SessionPersistence | None:
+    """Creates the conversation persistence, when a SHARED_STORE_URL or a PERSISTENCE_PATH is set."""
+    if not settings.shared_store_url and not settings.persistence_path:
+        return None
+
+    persistence = SessionPersistence.from_settings(settings)
+    persistence.start()
+    return persistence
+
+
+def new_dispatcher(settings: Settings, bot: Bot, **kwargs) -> Dispatcher:
+    """Creates a dispatcher with DISPATCHER_WORKERS worker threads, behind admission control if ADMISSION_ENABLED."""
+    if settings.admission_enabled:
+        return AdmissionDispatcher.from_settings(settings, bot, Queue(), use_context=True, **kwargs)
+    return Dispatcher(bot, Queue(), workers=settings.dispatcher_workers, use_context=True, **kwargs)
+
+
+def add_handlers(dispatcher: Dispatcher, settings: Settings) -> None:
+    """Registers the bot handlers on the dispatcher."""
+    persistent = dispatcher.persistence is not None
+    start_handler = get_start_handler(persistent=persistent)
+    search_handler = get_search_conv_handler(run_async=settings.run_async_handlers, persistent=persistent)
+    MetricsService.register_conversation(start_handler)
+    MetricsService.register_conversation(search_handler)
+
+    dispatcher.add_handler(start_handler)
+    dispatcher.add_handler(search_handler)
+    dispatcher.add_handler(get_search_results_handler(run_async=settings.run_async_handlers))
+    for handler in get_quick_search_handlers(run_async=settings.run_async_handlers):
+        dispatcher.add_handler(handler)
+
+    conversations = [start_handler, search_handler]
+    if settings.subscriptions_enabled:
+        subscribe_handler, unsubscribe_handler = get_subscribe_handlers(run_async=settings.run_async_handlers, persistent=persistent)
+        MetricsService.register_conversation(subscribe_handler)
+        dispatcher.add_handler(subscribe_handler)
+        dispatcher.add_handler(unsubscribe_handler)
+        conversations.append(subscribe_handler)
+
+    if persistent:
+        dispatcher.persistence.add_conversation_handlers(conversations)
+
+    # Replicas sharing the sessions read the session of the chat before the conversations handle an update
+    if persistent and dispatcher.persistence.store.shared:
+        dispatcher.add_handler(dispatcher.persistence.get_prefetch_handler(conversations), group=-1)
+
+
+def start_background_services(settings: Settings, bot: Bot, worker: int = 0) -> None:
+    """
+    Starts the optional background services, with the metrics on METRICS_PORT + worker.
+    The subscription alerts are sent by the first worker only, and follow the syncs of the local replica.
+    """
+    if settings.subscriptions_enabled and worker == 0:
+        SubscriptionService.start(bot)
+        PoiIndexService.add_listener(SubscriptionService.publish)
+    if settings.poi_index_enabled or settings.subscriptions_enabled:
+        PoiIndexService.start_sync()
+    if settings.metrics_enabled:
+        MetricsServer(settings.metrics_listen, settings.metrics_port + worker).start()
 
-def main():
-    settings = Settings(_env_file="config/.env")
-    
-    # Create the Updater and pass it your bot's token.
-    updater = Updater(settings.telegram_key)
 
-    # Get the dispatcher to register handlers
-    dispatcher = updater.dispatcher
+def create_dispatcher(settings: Settings, worker: int = 0) -> Dispatcher:
+    """Creates the dispatcher of a webhook worker process."""
+    bot = create_bot(settings)
+    start_background_services(settings, bot, worker)
+    dispatcher = new_dispatcher(settings, bot, persistence=create_persistence(settings))
+    add_handlers(dispatcher, settings)
+    return dispatcher
+
+
+def run_polling(settings: Settings) -> None:
+    """Runs the bot with a single long-polling consumer."""
+    bot = create_bot(settings)
+    start_background_services(settings, bot)
+
+    # Create the Updater around the dispatcher
+    job_queue = JobQueue()
+    dispatcher = new_dispatcher(settings, bot, persistence=create_persistence(settings), job_queue=job_queue)
+    job_queue.set_dispatcher(dispatcher)
+    updater = Updater(dispatcher=dispatcher, workers=None)
 
     # Add handlers to the dispatcher
-    dispatcher.add_handler(get_start_conv_handler())
-    dispatcher.add_handler(get_search_conv_handler())
+    add_handlers(updater.dispatcher, settings)
 
     # Start the Bot
     updater.start_polling()
@@ -33,6 +122,55 @@ def main():
     # SIGTERM or SIGABRT. This should be used most of the time, since
     # start_polling() is non-blocking and will stop the bot gracefully.
     updater.idle()
+    if updater.persistence:
+        updater.persistence.stop()
+    if SubscriptionService.engine is not None:
+        SubscriptionService.engine.stop()
+    bot.scheduler.stop()
+
+
+def run_webhook(settings: Settings) -> None:
+    """Runs the bot behind a webhook, spreading the updates over several worker processes."""
+    workers = settings.webhook_workers
+
+    # Every worker sends its share of the global message rate
+    worker_settings = settings.copy(update={
+        "scheduler_global_rate": settings.scheduler_global_rate / workers,
+        "scheduler_global_burst": max(1, settings.scheduler_global_burst // workers),
+    })
+    server = WebhookServer(
+        listen=settings.webhook_listen,
+        port=settings.webhook_port,
+        url_path=f'/{settings.webhook_path}',
+        workers=workers,
+        dispatcher_factory=partial(create_dispatcher, worker_settings),
+        secret_token=settings.webhook_secret_token
+    )
+    server.start()
+
+    Bot(settings.telegram_key).set_webhook(
+        url=f'{settings.webhook_url.rstrip("/")}/{settings.webhook_path}',
+        secret_token=settings.webhook_secret_token or None
+    )
+
+    # Run until Ctrl-C or SIGTERM
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop.set())
+    while not stop.wait(1):
+        pass
+
+    server.stop()
+
+
+def main():
+    settings = get_settings()
+    LoggingService.configure(settings)
+
+    if settings.serving_mode == "webhook":
+        run_webhook(settings)
+    else:
+        run_polling(settings)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
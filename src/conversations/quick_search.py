@@ -0,0 +1,125 @@
+import functools
+import logging
+
+from telegram import ParseMode, Update
+from telegram.ext import CallbackContext, CallbackQueryHandler, Filters, InlineQueryHandler, MessageHandler
+
+from src.conversations.search_conversation import SEARCH_RESULTS_KEY, SearchResults, fetch_results_page
+from src.services.admission_service import search_priority
+from src.services.circuit_breaker_service import CircuitOpenError, upstream_errors
+from src.services.inline_search_service import InlineSearchService
+from src.services.keyboards_service import KeyboardService
+from src.services.logging_service import LoggingService
+from src.services.metrics_service import MetricsService
+from src.services.results_service import ResultsService
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+
+logger = logging.getLogger(__name__)
+sampled_logger = LoggingService.get_sampled_logger(__name__)
+
+# Opens the private chat with the bot, from an inline query without answers
+SWITCH_PM_PARAMETER = 'search'
+
+
+# Inline mode: "@bot shelter near Lviv"
+def inline_query(update: Update, context: CallbackContext) -> None:
+    """Answers the last inline query a user typed, see InlineSearchService."""
+    query = update.inline_query
+    # The answer runs on the dispatcher workers, admitted like the other searches
+    run_async = functools.partial(context.dispatcher.run_async, update=update)
+    InlineSearchService.debouncer.submit(query.from_user.id, timed_answer_inline_query, query, runner=run_async)
+
+def answer_inline_query(query) -> None:
+    """Answers an inline query with the points of interest it asks for, in one round-trip."""
+    location = query.location
+    sampled_logger.debug('Inline query received', first_name=query.from_user.first_name, query=query.query)
+    try:
+        results, is_personal = InlineSearchService.search(
+            query.query,
+            location.latitude if location else None,
+            location.longitude if location else None
+        )
+    except upstream_errors() as error:
+        if not isinstance(error, CircuitOpenError):
+            logger.warning("Inline search failed: %r", error)
+        query.answer([], cache_time=0, switch_pm_text='Search unavailable, try in the chat', switch_pm_parameter=SWITCH_PM_PARAMETER)
+        return
+
+    if results is None:
+        query.answer([], cache_time=0, switch_pm_text='Type "near" and an address, or search in the chat', switch_pm_parameter=SWITCH_PM_PARAMETER)
+    elif not results:
+        query.answer([], cache_time=InlineSearchService.settings.inline_cache_time, is_personal=is_personal,
+            switch_pm_text='Nothing found, search in the chat', switch_pm_parameter=SWITCH_PM_PARAMETER)
+    else:
+        query.answer(list(results), cache_time=InlineSearchService.settings.inline_cache_time, is_personal=is_personal)
+
+# Answers run after the debounce delay, outside of the handler
+timed_answer_inline_query = search_priority(MetricsService.instrument_handler(answer_inline_query, 'quick_search', 'INLINE'))
+
+
+# Callback query search: a location sent outside of /search, then a tap on a category
+def location_categories(update: Update, context: CallbackContext) -> None:
+    """Offers the categories to search around a location, as inline buttons."""
+    location = update.message.location
+    try:
+        keyboard = KeyboardService.get_categories_inline_keyboard(location.latitude, location.longitude)
+    except upstream_errors() as error:
+        if not isinstance(error, CircuitOpenError):
+            logger.warning("Categories unavailable: %r", error)
+        update.message.reply_text('Sorry, the search is unavailable right now. Please try again in a few minutes.')
+        return
+
+    update.message.reply_text('What are you looking for around this location?', reply_markup=keyboard)
+
+def category_selected(update: Update, context: CallbackContext) -> None:
+    """Replaces the categories message with the nearest points of interest of the category tapped."""
+    query = update.callback_query
+    _, latitude, longitude, index, *version = query.data.split(':')
+    try:
+        categories = sorted(SafeRefugeApiService.get_category_list())
+    except upstream_errors() as error:
+        if not isinstance(error, CircuitOpenError):
+            logger.warning("Categories unavailable: %r", error)
+        query.answer('Sorry, the search is unavailable right now. Please try again in a few minutes.')
+        return
+    # The buttons hold the index of the category in the list they were built from
+    if version != [KeyboardService.get_categories_version(categories)] or int(index) >= len(categories):
+        query.answer('These categories have changed, please send your location again.')
+        return
+
+    category = categories[int(index)]
+    results = SearchResults(query.message.message_id, float(latitude), float(longitude), [category])
+    try:
+        has_next = fetch_results_page(query.message.chat_id, results, 0)
+    except upstream_errors() as error:
+        if not isinstance(error, CircuitOpenError):
+            logger.warning("Upstream call failed: %r", error)
+        query.answer('Sorry, I cannot look for points of interest right now. Please try again in a minute.')
+        return
+
+    if not results.items:
+        query.answer(f'Sorry, I could not find any {category} near this location.')
+        return
+
+    # The results buttons are handled by the search results handler
+    context.chat_data[SEARCH_RESULTS_KEY] = results
+    query.answer()
+    text, keyboard = ResultsService.render_page(results.items, results.token, 0, ResultsService.page_size, has_next)
+    query.edit_message_text(text, parse_mode=ParseMode.HTML, disable_web_page_preview=True, reply_markup=keyboard)
+
+
+def get_quick_search_handlers(run_async: bool = False) -> list:
+    """
+    Returns the single round-trip search handlers: inline queries, and locations sent outside of /search
+    answered with inline category buttons. Add them after the search conversation, which takes the
+    locations it asked for.
+    Args:
+        run_async: run the callbacks on the dispatcher worker threads.
+    """
+    return [
+        InlineQueryHandler(search_priority(inline_query), run_async=run_async),
+        MessageHandler(Filters.location, MetricsService.instrument_handler(location_categories, 'quick_search', 'LOCATION'), run_async=run_async),
+        CallbackQueryHandler(
+            search_priority(MetricsService.instrument_handler(category_selected, 'quick_search', 'CATEGORY')), pattern=r'^poi_cat:', run_async=run_async
+        ),
+    ]
@@ -1,7 +1,9 @@
+import functools
 import logging
 
-from telegram import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
+from telegram import ParseMode, ReplyKeyboardRemove, Update
 from telegram.ext import (
+    CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
@@ -11,40 +13,118 @@ from telegram.ext import (
 
 from src.services.safe_refuge_api_service import SafeRefugeApiService
 from src.safe_refuge_api_calls.geocode import get_geocode
+from src.services.admission_service import search_priority
+from src.services.circuit_breaker_service import CircuitOpenError, upstream_errors
 from src.services.keyboards_service import KeyboardService
+from src.services.results_service import ResultsService
+from src.services.logging_service import LoggingService, correlated
+from src.services.metrics_service import MetricsService
+from src.services.persistence_service import register_state_type
+from src.services.prefetch_service import PrefetchService
+from src.services.poi_stream_service import PoiRecord
 
 logger = logging.getLogger(__name__)
+sampled_logger = LoggingService.get_sampled_logger(__name__)
 LOCATION, CHECK_INFO, GET_POINTS, ADD_CATEGORY, DONE = range(5)
 
 
-# Dynamic keyboards:
-categories_keyboard = None
-
 # Fixed keyboards:
 yes_no_keyboard = KeyboardService.get_yes_no_keyboard()
 location_keyboard = KeyboardService.get_location_keyboard()
 search_keyboard = [['/search']]
 
-# TODO: Check for collisions in parallel requests
-user_categories_choice = None # Holding all the user-selected interests
+# Their markups are built once and shared by every reply
+yes_no_markup = KeyboardService.get_reply_markup(yes_no_keyboard, "Please choose:")
+location_markup = KeyboardService.get_reply_markup(location_keyboard)
+search_markup = KeyboardService.get_reply_markup(search_keyboard, "For starting a new search, please click:")
+yes_no_retry_markup = KeyboardService.get_reply_markup(yes_no_keyboard, "please click:")
+search_retry_markup = KeyboardService.get_reply_markup(search_keyboard, "please click:")
+
+SEARCH_SESSION_KEY = 'search_session'
+SEARCH_RESULTS_KEY = 'search_results'
+
+
+@register_state_type
+class SearchSession:
+    """
+    Search conversation state of a single chat.
+    Stored in context.chat_data, so parallel conversations never share it.
+    """
+
+    __slots__ = ('categories',)
+
+    def __init__(self):
+        self.categories = {} # Holding all the user-selected interests
+
+    def get_categories_markup(self, placeholder: str = "Please choose:"):
+        """
+        Returns the keyboard of the categories the user did not select yet (shared, see KeyboardService).
+        """
+        return KeyboardService.get_categories_markup(self.categories, placeholder)
+
+    def to_state(self) -> dict:
+        return {'categories': self.categories}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "SearchSession":
+        session = cls()
+        session.categories = state['categories']
+        return session
+
+
+def get_search_session(context: CallbackContext) -> SearchSession:
+    """
+    Returns the search session of the current chat, creating it if needed.
+    """
+    session = context.chat_data.get(SEARCH_SESSION_KEY)
+    if session is None:
+        session = context.chat_data[SEARCH_SESSION_KEY] = SearchSession()
+
+    return session
+
+
+@register_state_type
+class SearchResults:
+    """
+    The last search results shown in a chat, used to page through them and to send location pins on demand.
+    Kept after the conversation ends, so the inline buttons of the results message keep working.
+    """
+
+    __slots__ = ('token', 'latitude', 'longitude', 'categories', 'skip', 'items')
+
+    def __init__(self, token: int, latitude: float, longitude: float, categories: list):
+        self.token = token # Id of the search, echoed by the inline buttons
+        self.latitude = latitude
+        self.longitude = longitude
+        self.categories = categories
+        self.skip = 0
+        self.items = [] # PoiRecord of the page shown
+
+    def to_state(self) -> list:
+        items = [item.to_state() for item in self.items]
+        return [self.token, self.latitude, self.longitude, self.categories, self.skip, items]
+
+    @classmethod
+    def from_state(cls, state: list) -> "SearchResults":
+        token, latitude, longitude, categories, skip, items = state
+        results = cls(token, latitude, longitude, categories)
+        results.skip = skip
+        results.items = [PoiRecord.from_state(item) for item in items]
+        return results
 
 # Helper functions (for clarity):
-def invalid_category_selected_msg(update) -> None:
+def invalid_category_selected_msg(update, categories_markup) -> None:
     """
     Invalid category selected.
     Updates the user to select another category.
 
     Args:
         update: The update object.
+        categories_markup: The keyboard of the categories still available to the user.
     """
     update.message.reply_text(
         'It looks like you choose an invalid category. Please, choose one of the available categories.',
-        reply_markup=ReplyKeyboardMarkup(
-            categories_keyboard,
-            one_time_keyboard=True,
-            input_field_placeholder="Please choose:",
-            resize_keyboard=True
-        )
+        reply_markup=categories_markup
     )
 
 def all_categories_selected_msg(update) -> None:
@@ -53,21 +133,14 @@ def all_categories_selected_msg(update) -> None:
     """
     update.message.reply_text(
         'You have selected all the categories.\nNow we need your location to provide the closest available assistance for your needs. If you see the prompt, please click "Allow" or alternatively you can press skip and manually enter your address',
-        reply_markup=ReplyKeyboardMarkup(
-            location_keyboard,
-            one_time_keyboard=True,
-            input_field_placholder="Please choose:",
-            resize_keyboard=True
-        )     
-    
+        reply_markup=location_markup
     )
 
-def ask_for_location(update, user) -> None | int:
+def ask_for_location(update, user, user_categories_choice) -> None | int:
     """
     Asks the user to send their location.
     """
-    categories_choice_len = len(user_categories_choice)
-    logger.info(f'User {user.first_name} interests in this {categories_choice_len} categories: {list(user_categories_choice.keys())}')
+    sampled_logger.debug('Categories selected', categories=list(user_categories_choice.keys()))
 
     # Checks if the user already shared his location
     if update.message.location:
@@ -75,13 +148,7 @@ def ask_for_location(update, user) -> None | int:
 
     update.message.reply_text(
         'We need your location to provide the closest available assistance for your needs. If you see the prompt, please click "Allow" or alternatively you can press skip and manually enter your address',
-        reply_markup=ReplyKeyboardMarkup(
-            location_keyboard,
-            one_time_keyboard=True,
-            input_field_placholder="Please choose:",
-            resize_keyboard=True
-        )     
-    
+        reply_markup=location_markup
     )
 
 def cant_find_POI_msg(update) -> None:
@@ -90,26 +157,25 @@ def cant_find_POI_msg(update) -> None:
     """
     update.message.reply_text(
         'Sorry, I could not find any points of interest near you. Maybe you want to look for another points of interest?',
-        reply_markup=ReplyKeyboardMarkup(
-            yes_no_keyboard,
-            one_time_keyboard=True,
-            input_field_placeholder="Please choose:",
-            resize_keyboard=True
-        )
+        reply_markup=yes_no_markup
     )
 
-def ask_for_more_info(update) -> None:
+def upstream_unavailable_msg(update, error, text) -> None:
+    """
+    An upstream API call failed - asks the user to try again.
+    Calls failed fast by an open circuit are not logged, the circuit breaker already was.
+    """
+    if not isinstance(error, CircuitOpenError):
+        logger.warning("Upstream call failed: %r", error)
+    update.message.reply_text(text)
+
+def ask_for_more_info(update, categories_markup) -> None:
     """
     Checks if the user has selected yes.
     """
     update.message.reply_text(
             'OK, select another category.',
-            reply_markup=ReplyKeyboardMarkup(
-                categories_keyboard,
-                one_time_keyboard=True,
-                input_field_placeholder="Please choose:",
-                resize_keyboard=True
-            )
+            reply_markup=categories_markup
         )
 
 def would_you_search_again_msg(update) -> None:
@@ -118,15 +184,10 @@ def would_you_search_again_msg(update) -> None:
     """
     update.message.reply_text(
         'Would you like to start a new search?', 
-        reply_markup=ReplyKeyboardMarkup(
-            yes_no_keyboard,
-            one_time_keyboard=True,
-            input_field_placeholder="Please choose:",
-            resize_keyboard=True
-        )
+        reply_markup=yes_no_markup
     )
 
-def invalid_answer_msg(update, keyboard_type, extra_text = "") -> None:
+def invalid_answer_msg(update, markup, extra_text = "") -> None:
     """
     Invalid answer - will return a clarification message to the user
     """
@@ -134,49 +195,104 @@ def invalid_answer_msg(update, keyboard_type, extra_text = "") -> None:
         f'Sorry, I did not understand your answer.\
         Please follow the instructions:\n\
         {extra_text}',
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard_type,
-            one_time_keyboard=True,
-            input_field_placeholder="please click:",
-            resize_keyboard=True
-        )
+        reply_markup=markup
     )
 
-def send_locations_to_user(update, points) -> None:
+def fetch_results_page(chat_id, results, skip) -> bool:
     """
-    Sends the user the nearest available points of interest.
+    Fetches a page of points of interest for the search results.
+    Returns: True if there is a next page.
     """
-    update.message.reply_text(
-            'Here are the nearest points of interest:\n', 
-            quote=True,  
-            reply_markup=ReplyKeyboardRemove()
-        )
+    page_size = ResultsService.page_size
+    # One extra item tells whether there is a next page
+    items = PrefetchService.search_nearby(
+        chat_id=chat_id,
+        skip=skip,
+        limit=page_size + 1,
+        latitude=results.latitude,
+        longitude=results.longitude,
+        categories=results.categories
+    )
+
+    results.skip = skip
+    results.items = items[:page_size]
+    return len(items) > page_size
+
+def prefetch_results(update, context) -> None:
+    """
+    Starts searching the categories selected so far around the location of the last search of the chat,
+    in the background: the user often sends the same location again (see PrefetchService).
+    """
+    results = context.chat_data.get(SEARCH_RESULTS_KEY)
+    if results is None:
+        return
+
+    categories = list(get_search_session(context).categories.values())
+    PrefetchService.prefetch(update.message.chat_id, results.latitude, results.longitude, categories)
+
+def with_prefetch(callback):
+    """
+    Wraps a conversation callback that selects categories, to prefetch the results once it ran.
+    """
+    @functools.wraps(callback)
+    def wrapper(update: Update, context: CallbackContext) -> int:
+        state = callback(update, context)
+        if state in (ADD_CATEGORY, LOCATION):
+            prefetch_results(update, context)
+        return state
+
+    return wrapper
+
+def send_locations_to_user(update, context, latitude, longitude) -> int | None:
+    """
+    Sends the user the nearest available points of interest, as a single message with one page of results.
+    Location pins and the next pages are sent on demand, through the inline buttons.
+    Returns None, keeping the conversation state, if the points of interest are unavailable.
+    """
+    categories = list(get_search_session(context).categories.values())
+    results = SearchResults(update.message.message_id, latitude, longitude, categories)
+    try:
+        has_next = fetch_results_page(update.message.chat_id, results, 0)
+    except upstream_errors() as error:
+        # Stay in the current state, so the user can send the location again
+        upstream_unavailable_msg(update, error, 'Sorry, I cannot look for points of interest right now. Please try again in a minute, or /cancel.')
+        return None
+
+    if not results.items:
+        cant_find_POI_msg(update)
+        return ADD_CATEGORY
 
-    for name, location in points.items():
-        update.message.reply_text(f'{name}:\n')
-        update.message.reply_location(location=location, reply_markup=ReplyKeyboardRemove())   
+    context.chat_data[SEARCH_RESULTS_KEY] = results
+    text, keyboard = ResultsService.render_page(results.items, results.token, 0, ResultsService.page_size, has_next)
+    update.message.reply_text(
+        text,
+        quote=True,
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True,
+        reply_markup=keyboard
+    )
+    would_you_search_again_msg(update)
+    return DONE
 
 
 # Conversation functions:
 def search(update: Update, context: CallbackContext) -> int:
     """Starts the conversation and asks the user about their needs."""
-    user = update.message.from_user
-    logger.info(f'User {user.first_name} started the conversation.')
+    sampled_logger.debug('Search started')
 
-    global categories_keyboard
-    global user_categories_choice
-    categories_keyboard = KeyboardService.get_categories_keyboard()
+    # reset the user categories choice
+    session = context.chat_data[SEARCH_SESSION_KEY] = SearchSession()
     # inline_categories_keyboard = keyboard_service.get_categories_inline_keyboard()
-    user_categories_choice = {} # reset the user categories choice
+    try:
+        categories_markup = session.get_categories_markup("Category:")
+    except upstream_errors() as error:
+        # No categories were ever loaded
+        upstream_unavailable_msg(update, error, 'Sorry, the search is unavailable right now. Please try again in a few minutes.')
+        return ConversationHandler.END
 
     update.message.reply_text(
         'Hi! What kind of point of interest are you looking for?\nPlease, select the appropriate option so that I can give you more accurate information.',
-        reply_markup=ReplyKeyboardMarkup(
-            categories_keyboard,
-            one_time_keyboard=True,
-            input_field_placeholder="Category:",
-            resize_keyboard=True
-            )
+        reply_markup=categories_markup
         # reply_markup=inline_categories_keyboard
     )
 
@@ -184,37 +300,31 @@ def search(update: Update, context: CallbackContext) -> int:
 
 def check_info(update: Update, context: CallbackContext) -> int:
     """Stores the info about the user and ends the conversation."""
-    user = update.message.from_user
     user_answer = update.message.text
-    logger.info(f'{user.first_name} Point of interest are: {update.message.text}')
 
-    global user_categories_choice
-    global categories_keyboard
+    session = get_search_session(context)
+    user_categories_choice = session.categories
 
     # Checks that the selected category is valid
     remaining_cat = SafeRefugeApiService.get_remaining_categories(user_categories_choice)
     user_choice = user_categories_choice.values()
 
     if user_answer not in [*remaining_cat, *user_choice]:
-        invalid_category_selected_msg(update)
+        sampled_logger.debug('Invalid category')
+        invalid_category_selected_msg(update, session.get_categories_markup())
         return CHECK_INFO
 
+    sampled_logger.debug('Category selected', category=user_answer)
     user_categories_choice[update.message.text] = update.message.text
-    categories_keyboard = KeyboardService.get_categories_keyboard(list(user_categories_choice))
     
     # Checks if all categories are selected
-    if categories_keyboard == []:
+    if not session.get_categories_markup().keyboard:
         all_categories_selected_msg(update)
         return LOCATION
 
     update.message.reply_text(
         'There is another category of interest are you looking for? ',
-        reply_markup=ReplyKeyboardMarkup(
-            yes_no_keyboard,
-            one_time_keyboard=True,
-            input_field_placeholder="Please choose:",
-            resize_keyboard=True
-            )
+        reply_markup=yes_no_markup
     )
 
     return ADD_CATEGORY
@@ -226,40 +336,30 @@ def add_category(update: Update, context: CallbackContext) -> int:
     user = update.message.from_user
     user_answer = update.message.text
 
+    session = get_search_session(context)
+
     if user_answer.lower() in ['No', 'no']:
-        ask_for_location(update, user)
+        ask_for_location(update, user, session.categories)
         return LOCATION
         
     elif user_answer.lower() in ['Yes', 'yes']:
-        ask_for_more_info(update)
+        ask_for_more_info(update, session.get_categories_markup())
         return CHECK_INFO
         
     else:
-        invalid_answer_msg(update, yes_no_keyboard, 'Please select Yes or No')
+        invalid_answer_msg(update, yes_no_retry_markup, 'Please select Yes or No')
         return ADD_CATEGORY
 
 def location(update: Update, context: CallbackContext) -> int:
     """Stores the location and looks for POIs (ONLY if user sent location)"""
-    
-    user = update.message.from_user
     user_location = update.message.location
-    logger.info(f'Location of { user.first_name}: {user_location.latitude} / {user_location.longitude}')
+    sampled_logger.debug('Location received', latitude=user_location.latitude, longitude=user_location.longitude)
 
-    points = SafeRefugeApiService.get_points_of_interest(chat_id=update.message.chat_id, latitude=user_location.latitude, longitude=user_location.longitude, categories=user_categories_choice.values())
-    
-    if not points:   
-        cant_find_POI_msg(update)
-        return ADD_CATEGORY 
-        
-    # TODO: to return locations table too.
-    send_locations_to_user(update, points)
-    would_you_search_again_msg(update)
-    return DONE
+    return send_locations_to_user(update, context, user_location.latitude, user_location.longitude)
 
 def skip_location(update: Update, context: CallbackContext) -> int:
     """Skips the location and asks for info about the user."""
-    user = update.message.from_user
-    logger.info(f'User {user.first_name} did not send a location.')
+    sampled_logger.debug('Location skipped')
     
     update.message.reply_text(
         "Ok, please type in an address close to yours so I can give you the relevant points of interest, otherwise I won't be able to help you.",
@@ -268,38 +368,47 @@ def skip_location(update: Update, context: CallbackContext) -> int:
 
     return GET_POINTS
 
-def get_points(update: Update, context: CallbackContext) -> int:
-    """Uses geolocation to turn the address into coordinates"""    
-    user = update.message.from_user
+def geocode_address(update) -> list | None:
+    """
+    Turns the address the user typed into coordinates.
+    Asks the user to type it again if it could not be.
+    Returns: [formatted address, {"lat": ..., "lng": ...}], or None.
+    """
     user_address = update.message.text
-    logger.info(f'User {user.first_name} sent {user_address} as an address close to them.')    
-    
-    result = get_geocode(user_address)
+    sampled_logger.debug('Address received')
+
+    try:
+        result = get_geocode(user_address)
+    except upstream_errors() as error:
+        upstream_unavailable_msg(update, error, 'Sorry, I cannot look up addresses right now. Please try again in a minute, or /cancel.')
+        return None
 
     if result == []:
         update.message.reply_text(
             'Sorry, I could not recognise that address. Maybe retype the address?',
             reply_markup=ReplyKeyboardRemove()
         )
+        return None
+
+    return result
 
+def get_points(update: Update, context: CallbackContext) -> int:
+    """Uses geolocation to turn the address into coordinates"""
+    result = geocode_address(update)
+    if result is None:
         return GET_POINTS
 
-    else:
-        update.message.reply_text(
-            f'You have inputted {result[0]} as your address. Looking for points of interest...',
-            reply_markup=ReplyKeyboardRemove()
-        )
+    # The search runs while the confirmation is sent
+    lat, lng = result[1]["lat"], result[1]["lng"]
+    categories = list(get_search_session(context).categories.values())
+    PrefetchService.prefetch(update.message.chat_id, lat, lng, categories)
 
-        lat, lng = result[1]["lat"], result[1]["lng"]
-        points = SafeRefugeApiService.get_points_of_interest(chat_id=update.message.chat_id, latitude=lat, longitude=lng, categories=user_categories_choice.values())
-        
-        if points:    
-            send_locations_to_user(update, points)
-            would_you_search_again_msg(update)
-            return DONE
+    update.message.reply_text(
+        f'You have inputted {result[0]} as your address. Looking for points of interest...',
+        reply_markup=ReplyKeyboardRemove()
+    )
 
-        cant_find_POI_msg()
-        return ADD_CATEGORY
+    return send_locations_to_user(update, context, lat, lng)
 
 def end_of_conversation(update: Update, context: CallbackContext):
     """Ends the conversation."""
@@ -307,14 +416,11 @@ def end_of_conversation(update: Update, context: CallbackContext):
     user_answer = update.message.text
     
     if user_answer.lower() in ['No', 'no']:
+        context.chat_data.pop(SEARCH_SESSION_KEY, None)
+        PrefetchService.cancel(update.message.chat_id)
         update.message.reply_text(
             'I hope this information will be helpful for you.\nsee you soon!',
-            reply_markup=ReplyKeyboardMarkup(
-                search_keyboard,
-                one_time_keyboard=True,
-                input_field_placeholder="For starting a new search, please click:",
-                resize_keyboard=True
-            )
+            reply_markup=search_markup
         )
         
         return ConversationHandler.END
@@ -324,13 +430,14 @@ def end_of_conversation(update: Update, context: CallbackContext):
     
     else:
         
-        invalid_answer_msg(update, search_keyboard, 'For starting a new search, please click /search.')
+        invalid_answer_msg(update, search_retry_markup, 'For starting a new search, please click /search.')
         return ConversationHandler.END
 
 def cancel(update: Update, context: CallbackContext) -> int:
     """Cancels and ends the conversation."""
-    user = update.message.from_user
-    logger.info(f'User {user.first_name} canceled the conversation.')
+    sampled_logger.debug('Search cancelled')
+    context.chat_data.pop(SEARCH_SESSION_KEY, None)
+    PrefetchService.cancel(update.message.chat_id)
     
     update.message.reply_text(
         'The current search has been cancelled. Anything else I can do for you?\
@@ -341,21 +448,78 @@ def cancel(update: Update, context: CallbackContext) -> int:
     return ConversationHandler.END
 
 
-def get_search_conv_handler() -> ConversationHandler:
-    """Returns the handler for the search conversation."""
+def results_callback(update: Update, context: CallbackContext) -> None:
+    """Handles the inline buttons of the search results: location pins and pagination."""
+    query = update.callback_query
+    action, token, value = query.data.split(':')
+    results = context.chat_data.get(SEARCH_RESULTS_KEY)
+
+    if results is None or results.token != int(token):
+        query.answer('These results have expired, please start a new /search.')
+        return
+
+    if action == 'poi_pin':
+        index = int(value)
+        query.answer()
+        if index < len(results.items):
+            query.message.reply_location(location=ResultsService.get_location(results.items[index]))
+        return
+
+    try:
+        has_next = fetch_results_page(query.message.chat_id, results, int(value))
+    except upstream_errors() as error:
+        if not isinstance(error, CircuitOpenError):
+            logger.warning("Upstream call failed: %r", error)
+        query.answer('Sorry, I cannot load more results right now. Please try again in a minute.')
+        return
+    query.answer()
+    text, keyboard = ResultsService.render_page(results.items, results.token, results.skip, ResultsService.page_size, has_next)
+    query.edit_message_text(
+        text,
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True,
+        reply_markup=keyboard
+    )
+
+
+def get_search_results_handler(run_async: bool = False) -> CallbackQueryHandler:
+    """
+    Returns the handler for the inline buttons of the search results.
+    Args:
+        run_async: run the callback on the dispatcher worker threads.
+    """
+
+    callback = MetricsService.instrument_handler(correlated(results_callback), 'search', 'RESULTS')
+    return CallbackQueryHandler(callback, pattern=r'^poi_(pin|page):', run_async=run_async)
+
+
+def get_search_conv_handler(run_async: bool = False, persistent: bool = False) -> ConversationHandler:
+    """
+    Returns the handler for the search conversation.
+    Args:
+        run_async: run the conversation callbacks on the dispatcher worker threads.
+        persistent: keep the conversation states in the dispatcher's persistence.
+    """
+
+    def timed(state, callback):
+        # Latency histogram per conversation state, see MetricsService, and logs carrying the update id
+        return MetricsService.instrument_handler(correlated(callback), 'search', state)
 
     return ConversationHandler(
-        entry_points=[CommandHandler('search', search)],
+        entry_points=[CommandHandler('search', search_priority(timed('ENTRY', search)))],
         states={
-            CHECK_INFO: [MessageHandler(Filters.text, check_info)],
-            ADD_CATEGORY: [MessageHandler(Filters.text, add_category)],            
+            CHECK_INFO: [MessageHandler(Filters.text, timed('CHECK_INFO', with_prefetch(check_info)))],
+            ADD_CATEGORY: [MessageHandler(Filters.text, timed('ADD_CATEGORY', add_category))],
             LOCATION: [
-                MessageHandler(Filters.location, location),
-                CommandHandler('skip', skip_location)
+                MessageHandler(Filters.location, search_priority(timed('LOCATION', location))),
+                CommandHandler('skip', timed('LOCATION', skip_location))
             ],
             # TODO: adding edge cases - if users recant, allow them to send location again.
-            GET_POINTS: [MessageHandler(Filters.text, get_points)],
-            DONE: [MessageHandler(Filters.text, end_of_conversation)],
+            GET_POINTS: [MessageHandler(Filters.text, search_priority(timed('GET_POINTS', get_points)))],
+            DONE: [MessageHandler(Filters.text, timed('DONE', end_of_conversation))],
         },
-        fallbacks=[CommandHandler('cancel', cancel)],
+        fallbacks=[CommandHandler('cancel', timed('FALLBACK', cancel))],
+        run_async=run_async,
+        name='search',
+        persistent=persistent,
     )
@@ -33,7 +33,7 @@ def start(update: Update, context: CallbackContext) -> int:
 def gender(update: Update, context: CallbackContext) -> int:
     """Stores the selected gender and asks for a photo."""
     user = update.message.from_user
-    logger.info("Gender of %s: %s", user.first_name, update.message.text)
+    logger.info("Gender selected", extra={'fields': {'first_name': user.first_name, 'text': update.message.text}})
     
     update.message.reply_text(
         'I see! Please send me a photo of yourself, '
@@ -49,7 +49,7 @@ def photo(update: Update, context: CallbackContext) -> int:
     user = update.message.from_user
     photo_file = update.message.photo[-1].get_file()
     photo_file.download('user_photo.jpg')
-    logger.info("Photo of %s: %s", user.first_name, 'user_photo.jpg')
+    logger.info("Photo saved as %s", 'user_photo.jpg', extra={'fields': {'first_name': user.first_name}})
     
     update.message.reply_text(
         'Gorgeous! Now, send me your location please, or send /skip if you don\'t want to.'
@@ -61,7 +61,7 @@ def photo(update: Update, context: CallbackContext) -> int:
 def skip_photo(update: Update, context: CallbackContext) -> int:
     """Skips the photo and asks for a location."""
     user = update.message.from_user
-    logger.info("User %s did not send a photo.", user.first_name)
+    logger.info("User did not send a photo.", extra={'fields': {'first_name': user.first_name}})
     
     update.message.reply_text(
         'I bet you look great! Now, send me your location please, or send /skip.'
@@ -74,7 +74,9 @@ def location(update: Update, context: CallbackContext) -> int:
     """Stores the location and asks for some info about the user."""
     user = update.message.from_user
     user_location = update.message.location
-    logger.info("Location of %s: %f / %f", user.first_name, user_location.latitude, user_location.longitude)
+    logger.info("Location received", extra={'fields': {
+        'first_name': user.first_name, 'latitude': user_location.latitude, 'longitude': user_location.longitude
+    }})
 
     update.message.reply_text(
         'Maybe I can visit you sometime! At last, tell me something about yourself.'
@@ -86,7 +88,7 @@ def location(update: Update, context: CallbackContext) -> int:
 def skip_location(update: Update, context: CallbackContext) -> int:
     """Skips the location and asks for info about the user."""
     user = update.message.from_user
-    logger.info("User %s did not send a location.", user.first_name)
+    logger.info("User did not send a location.", extra={'fields': {'first_name': user.first_name}})
     
     update.message.reply_text(
         'You seem a bit paranoid! At last, tell me something about yourself.'
@@ -98,7 +100,7 @@ def skip_location(update: Update, context: CallbackContext) -> int:
 def bio(update: Update, context: CallbackContext) -> int:
     """Stores the info about the user and ends the conversation."""
     user = update.message.from_user
-    logger.info("Bio of %s: %s", user.first_name, update.message.text)
+    logger.info("Bio received", extra={'fields': {'first_name': user.first_name, 'text': update.message.text}})
     
     update.message.reply_text(
         'Thank you! I hope we can talk again some day.'
@@ -110,7 +112,7 @@ def bio(update: Update, context: CallbackContext) -> int:
 def cancel(update: Update, context: CallbackContext) -> int:
     """Cancels and ends the conversation."""
     user = update.message
-    logger.info("User %s canceled the conversation.", user.from_user.first_name)
+    logger.info("User canceled the conversation.", extra={'fields': {'first_name': user.from_user.first_name}})
     
     update.message.reply_text(
         'Bye! I hope we can talk again some day.', reply_markup=ReplyKeyboardRemove()
@@ -119,8 +121,8 @@ def cancel(update: Update, context: CallbackContext) -> int:
     return ConversationHandler.END
 
 
-def get_start_handler():
-    """Returning an handler of the start conversation"""
+def get_start_handler(persistent: bool = False):
+    """Returning an handler of the start conversation, persistent if the dispatcher has a persistence"""
 
     return ConversationHandler(
         entry_points=[CommandHandler('start', start)],
@@ -133,5 +135,7 @@ def get_start_handler():
             ],
             BIO: [MessageHandler(Filters.text & ~Filters.command, bio)],
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='start',
+        persistent=persistent,
     )
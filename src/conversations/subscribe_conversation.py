@@ -0,0 +1,114 @@
+import logging
+
+from telegram import ReplyKeyboardRemove, Update
+from telegram.ext import CallbackContext, CommandHandler, ConversationHandler, Filters, MessageHandler
+
+from src.conversations.search_conversation import (
+    ADD_CATEGORY,
+    CHECK_INFO,
+    GET_POINTS,
+    LOCATION,
+    SEARCH_SESSION_KEY,
+    SearchSession,
+    add_category,
+    cancel,
+    check_info,
+    geocode_address,
+    get_search_session,
+    skip_location,
+    upstream_unavailable_msg,
+)
+from src.services.admission_service import search_priority
+from src.services.logging_service import LoggingService
+from src.services.metrics_service import MetricsService
+from src.services.results_service import ResultsService
+from src.services.subscription_service import SubscriptionService
+
+logger = logging.getLogger(__name__)
+sampled_logger = LoggingService.get_sampled_logger(__name__)
+
+
+# Helper functions (for clarity):
+def subscribed_msg(update, context, latitude, longitude, place) -> int:
+    """
+    Subscribes the chat to the categories of the session around a location, and ends the conversation.
+    """
+    categories = list(get_search_session(context).categories.values())
+    subscription = SubscriptionService.subscribe(update.message.chat_id, latitude, longitude, categories)
+    context.chat_data.pop(SEARCH_SESSION_KEY, None)
+    sampled_logger.debug('Chat %s subscribed to %s', update.message.chat_id, categories)
+
+    update.message.reply_text(
+        f'Done! I will let you know about new points of interest ({", ".join(categories)}) within '
+        f'{ResultsService.format_distance(subscription.radius)} of {place}.\nSend /unsubscribe to stop the alerts.',
+        reply_markup=ReplyKeyboardRemove()
+    )
+    return ConversationHandler.END
+
+
+# Conversation functions:
+def subscribe(update: Update, context: CallbackContext) -> int:
+    """Starts the subscription and asks the user about the categories to be alerted about."""
+    session = context.chat_data[SEARCH_SESSION_KEY] = SearchSession()
+    try:
+        categories_markup = session.get_categories_markup("Category:")
+    except Exception as error:
+        upstream_unavailable_msg(update, error, 'Sorry, the alerts are unavailable right now. Please try again in a few minutes.')
+        return ConversationHandler.END
+
+    update.message.reply_text(
+        'I can alert you when new points of interest open near you.\nWhat kind of point of interest should I look out for?',
+        reply_markup=categories_markup
+    )
+    return CHECK_INFO
+
+def subscribe_location(update: Update, context: CallbackContext) -> int:
+    """Subscribes around the location the user sent."""
+    user_location = update.message.location
+    return subscribed_msg(update, context, user_location.latitude, user_location.longitude, 'your location')
+
+def subscribe_address(update: Update, context: CallbackContext) -> int:
+    """Subscribes around the address the user typed."""
+    result = geocode_address(update)
+    if result is None:
+        return GET_POINTS
+
+    return subscribed_msg(update, context, result[1]["lat"], result[1]["lng"], result[0])
+
+def unsubscribe(update: Update, context: CallbackContext) -> None:
+    """Stops the alerts of the chat."""
+    if SubscriptionService.unsubscribe(update.message.chat_id):
+        update.message.reply_text('OK, I will not send you alerts anymore. Send /subscribe to get them again.')
+    else:
+        update.message.reply_text('You are not subscribed to any alerts. Send /subscribe to get some.')
+
+
+def get_subscribe_handlers(run_async: bool = False, persistent: bool = False) -> list:
+    """
+    Returns the handlers of the /subscribe conversation, which shares the category and location steps
+    of the search conversation, and of /unsubscribe.
+    Args:
+        run_async: run the conversation callbacks on the dispatcher worker threads.
+        persistent: keep the conversation states in the dispatcher's persistence.
+    """
+
+    def timed(state, callback):
+        return MetricsService.instrument_handler(callback, 'subscribe', state)
+
+    conversation = ConversationHandler(
+        entry_points=[CommandHandler('subscribe', search_priority(timed('ENTRY', subscribe)))],
+        states={
+            CHECK_INFO: [MessageHandler(Filters.text, timed('CHECK_INFO', check_info))],
+            ADD_CATEGORY: [MessageHandler(Filters.text, timed('ADD_CATEGORY', add_category))],
+            LOCATION: [
+                MessageHandler(Filters.location, timed('LOCATION', subscribe_location)),
+                CommandHandler('skip', timed('LOCATION', skip_location))
+            ],
+            GET_POINTS: [MessageHandler(Filters.text, search_priority(timed('GET_POINTS', subscribe_address)))],
+        },
+        fallbacks=[CommandHandler('cancel', timed('FALLBACK', cancel))],
+        run_async=run_async,
+        name='subscribe',
+        persistent=persistent,
+    )
+    return [conversation, CommandHandler('unsubscribe', timed('UNSUBSCRIBE', unsubscribe), run_async=run_async)]
@@ -0,0 +1,104 @@
+"""
+Builds the offline gazetteer read by GazetteerService (see GAZETTEER_PATH).
+
+Reads the place names from a tab separated file, one place per line:
+
+    kind    name    country    [weight    [latitude    longitude]]
+
+where kind is city, region, border_crossing or country, country its ISO code, and weight ranks the places
+sharing a prefix (like the population). Places without coordinates are geocoded with the Google API,
+restricted to their country; places of countries outside GAZETTEER_COUNTRIES are skipped. Lines starting
+with # are ignored. Several lines may name the same place, in other languages.
+
+    python -m src.jobs.build_gazetteer places.tsv --output data/gazetteer.bin
+"""
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config.settings import get_settings
+from src.services.gazetteer_service import PLACE_KINDS, Gazetteer, Place
+from src.services.geocode_service import GeocodeService
+
+logger = logging.getLogger(__name__)
+
+
+def read_places(path: str, countries: set) -> list:
+    """
+    Read the places file.
+    Return: list of (kind, name, country, weight, latitude or None, longitude or None)
+    """
+    places = []
+    with open(path, encoding='utf-8') as file:
+        for number, line in enumerate(file, start=1):
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in line.rstrip('\n').split('\t')]
+            if len(fields) < 3 or fields[0] not in PLACE_KINDS:
+                logger.warning("%s:%s: expected kind, name and country, skipped", path, number)
+                continue
+            if fields[2].upper() not in countries:
+                continue
+
+            weight = int(fields[3]) if len(fields) > 3 and fields[3] else 0
+            latitude, longitude = (float(fields[4]), float(fields[5])) if len(fields) > 5 else (None, None)
+            places.append((fields[0], fields[1], fields[2].upper(), weight, latitude, longitude))
+    return places
+
+
+def geocode_place(kind: str, name: str, country: str, weight: int, latitude, longitude):
+    """
+    Geocode a place with the Google API, unless its coordinates are known.
+    Return: Place, or None if Google did not recognise it
+    """
+    if latitude is not None:
+        return Place(name, kind, latitude, longitude, name, weight)
+
+    with GeocodeService.limiter:
+        geocode = GeocodeService.gmaps.geocode(name, components={'country': country})
+    if not geocode:
+        return None
+
+    location = geocode[0]["geometry"]["location"]
+    return Place(name, kind, location["lat"], location["lng"], geocode[0]["formatted_address"], weight)
+
+
+def build(path: str, output: str, countries: set, workers: int) -> dict:
+    started_at = time.perf_counter()
+    places = read_places(path, countries)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        geocoded = list(executor.map(lambda place: geocode_place(*place), places))
+
+    unrecognised = [place[1] for place, result in zip(places, geocoded) if result is None]
+    for name in unrecognised:
+        logger.warning("Google did not recognise %s, skipped", name)
+
+    names = Gazetteer.write(output, [place for place in geocoded if place is not None])
+    return {
+        "places": len(places),
+        "geocoded": sum(1 for place in places if place[4] is None) - len(unrecognised),
+        "unrecognised": len(unrecognised),
+        "names": names,
+        "seconds": round(time.perf_counter() - started_at, 1),
+    }
+
+
+def main():
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('places', help='tab separated file of the places')
+    parser.add_argument('--output', default=settings.gazetteer_path or 'gazetteer.bin', help='gazetteer file to write')
+    parser.add_argument('--countries', default=settings.gazetteer_countries, help='comma separated ISO codes of the countries kept')
+    parser.add_argument('--workers', type=int, default=settings.geocode_max_concurrency, help='concurrent geocoding requests')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    countries = {country.strip().upper() for country in args.countries.split(',') if country.strip()}
+    print(json.dumps(build(args.places, args.output, countries, args.workers), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""
+Runs the stand-in of the shared store (see SHARED_STORE_URL), to try several bot replicas on one host without Redis.
+With --path, the data is loaded from the file on start and written to it on exit.
+
+    python -m src.jobs.shared_store --port 6379 --path data/shared_store.json
+"""
+import argparse
+import logging
+import threading
+
+from src.services.shared_store_service import RespStandInServer
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listen', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=6379, help='port to listen on')
+    parser.add_argument('--path', default="", help='file keeping the data between runs')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    server = RespStandInServer(args.listen, args.port, args.path).start()
+    logger.info("Shared store stand-in listening at %s", server.url)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
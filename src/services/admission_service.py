@@ -0,0 +1,315 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram import Update
+from telegram.ext import ConversationHandler, Dispatcher, DispatcherHandlerStop
+from telegram.ext.utils.promise import Promise
+
+from config.settings import Settings
+from src.services.metrics_service import MetricsService
+from src.services.persistence_service import conversation_key
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, highest first
+PRIORITIES = ('command', 'reply', 'search')
+
+# Update of the worker tokens: no chat or user data to store
+ADMISSION_TOKEN = Update(0)
+
+BUSY_TEXT = "Sorry, I'm handling a lot of requests right now. Please try again in a few seconds."
+
+
+def search_priority(callback):
+    """
+    Marks a handler callback that starts or runs a search: its updates are admitted with the new searches, last.
+    Return: the callback
+    """
+    callback.admission_priority = 'search'
+    return callback
+
+
+def skip_handler(*args, **kwargs) -> None:
+    """
+    Stands for the callback of a shed update: its conversation stays in the state it was in.
+    """
+    return None
+
+
+class AdmissionEntry:
+    """
+    Work of an update waiting for a worker.
+    """
+
+    __slots__ = ('item', 'priority', 'enqueued_at', 'deadline')
+
+    def __init__(self, item, priority: str, enqueued_at: float, deadline: float):
+        self.item = item
+        self.priority = priority
+        self.enqueued_at = enqueued_at
+        self.deadline = deadline
+
+    def expired(self, now: float) -> bool:
+        return now >= self.deadline
+
+
+class AdmissionQueue:
+    """
+    Work queue served by priority class: one bounded FIFO queue per class of PRIORITIES, the highest class first.
+    The lowest class runs on at most `low_priority_slots` workers at once, so the others always find a worker.
+    Work that waited past its deadline is handed out at once, whatever its class, to be shed by the worker.
+    """
+
+    def __init__(self, queue_size: int = 200, deadline: float = 10, low_priority_slots: int = None):
+        """
+        Args:
+            queue_size: maximum number of waiting entries per class.
+            deadline: seconds an entry may wait for a worker.
+            low_priority_slots: maximum number of entries of the lowest class running at once. Default: None (no limit)
+        """
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.low_priority_slots = low_priority_slots
+
+        self._condition = threading.Condition()
+        self._queues = {priority: deque() for priority in PRIORITIES}
+        self._running = dict.fromkeys(PRIORITIES, 0)
+        self._closed = False
+
+    def put(self, item, priority: str) -> bool:
+        """
+        Queue an item.
+        Return: False if the queue of its class is full, or the queue is closed
+        """
+        now = time.monotonic()
+        with self._condition:
+            queue = self._queues[priority]
+            if self._closed or len(queue) >= self.queue_size:
+                return False
+            queue.append(AdmissionEntry(item, priority, now, now + self.deadline))
+            self._condition.notify()
+        return True
+
+    def get(self):
+        """
+        Wait for the next entry to run or to shed. Call done() once a returned entry that was not expired ran.
+        Return: the AdmissionEntry, or None once the queue is closed and empty
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                next_deadline = None
+                for priority in PRIORITIES:
+                    queue = self._queues[priority]
+                    if not queue:
+                        continue
+                    if queue[0].expired(now):
+                        return queue.popleft()
+                    if priority != PRIORITIES[-1] or self.low_priority_slots is None or self._running[priority] < self.low_priority_slots:
+                        self._running[priority] += 1
+                        return queue.popleft()
+                    next_deadline = queue[0].deadline
+
+                if self._closed and not any(self._queues.values()):
+                    return None
+                # Woken up by put() and done(), or when the waiting low priority entry expires
+                self._condition.wait(None if next_deadline is None else next_deadline - now)
+
+    def done(self, entry: AdmissionEntry) -> None:
+        with self._condition:
+            self._running[entry.priority] -= 1
+            self._condition.notify()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        """
+        Refuse new entries; get() returns None once the waiting ones are handed out.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                priority: {"queued": len(self._queues[priority]), "running": self._running[priority]}
+                for priority in PRIORITIES
+            }
+
+
+class AdmissionDispatcher(Dispatcher):
+    """
+    Dispatcher with admission control of the handlers run on its worker threads (run_async handlers).
+    Their work is queued per priority class: commands like /cancel first, replies in a conversation next,
+    new searches last (see classify and search_priority). Updates that find their queue full, or that wait past the deadline, are not handled:
+    the user gets a "busy" reply instead, and the conversation stays where it was.
+    Only the public run_async is overridden: work queued by the deprecated @run_async decorator is not admitted.
+    """
+
+    def __init__(self, *args, admission: AdmissionQueue, **kwargs):
+        """
+        Args:
+            admission: queue of the work of the worker threads.
+            Other arguments: see Dispatcher.
+        """
+        super().__init__(*args, **kwargs)
+        self.admission = admission
+        MetricsService.register_admission(admission)
+
+        # Busy replies are sent off the dispatcher and worker threads, and only while they keep up
+        self._busy_replies = ThreadPoolExecutor(max_workers=1, thread_name_prefix='admission-busy')
+        self._busy_pending = 0
+        self._busy_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: Settings, bot, update_queue, **kwargs) -> "AdmissionDispatcher":
+        """
+        Creates a dispatcher with the DISPATCHER_WORKERS and the ADMISSION_* settings.
+        """
+        workers = settings.dispatcher_workers
+        admission = AdmissionQueue(
+            queue_size=settings.admission_queue_size,
+            deadline=settings.admission_deadline,
+            low_priority_slots=max(1, workers - settings.admission_reserved_workers)
+        )
+        return cls(bot, update_queue, workers=workers, admission=admission, **kwargs)
+
+    def classify(self, update, callback=None) -> str:
+        """
+        Get the priority class of an update: the class its callback was marked with (see search_priority), else
+        'command' for commands, 'reply' for buttons and the messages of a conversation in progress, 'search' for the rest.
+        Return: the priority class, in PRIORITIES
+        """
+        priority = getattr(callback, 'admission_priority', None)
+        if priority is not None:
+            return priority
+        if not isinstance(update, Update):
+            return 'command'
+        if update.callback_query is not None:
+            return 'reply'
+
+        message = update.effective_message
+        if message is not None and message.text and message.text.startswith('/'):
+            return 'command'
+        if message is not None and self.in_conversation(update):
+            return 'reply'
+        return 'search'
+
+    def in_conversation(self, update: Update) -> bool:
+        """
+        Return: True if the update continues a conversation in progress
+        """
+        for handlers in self.handlers.values():
+            for handler in handlers:
+                if not isinstance(handler, ConversationHandler):
+                    continue
+                try:
+                    key = conversation_key(handler, update)
+                except AttributeError:
+                    # The update has no user or chat for this handler
+                    continue
+                if key in handler.conversations:
+                    return True
+        return False
+
+    def run_async(self, func, *args, update=None, **kwargs) -> Promise:
+        """
+        Queue the work of an update in its priority class, and a token on the worker threads: each token runs the
+        highest priority work waiting. The dispatcher and its workers run as they are, only the order of the work changes.
+        Return: the Promise of the work
+        """
+        promise = Promise(func, args, kwargs, update=update)
+        priority = self.classify(update, func)
+        if not self.admission.put(promise, priority):
+            self._shed(promise, priority, 'stopping' if self.admission.closed else 'queue_full')
+            return promise
+        # The workers store the changes of the update of the token: it has none, the work stores its own
+        super().run_async(self._run_admitted, update=ADMISSION_TOKEN)
+        return promise
+
+    def _run_admitted(self) -> None:
+        """
+        Run the next work of the admission queue, or shed it if it waited past its deadline.
+        """
+        entry = self.admission.get()
+        if entry is None:
+            return
+
+        promise = entry.item
+        now = time.monotonic()
+        MetricsService.admission_wait.observe(now - entry.enqueued_at, priority=entry.priority)
+        if entry.expired(now):
+            self._shed(promise, entry.priority, 'deadline')
+            return
+
+        try:
+            self._run_promise(promise)
+        finally:
+            self.admission.done(entry)
+
+    def _run_promise(self, promise: Promise) -> None:
+        """
+        Run the work of an update, then store its changes or handle its error, like the worker threads of Dispatcher.
+        """
+        promise.run()
+
+        if not promise.exception:
+            self.update_persistence(update=promise.update)
+            return
+
+        if isinstance(promise.exception, DispatcherHandlerStop):
+            logger.warning('DispatcherHandlerStop is not supported with async functions; func: %s', promise.pooled_function.__name__)
+            return
+
+        # Avoid infinite recursion of error handlers
+        if promise.pooled_function in self.error_handlers or not promise.error_handling:
+            logger.error('An uncaught error was raised while handling the error: %r', promise.exception)
+            return
+
+        try:
+            self.dispatch_error(promise.update, promise.exception, promise=promise)
+        except Exception:
+            logger.exception('An uncaught error was raised while handling the error.')
+
+    def _shed(self, promise: Promise, priority: str, reason: str) -> None:
+        """
+        Resolve the promise of an update without handling it, and tell the user to retry.
+        """
+        MetricsService.admission_shed.inc(priority=priority, reason=reason)
+        promise.pooled_function = skip_handler
+        promise.run()
+
+        update = promise.update
+        if not isinstance(update, Update) or update.inline_query is not None:
+            # Inline queries are sent again as the user types
+            return
+
+        with self._busy_lock:
+            if self._busy_pending >= self.admission.queue_size:
+                return
+            self._busy_pending += 1
+        self._busy_replies.submit(self._reply_busy, update)
+
+    def _reply_busy(self, update: Update) -> None:
+        try:
+            if update.callback_query is not None:
+                self.bot.answer_callback_query(update.callback_query.id, text=BUSY_TEXT)
+            elif update.effective_chat is not None:
+                self.bot.send_message(update.effective_chat.id, BUSY_TEXT)
+        except Exception as error:
+            logger.warning("Failed to send the busy reply: %r", error)
+        finally:
+            with self._busy_lock:
+                self._busy_pending -= 1
+
+    def stop(self) -> None:
+        # The workers run the waiting work, then stop
+        self.admission.close()
+        super().stop()
+        self._busy_replies.shutdown(wait=True)
@@ -0,0 +1,207 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class TTLValueCache:
+    """
+    In-process cache for a single value loaded from an upstream source.
+
+    Fresh values are served from memory. Once the TTL has passed the stale value keeps
+    being served while a background thread refreshes it (stale-while-revalidate).
+    When nothing is cached yet, concurrent callers share a single in-flight fetch.
+    If a refresh fails, the last good value is kept and the refresh is retried after error_ttl.
+    """
+
+    def __init__(self, loader, ttl: float, error_ttl: float = None, name: str = "cache"):
+        """
+        Args:
+            loader: callable without arguments that fetches the value from upstream.
+            ttl: seconds a loaded value is considered fresh.
+            error_ttl: seconds to wait before retrying after a failed refresh. Default: ttl
+            name: name used in logs and stats.
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.error_ttl = ttl if error_ttl is None else error_ttl
+        self.name = name
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._value = None
+        self._has_value = False
+        self._expires_at = 0.0
+        self._inflight = None  # threading.Event of the running fetch, if any
+        self._last_error = None
+
+    def get(self):
+        """
+        Get the cached value, loading it from upstream when there is none yet.
+        Raises the loader's exception if the value could not be loaded and nothing is cached.
+        """
+        with self._lock:
+            if self._has_value:
+                self.hits += 1
+                if time.monotonic() >= self._expires_at and self._inflight is None:
+                    self._inflight = threading.Event()
+                    threading.Thread(target=self._refresh, name=f"{self.name}-refresh", daemon=True).start()
+                return self._value
+
+            self.misses += 1
+            inflight = self._inflight
+            is_owner = inflight is None
+            if is_owner:
+                inflight = self._inflight = threading.Event()
+
+        if is_owner:
+            self._refresh()
+        else:
+            inflight.wait()
+
+        with self._lock:
+            if self._has_value:
+                return self._value
+            raise self._last_error
+
+    def invalidate(self) -> None:
+        """
+        Mark the cached value as expired, so the next get() refreshes it.
+        """
+        with self._lock:
+            self._expires_at = 0.0
+
+    def stats(self) -> dict:
+        """
+        Return: dict with the hit/miss counters of the cache.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def _refresh(self) -> None:
+        """
+        Load the value from upstream and wake up every caller waiting for it.
+        """
+        try:
+            value = self.loader()
+        except Exception as error:
+            logger.warning("Failed to refresh %s: %r", self.name, error)
+            with self._lock:
+                self._last_error = error
+                self._expires_at = time.monotonic() + self.error_ttl
+                inflight, self._inflight = self._inflight, None
+        else:
+            with self._lock:
+                self._value = value
+                self._has_value = True
+                self._last_error = None
+                self._expires_at = time.monotonic() + self.ttl
+                inflight, self._inflight = self._inflight, None
+
+        inflight.set()
+
+
+class SingleFlightCache:
+    """
+    In-process cache of values keyed by a query, with a short TTL.
+
+    Concurrent gets of a key that is not cached share a single call of the loader (single flight),
+    so a burst of identical queries makes one upstream call. Values are kept for ttl seconds,
+    and the least recently used ones are evicted beyond max_size. Failures are not cached:
+    when a load fails, the expired value of the key is served instead, if it expired less than stale_ttl ago.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 1000, name: str = "cache", stale_ttl: float = 0):
+        """
+        Args:
+            ttl: seconds a loaded value is reused.
+            max_size: maximum number of values kept.
+            name: name used in logs and stats.
+            stale_ttl: seconds after its expiry a value is still served when its load fails. Default: 0 (never)
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.name = name
+        self.stale_ttl = stale_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> Future of the running load
+
+    def get(self, key, loader):
+        """
+        Get the value of a key, loading it with loader() unless it is cached or already being loaded.
+        Raises the loader's exception to every caller that waited for the failed load, unless a stale value is served.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+
+            inflight = self._inflight.get(key)
+            is_owner = inflight is None
+            if is_owner:
+                self.misses += 1
+                inflight = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not is_owner:
+            return inflight.result()
+
+        try:
+            value = loader()
+        except BaseException as error:
+            with self._lock:
+                del self._inflight[key]
+                entry = self._entries.get(key)
+                is_stale = isinstance(error, Exception) and entry is not None and entry[0] + self.stale_ttl > time.monotonic()
+                if is_stale:
+                    self.stale += 1
+            if is_stale:
+                inflight.set_result(entry[1])
+                return entry[1]
+            inflight.set_exception(error)
+            raise
+
+        with self._lock:
+            del self._inflight[key]
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        inflight.set_result(value)
+        return value
+
+    def stats(self) -> dict:
+        """
+        Return: dict with the hit/miss/coalesced/stale counters and the size of the cache.
+        Coalesced gets waited for a load started by another caller, stale gets were served an expired value.
+        """
+        with self._lock:
+            total = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_ratio": (self.hits + self.coalesced) / total if total else 0.0,
+                "stale": self.stale,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,203 @@
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+
+from config.settings import Settings
+from src.services.concurrency_service import UpstreamBusyError
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling an upstream API whose circuit is open.
+    """
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Tell whether an error of an upstream call means the upstream is failing: a 5xx response,
+    a timeout or a connection error. Rejected requests (4xx) and a full limiter (UpstreamBusyError) do not.
+    """
+    if isinstance(error, requests.HTTPError):
+        return error.response is None or error.response.status_code >= 500
+    failures = (
+        requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError, TimeoutError, ConnectionError
+    )
+    gmaps = sys.modules.get('googlemaps.exceptions')
+    if gmaps is not None:
+        if isinstance(error, gmaps.HTTPError):
+            return error.status_code >= 500
+        failures += (gmaps.Timeout, gmaps.TransportError)
+    return isinstance(error, failures)
+
+
+def upstream_errors() -> tuple:
+    """
+    Errors of the upstream calls that the handlers answer with a "try again later" message.
+    The googlemaps ones are only there once the client is loaded (see GoogleAPI), so it is not imported before.
+    Return: tuple of exception types, for an except clause
+    """
+    errors = (CircuitOpenError, UpstreamBusyError, requests.RequestException)
+    gmaps = sys.modules.get('googlemaps.exceptions')
+    if gmaps is not None:
+        errors += (gmaps.ApiError, gmaps.HTTPError, gmaps.Timeout, gmaps.TransportError)
+    return errors
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of an upstream API. Each call is made in a `with breaker.guard():` block.
+
+    Calls are counted in a rolling window of `window` seconds. Once the window holds min_calls calls,
+    and error_rate of them failed (see is_upstream_failure) or slow_call_rate of them took longer than slow_call_seconds,
+    the circuit opens: calls fail fast with CircuitOpenError for open_seconds. Then a single probe call
+    is let through (half-open), which closes the circuit if it succeeds and opens it again otherwise.
+    """
+
+    CLOSED = 'closed'
+    HALF_OPEN = 'half_open'
+    OPEN = 'open'
+
+    def __init__(self, name: str, window: float = 30, min_calls: int = 10, error_rate: float = 0.5,
+        slow_call_seconds: float = 3, slow_call_rate: float = 0.8, open_seconds: float = 15):
+        """
+        Args:
+            name: name of the upstream, used in logs, errors and metrics.
+            window: seconds of calls the error and slow call rates are computed on.
+            min_calls: calls needed in the window before the circuit can open.
+            error_rate: share of failed calls that opens the circuit.
+            slow_call_seconds: duration above which a call counts as slow.
+            slow_call_rate: share of slow calls that opens the circuit.
+            open_seconds: seconds calls fail fast before a probe call is let through.
+        """
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+
+        self.state = self.CLOSED
+        self.rejected = 0
+
+        self._lock = threading.Lock()
+        self._buckets = deque()  # [second, calls, failures, slow calls], oldest first
+        self._opened_at = 0.0
+        self._probing = False
+
+    @classmethod
+    def from_settings(cls, name: str, settings: Settings) -> "CircuitBreaker":
+        """
+        Creates a circuit breaker configured by the CIRCUIT_* settings.
+        """
+        return cls(
+            name,
+            window=settings.circuit_window,
+            min_calls=settings.circuit_min_calls,
+            error_rate=settings.circuit_error_rate,
+            slow_call_seconds=settings.circuit_slow_call_seconds,
+            slow_call_rate=settings.circuit_slow_call_rate,
+            open_seconds=settings.circuit_open_seconds
+        )
+
+    @contextmanager
+    def guard(self):
+        """
+        Make an upstream call in the with block, unless the circuit is open.
+        Upstream failures raised in the block count as failures (see is_upstream_failure); other exceptions,
+        and leaving the block early (GeneratorExit), count as successful calls.
+        Raises CircuitOpenError when the call is not allowed.
+        """
+        is_probe = self._allow()
+        started_at = time.monotonic()
+        failed = False
+        try:
+            yield
+        except Exception as error:
+            failed = is_upstream_failure(error)
+            raise
+        finally:
+            self._record(is_probe, failed, time.monotonic() - started_at)
+
+    def stats(self) -> dict:
+        """
+        Return: dict with the state, the calls, failures and slow calls in the window, and the rejected calls.
+        """
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                "state": self.state,
+                "calls": sum(bucket[1] for bucket in self._buckets),
+                "failures": sum(bucket[2] for bucket in self._buckets),
+                "slow": sum(bucket[3] for bucket in self._buckets),
+                "rejected": self.rejected,
+            }
+
+    def _allow(self) -> bool:
+        """
+        Return: True if the call is the probe of a half-open circuit.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                logger.info("Circuit of %s is half-open, probing", self.name)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+
+        raise CircuitOpenError(f"{self.name} is unavailable, its circuit is open")
+
+    def _record(self, is_probe: bool, failed: bool, seconds: float) -> None:
+        now = time.monotonic()
+        slow = seconds > self.slow_call_seconds
+        with self._lock:
+            if is_probe:
+                self._probing = False
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self.state = self.CLOSED
+                    self._buckets.clear()
+                    logger.info("Circuit of %s is closed again", self.name)
+                return
+
+            second = int(now)
+            if self._buckets and self._buckets[-1][0] == second:
+                bucket = self._buckets[-1]
+            else:
+                bucket = [second, 0, 0, 0]
+                self._buckets.append(bucket)
+            bucket[1] += 1
+            bucket[2] += failed
+            bucket[3] += slow
+
+            if self.state != self.CLOSED:
+                return
+            self._trim(now)
+            calls = sum(bucket[1] for bucket in self._buckets)
+            if calls < self.min_calls:
+                return
+            failures = sum(bucket[2] for bucket in self._buckets)
+            slow_calls = sum(bucket[3] for bucket in self._buckets)
+            if failures >= self.error_rate * calls or slow_calls >= self.slow_call_rate * calls:
+                self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = self.OPEN
+        self._opened_at = now
+        self._buckets.clear()
+        logger.warning("Circuit of %s is open for %ss", self.name, self.open_seconds)
+
+    def _trim(self, now: float) -> None:
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamBusyError(RuntimeError):
+    """
+    Raised when an upstream API has no free concurrency slot within the acquire timeout.
+    """
+
+
+class UpstreamLimiter:
+    """
+    Bounds the number of concurrent calls to an upstream API.
+    Used as a context manager around each call; waits at most acquire_timeout for a slot.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, acquire_timeout: float = None):
+        """
+        Args:
+            name: name of the upstream, used in errors.
+            max_concurrency: maximum number of calls in flight at once.
+            acquire_timeout: seconds to wait for a free slot. Default: None (wait forever)
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def acquire(self) -> None:
+        """
+        Take a slot, for a call that does not end with a with block. Raises UpstreamBusyError.
+        """
+        if not self._semaphore.acquire(timeout=self.acquire_timeout):
+            raise UpstreamBusyError(f"{self.name} has {self.max_concurrency} calls in flight already")
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class Debouncer:
+    """
+    Runs only the last call of a burst per key: a call runs after `delay` seconds, unless a newer call
+    with the same key arrives meanwhile and replaces it. One scheduler thread waits for every pending call,
+    and hands each due call to the runner it was submitted with (like Dispatcher.run_async).
+    """
+
+    def __init__(self, delay: float):
+        """
+        Args:
+            delay: seconds a call waits for a newer one. 0 runs every call at once, in the calling thread.
+        """
+        self.delay = delay
+        self.dropped = 0
+        self._condition = threading.Condition()
+        self._pending = {}  # key -> (due time, callback, args, runner) of the pending call
+        self._due = deque()  # (due time, key) of the calls, in due order: they all wait the same delay
+        self._thread = None
+
+    def submit(self, key, callback, *args, runner=None) -> None:
+        """
+        Schedule callback(*args), replacing the pending call of the key.
+        Args:
+            runner: callable(callback, *args) running the call once it is due, like Dispatcher.run_async.
+                Default: None (run it on the scheduler thread, it must be quick)
+        """
+        if self.delay <= 0:
+            self._run(callback, args, None)
+            return
+
+        due = time.monotonic() + self.delay
+        with self._condition:
+            if key in self._pending:
+                self.dropped += 1
+            self._pending[key] = (due, callback, args, runner)
+            self._due.append((due, key))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._schedule, name='debouncer', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _schedule(self) -> None:
+        """
+        Scheduler loop: runs the calls as they are due, skipping the replaced ones.
+        """
+        while True:
+            with self._condition:
+                call = None
+                while call is None:
+                    if not self._due:
+                        self._condition.wait()
+                        continue
+                    due, key = self._due[0]
+                    wait = due - time.monotonic()
+                    if wait > 0:
+                        self._condition.wait(wait)
+                        continue
+                    self._due.popleft()
+                    pending = self._pending.get(key)
+                    # Else replaced by a newer call, due later
+                    if pending is not None and pending[0] == due:
+                        call = self._pending.pop(key)
+
+            _, callback, args, runner = call
+            self._run(callback, args, runner)
+
+    @staticmethod
+    def _run(callback, args, runner) -> None:
+        try:
+            if runner is None:
+                callback(*args)
+            else:
+                runner(callback, *args)
+        except Exception as error:
+            logger.warning("Debounced call failed: %r", error)
@@ -0,0 +1,61 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LazyService:
+    """
+    Class attribute built by a factory on first access, then stored on the class in place of this descriptor,
+    so later accesses are plain attribute reads. Used for the settings and clients of the service classes,
+    so importing them does no parsing, file or network setup.
+    """
+
+    def __init__(self, factory):
+        """
+        Args:
+            factory: callable with no arguments returning the attribute value.
+        """
+        self.factory = factory
+        self._lock = threading.RLock()
+
+    def __set_name__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        with self._lock:
+            # Another thread may have built it while this one waited
+            value = self.owner.__dict__.get(self.name, self)
+            if value is not self:
+                return value
+
+            started_at = time.perf_counter()
+            value = self.factory()
+            ServiceContainer.record(f'{self.owner.__name__}.{self.name}', time.perf_counter() - started_at)
+            setattr(self.owner, self.name, value)
+            return value
+
+
+class ServiceContainer:
+    """
+    Registry of the lazily built services: records what was built, and how long it took, for the startup report.
+    """
+
+    _lock = threading.Lock()
+    _built = {}  # "Class.attribute" -> seconds spent building it
+
+    @staticmethod
+    def record(name: str, seconds: float) -> None:
+        with ServiceContainer._lock:
+            ServiceContainer._built[name] = seconds
+        logger.debug("Built %s in %.1fms", name, seconds * 1000)
+
+    @staticmethod
+    def built() -> dict:
+        """
+        Return: dict of the services built so far, with the seconds their construction took, in build order.
+        """
+        with ServiceContainer._lock:
+            return dict(ServiceContainer._built)
@@ -0,0 +1,297 @@
+import bisect
+import logging
+import mmap
+import os
+import struct
+import threading
+from typing import NamedTuple
+
+from config.settings import Settings, get_settings
+from src.services.container_service import LazyService
+from src.services.geocode_cache_service import GeocodeCache
+from src.services.logging_service import LoggingService
+from src.services.metrics_service import MetricsService
+
+logger = logging.getLogger(__name__)
+sampled_logger = LoggingService.get_sampled_logger(__name__)
+
+# Kinds of places, stored as their index
+PLACE_KINDS = ('city', 'region', 'border_crossing', 'country')
+
+MAGIC = b'GZT1'
+# magic, number of records, offset of the strings
+HEADER = struct.Struct('<4sII')
+# key offset, key length, kind, latitude, longitude, name offset, name length, weight: records are sorted by key
+RECORD = struct.Struct('<IHBxffIHxxI')
+
+
+class Place(NamedTuple):
+    """
+    A place of the gazetteer.
+    name: the name it is looked up by, like "Lviv"; names are matched normalized, see GeocodeCache.normalize
+    display: the address shown for it, like "Lviv, Lviv Oblast, Ukraine"
+    weight: ranks places sharing a prefix, like the population
+    """
+    name: str
+    kind: str
+    latitude: float
+    longitude: float
+    display: str
+    weight: int = 0
+
+
+def bounded_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Edit distance of two strings (insertions, deletions, substitutions and swaps of adjacent letters),
+    giving up as soon as it exceeds max_distance.
+    Return: the distance, or max_distance + 1 if it is larger
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    before, previous = None, list(range(len(b) + 1))
+    for i, char in enumerate(a, start=1):
+        current = [i]
+        for j, other in enumerate(b, start=1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other))
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == other:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > max_distance:
+            return max_distance + 1
+        before, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class Gazetteer:
+    """
+    Offline lookup of place names (cities, regions, border crossings and countries), from a file built by
+    src.jobs.build_gazetteer. The file is memory-mapped: the sorted records are binary searched in place,
+    so it is shared by the worker processes and costs no parsing at start.
+    Names match exactly, by a unique prefix, or with a typo or two.
+    """
+
+    def __init__(self, path: str, min_prefix: int = 4):
+        """
+        Args:
+            path: the gazetteer file.
+            min_prefix: shortest typed name matched by prefix or with typos.
+        """
+        self.path = path
+        self.min_prefix = min_prefix
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self._strings = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a gazetteer file")
+
+        self._keys = _Keys(self)
+
+    @classmethod
+    def from_settings(cls, settings: Settings):
+        """
+        Opens the gazetteer file of the GAZETTEER_PATH setting.
+        Return: the Gazetteer, or None if there is none
+        """
+        if not settings.gazetteer_path:
+            return None
+        if not os.path.exists(settings.gazetteer_path):
+            logger.warning("Gazetteer %s not found, addresses are geocoded by Google only", settings.gazetteer_path)
+            return None
+        return cls(settings.gazetteer_path, settings.gazetteer_min_prefix)
+
+    @staticmethod
+    def write(path: str, places) -> int:
+        """
+        Write a gazetteer file. Places normalized to the same name keep the one of the largest weight.
+        Args:
+            path: the file to write, replaced atomically.
+            places: iterable of Place.
+        Return: number of names written
+        """
+        by_key = {}
+        for place in places:
+            key = GeocodeCache.normalize(place.name)
+            if key and (key not in by_key or place.weight > by_key[key].weight):
+                by_key[key] = place
+
+        strings = bytearray()
+        records = bytearray()
+        for key in sorted(by_key):
+            place = by_key[key]
+            encoded_key, encoded_display = key.encode(), place.display.encode()
+            records += RECORD.pack(
+                len(strings), len(encoded_key), PLACE_KINDS.index(place.kind), place.latitude, place.longitude,
+                len(strings) + len(encoded_key), len(encoded_display), place.weight
+            )
+            strings += encoded_key + encoded_display
+
+        strings_offset = HEADER.size + len(records)
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, len(by_key), strings_offset))
+            file.write(records)
+            file.write(strings)
+        os.replace(temporary_path, path)
+        return len(by_key)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def key(self, index: int) -> str:
+        key_offset, key_length = RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)[:2]
+        start = self._strings + key_offset
+        return self._map[start:start + key_length].decode()
+
+    def place(self, index: int) -> Place:
+        key_offset, key_length, kind, latitude, longitude, name_offset, name_length, weight = RECORD.unpack_from(
+            self._map, HEADER.size + index * RECORD.size
+        )
+        start = self._strings + name_offset
+        # Coordinates are stored as float32, precise to about a meter
+        return Place(
+            self.key(index), PLACE_KINDS[kind], round(latitude, 5), round(longitude, 5),
+            self._map[start:start + name_length].decode(), weight
+        )
+
+    def prefix_range(self, prefix: str) -> range:
+        """
+        Return: range of the indexes of the names starting with prefix
+        """
+        start = bisect.bisect_left(self._keys, prefix)
+        return range(start, bisect.bisect_left(self._keys, prefix + '\U0010ffff', lo=start))
+
+    def find(self, name: str) -> tuple:
+        """
+        Find a place by its normalized name: exact match, else the heaviest name it is a prefix of,
+        else the closest name within one typo (two for names of 8 characters or more).
+        Return: (Place, match kind: "exact", "prefix" or "fuzzy"), or (None, "miss")
+        """
+        candidates = self.prefix_range(name)
+        if candidates and self.key(candidates.start) == name:
+            return self.place(candidates.start), 'exact'
+        if len(name) < self.min_prefix:
+            return None, 'miss'
+        if candidates:
+            return max((self.place(index) for index in candidates), key=lambda place: place.weight), 'prefix'
+
+        # Typos are looked for among the names sharing the first two letters, or with them swapped or the second missing
+        max_distance = 1 if len(name) < 8 else 2
+        best, best_distance = None, max_distance + 1
+        # Names that short are only looked for with a gazetteer_min_prefix below 3
+        prefixes = {name[:2]}
+        if len(name) > 1:
+            prefixes.add(name[1] + name[0])
+        if len(name) > 2:
+            prefixes.add(name[0] + name[2])
+        for prefix in prefixes:
+            for index in self.prefix_range(prefix):
+                distance = bounded_distance(name, self.key(index), max_distance)
+                if distance > max_distance:
+                    continue
+                place = self.place(index)
+                if distance < best_distance or (distance == best_distance and place.weight > best.weight):
+                    best, best_distance = place, distance
+        return (best, 'fuzzy') if best is not None else (None, 'miss')
+
+    def lookup(self, address: str):
+        """
+        Resolve an address naming a place, like "Lviv" or "Lviv, Ukraine". Street addresses (with digits)
+        are left to the Google API. An address of several parts resolves to its first part, when the other
+        parts name places too (its region or country).
+        Return: (geocode result as returned by GeocodeService.get_geocode, match kind), or (None, "miss")
+        """
+        result, match = None, 'miss'
+        if not any(char.isdigit() for char in address):
+            result, match = self._resolve(address)
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        MetricsService.gazetteer_lookups.inc(match=match)
+        return result, match
+
+    def _resolve(self, address: str) -> tuple:
+        place, match = self.find(GeocodeCache.normalize(address))
+        if place is None:
+            parts = [GeocodeCache.normalize(part) for part in address.split(',')]
+            parts = [part for part in parts if part]
+            if len(parts) > 1 and all(self.find(part)[0] is not None for part in parts[1:]):
+                place, match = self.find(parts[0])
+
+        if place is None:
+            return None, 'miss'
+        return [place.display, {"lat": place.latitude, "lng": place.longitude}], match
+
+    def stats(self) -> dict:
+        """
+        Return: dict with the hit/miss counters of the lookups and the number of names.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size": self._count,
+            }
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class _Keys:
+    """
+    Sequence view of the sorted keys of a gazetteer, for bisect.
+    """
+
+    def __init__(self, gazetteer: Gazetteer):
+        self.gazetteer = gazetteer
+
+    def __len__(self) -> int:
+        return len(self.gazetteer)
+
+    def __getitem__(self, index: int) -> str:
+        return self.gazetteer.key(index)
+
+
+class GazetteerService:
+    """
+    Service resolving typed addresses with the offline gazetteer, when GAZETTEER_PATH is set.
+    """
+
+    settings = LazyService(get_settings)
+
+    # Gazetteer, or None when it is disabled
+    gazetteer = LazyService(lambda: GazetteerService._register(Gazetteer.from_settings(GazetteerService.settings)))
+
+    @staticmethod
+    def _register(gazetteer):
+        if gazetteer is not None:
+            MetricsService.register_cache('gazetteer', gazetteer)
+            logger.info("Gazetteer %s loaded with %s names", gazetteer.path, len(gazetteer))
+        return gazetteer
+
+    @staticmethod
+    def lookup(address: str):
+        """
+        Resolve an address with the offline gazetteer.
+        Return: [formatted address, {"lat": ..., "lng": ...}], or None if it has to be geocoded by the Google API
+        """
+        gazetteer = GazetteerService.gazetteer
+        if gazetteer is None:
+            return None
+
+        result, match = gazetteer.lookup(address)
+        if result is None:
+            sampled_logger.debug("Gazetteer miss, address left to Google")
+        else:
+            sampled_logger.debug("Gazetteer %s match", match)
+        return result
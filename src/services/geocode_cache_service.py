@@ -0,0 +1,187 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from config.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+class GeocodeCache:
+    """
+    Cache of geocoding results keyed by the normalized address.
+    Keeps an LRU in memory and, when a path is given, persists entries to SQLite so they survive restarts.
+    With a shared cache (see SharedStoreService), the bot replicas share their results.
+    Addresses that could not be recognised (empty results) are cached with a shorter TTL.
+    Expired rows are deleted from SQLite on open, then by the first write of every purge_interval.
+    """
+
+    punctuation = re.compile(r'[^\w\s]+')
+    whitespace = re.compile(r'\s+')
+
+    def __init__(self, max_size: int = 10000, ttl: float = 604800, negative_ttl: float = 3600, path: str = "", shared=None,
+        purge_interval: float = 3600):
+        """
+        Args:
+            max_size: maximum number of addresses kept in memory.
+            ttl: seconds a recognised address is cached.
+            negative_ttl: seconds an unrecognised address is cached.
+            path: SQLite file to persist the cache to. Default: "" (memory only)
+            shared: SharedCache looked up on a miss, and written to. Default: None
+            purge_interval: seconds between two deletes of the expired SQLite rows.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.shared = shared
+        self.purge_interval = purge_interval
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._db = None
+        self._purged_at = 0.0
+
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, result TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._db.commit()
+            self.purge()
+
+    @classmethod
+    def from_settings(cls, settings: Settings, shared=None) -> "GeocodeCache":
+        """
+        Creates a cache configured by the GEOCODE_CACHE_* settings.
+        """
+        return cls(
+            max_size=settings.geocode_cache_size,
+            ttl=settings.geocode_cache_ttl,
+            negative_ttl=settings.geocode_cache_negative_ttl,
+            path=settings.geocode_cache_path,
+            shared=shared,
+            purge_interval=settings.geocode_cache_purge_interval
+        )
+
+    @classmethod
+    def normalize(cls, address: str) -> str:
+        """
+        Normalize an address so trivially different spellings share a cache entry:
+        unicode form, case, punctuation and whitespace are ignored.
+        """
+        address = unicodedata.normalize('NFKC', address).casefold()
+        address = cls.punctuation.sub(' ', address)
+        return cls.whitespace.sub(' ', address).strip()
+
+    def get(self, address: str):
+        """
+        Get the cached geocode result of an address.
+        Return: the cached result ([] for an unrecognised address), or None on a cache miss.
+        """
+        key = self.normalize(address)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    'SELECT result, expires_at FROM geocode WHERE key = ? AND expires_at > ?', (key, now)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[1], json.loads(row[0]))
+                    self._put(key, entry)
+
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        result = self.shared.get(key) if self.shared is not None else None
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._put(key, (now + (self.ttl if result else self.negative_ttl), result))
+            return result
+
+    def set(self, address: str, result: list) -> None:
+        """
+        Cache the geocode result of an address.
+        Args:
+            address: the address as typed by the user.
+            result: the geocode result, [] if the address was not recognised.
+        """
+        key = self.normalize(address)
+        now = time.time()
+        expires_at = now + (self.ttl if result else self.negative_ttl)
+
+        with self._lock:
+            self._put(key, (expires_at, result))
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO geocode (key, result, expires_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(result), expires_at)
+                )
+                self._db.commit()
+                if now - self._purged_at >= self.purge_interval:
+                    self._purge(now)
+
+        if self.shared is not None:
+            self.shared.set(key, result, self.ttl if result else self.negative_ttl)
+
+    def purge(self) -> int:
+        """
+        Delete the expired rows from SQLite.
+        Return: the number of rows deleted
+        """
+        if self._db is None:
+            return 0
+        with self._lock:
+            return self._purge(time.time())
+
+    def _purge(self, now: float) -> int:
+        """
+        Delete the rows expired at `now`. Call with the lock held.
+        """
+        deleted = self._db.execute('DELETE FROM geocode WHERE expires_at < ?', (now,)).rowcount
+        self._db.commit()
+        self._purged_at = now
+        if deleted:
+            logger.info("Deleted %s expired geocode cache entries", deleted)
+        return deleted
+
+    def stats(self) -> dict:
+        """
+        Return: dict with the hit/miss counters and the size of the cache.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
+
+    def _put(self, key: str, entry: tuple) -> None:
+        """
+        Insert an entry in the in-memory LRU, evicting the least recently used ones. Call with the lock held.
+        """
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
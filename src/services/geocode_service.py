@@ -0,0 +1,69 @@
+import logging
+
+from config.settings import get_settings
+from src.services.circuit_breaker_service import CircuitBreaker
+from src.services.concurrency_service import UpstreamLimiter
+from src.services.container_service import LazyService
+from src.services.gazetteer_service import GazetteerService
+from src.services.geocode_cache_service import GeocodeCache
+from src.services.google_api_service import GoogleAPI
+from src.services.logging_service import LoggingService
+from src.services.metrics_service import MetricsService
+from src.services.shared_store_service import SharedStoreService
+
+logger = logging.getLogger(__name__)
+sampled_logger = LoggingService.get_sampled_logger(__name__)
+
+
+class GeocodeService:
+    """
+    Service for geocoding addresses with the Google Geocoding API.
+    The client, cache, limiter and circuit breaker are built on first use, see LazyService.
+    """
+
+    settings = LazyService(get_settings)
+
+    # googlemaps.Client
+    gmaps = LazyService(lambda: GoogleAPI().api)
+    cache = LazyService(lambda: MetricsService.register_cache(
+        'geocode', GeocodeCache.from_settings(GeocodeService.settings, shared=SharedStoreService.get_cache('geocode'))
+    ))
+    limiter = LazyService(lambda: UpstreamLimiter(
+        "google_geocode",
+        GeocodeService.settings.geocode_max_concurrency,
+        GeocodeService.settings.upstream_acquire_timeout
+    ))
+    breaker = LazyService(lambda: MetricsService.register_circuit(
+        'google_geocode', CircuitBreaker.from_settings("google_geocode", GeocodeService.settings)
+    ))
+
+    @staticmethod
+    def get_geocode(address: str) -> list:
+        """
+        Gets a geocode from the Google API based on address.
+        Place names found in the offline gazetteer are resolved locally, see GazetteerService.
+        Cached addresses are still served while the API is unavailable, others raise CircuitOpenError.
+        Return: [formatted address, {"lat": ..., "lng": ...}], or [] if the address was not recognised
+        """
+        cached = GeocodeService.cache.get(address)
+        if cached is not None:
+            sampled_logger.debug("Geocode cache hit", recognised=cached != [])
+            return cached
+
+        local = GazetteerService.lookup(address)
+        if local is not None:
+            return local
+
+        with GeocodeService.breaker.guard(), GeocodeService.limiter, MetricsService.time_upstream('geocode'):
+            geocode = GeocodeService.gmaps.geocode(address)
+        if geocode == []:
+            sampled_logger.debug("Geocode did not recognise address")
+            result = []
+        else:
+            returned_address = geocode[0]["formatted_address"]
+            location = geocode[0]["geometry"]["location"]
+            sampled_logger.debug("Geocode recognised address", address=returned_address, location=location)
+            result = [returned_address, location]
+
+        GeocodeService.cache.set(address, result)
+        return result
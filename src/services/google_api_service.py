@@ -1,21 +1,23 @@
 import logging
-import os
+from functools import cached_property
 
-from googlemaps import Client
-
-from config.settings import Settings
+from config.settings import get_settings
+from src.services.container_service import LazyService
 
 logger = logging.getLogger(__name__)
 
 
 class GoogleAPI:
-    """service for Google API"""
-    
-    settings = Settings(_env_file="config/.env")
+    """service for Google API, its client is created on first use"""
+
+    settings = LazyService(get_settings)
+
 
+    @cached_property
+    def api(self):
+        """googlemaps.Client of the GOOGLE_API_KEY"""
+        from googlemaps import Client
 
-    def __init__(self):
-        
-        api_key = self.settings.google_api_key
-        self.api = Client(api_key)
-        logger.info(f"Connected to Google API")
\ No newline at end of file
+        api = Client(self.settings.google_api_key)
+        logger.info("Connected to Google API")
+        return api
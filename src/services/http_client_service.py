@@ -0,0 +1,129 @@
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.settings import Settings
+from src.services.concurrency_service import UpstreamLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClient:
+    """
+    Shared HTTP client for upstream APIs.
+    Keeps a pool of keep-alive connections per host, applies connect/read timeouts
+    and retries 5xx responses and connection errors with jittered exponential backoff.
+    The number of requests in flight is bounded by max_concurrency: a streamed response holds its slot until it is closed.
+    """
+
+    retry_statuses = frozenset({500, 502, 503, 504})
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = 16, connect_timeout: float = 3.05,
+        read_timeout: float = 10, max_retries: int = 2, backoff_factor: float = 0.2, backoff_max: float = 2,
+        max_concurrency: int = 16, acquire_timeout: float = None):
+        """
+        Args:
+            pool_connections: number of hosts to keep connection pools for.
+            pool_maxsize: maximum number of keep-alive connections per host.
+            connect_timeout: seconds to wait for a connection to be established.
+            read_timeout: seconds to wait for the server to send data.
+            max_retries: number of retries after the first attempt.
+            backoff_factor: base delay of the exponential backoff, in seconds.
+            backoff_max: upper bound of a single backoff delay, in seconds.
+            max_concurrency: maximum number of requests in flight at once.
+            acquire_timeout: seconds to wait for a free request slot. Default: None (wait forever)
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.limiter = UpstreamLimiter("http", max_concurrency, acquire_timeout)
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # requests transparently decompresses gzip/deflate bodies
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "HttpClient":
+        """
+        Creates a client configured by the HTTP_* settings.
+        """
+        return cls(
+            pool_connections=settings.http_pool_connections,
+            pool_maxsize=settings.http_pool_maxsize,
+            connect_timeout=settings.http_connect_timeout,
+            read_timeout=settings.http_read_timeout,
+            max_retries=settings.http_max_retries,
+            backoff_factor=settings.http_backoff_factor,
+            backoff_max=settings.http_backoff_max,
+            max_concurrency=settings.safe_refuge_max_concurrency,
+            acquire_timeout=settings.upstream_acquire_timeout
+        )
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        Send a GET request through the pooled session.
+        Args:
+            url: url address.
+            kwargs: extra arguments for requests.Session.get.
+        Returns:
+            requests.Response: the last response received. A streamed one (stream=True) must be closed.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            try:
+                response = self._send(url, **kwargs)
+            except requests.ConnectionError as error:
+                if is_last_attempt:
+                    raise
+                # The query string carries the user's location, and the error repeats it
+                logger.warning("Connection error on %s, retrying: %s", urlsplit(url).path, type(error).__name__)
+            else:
+                if response.status_code not in self.retry_statuses or is_last_attempt:
+                    return response
+                logger.warning("Got %s from %s, retrying", response.status_code, urlsplit(url).path)
+                response.close()
+
+            time.sleep(self.backoff_delay(attempt))
+
+    def _send(self, url: str, **kwargs) -> requests.Response:
+        """
+        Send a GET request in a request slot, held until the body is read: until the response is closed when streamed.
+        """
+        self.limiter.acquire()
+        try:
+            response = self.session.get(url, **kwargs)
+        except BaseException:
+            self.limiter.release()
+            raise
+        if not kwargs.get("stream"):
+            self.limiter.release()
+            return response
+
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                # Only the first close releases the slot: it removes this method from the response
+                if response.__dict__.pop("close", None) is not None:
+                    self.limiter.release()
+
+        response.close = close_and_release
+        return response
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        Full-jitter backoff: a random delay between 0 and the exponential backoff of the attempt.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt))
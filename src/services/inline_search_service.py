@@ -0,0 +1,110 @@
+import logging
+import re
+
+from config.settings import get_settings
+from src.safe_refuge_api_calls.geocode import get_geocode
+from src.services.cache_service import SingleFlightCache
+from src.services.concurrency_service import Debouncer
+from src.services.container_service import LazyService
+from src.services.logging_service import LoggingService
+from src.services.metrics_service import MetricsService
+from src.services.poi_index_service import PoiIndexService
+from src.services.results_service import ResultsService
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+
+logger = logging.getLogger(__name__)
+sampled_logger = LoggingService.get_sampled_logger(__name__)
+
+
+class InlineSearchService:
+    """
+    Service for inline mode searches, like: "@bot shelter near Lviv".
+    Answers are cached per query text and location (see INLINE_*), and shared by every user
+    when the query names the address.
+    """
+
+    settings = LazyService(get_settings)
+
+    results_cache = LazyService(lambda: MetricsService.register_cache('inline', SingleFlightCache(
+        ttl=InlineSearchService.settings.inline_results_cache_ttl,
+        max_size=InlineSearchService.settings.inline_results_cache_size,
+        name="inline_cache"
+    )))
+
+    # Telegram sends an inline query on every keystroke, only the last one of a user is answered
+    debouncer = LazyService(lambda: Debouncer(InlineSearchService.settings.inline_debounce_seconds))
+
+    near_pattern = re.compile(r'\s+near\s+|^near\s+', re.IGNORECASE)
+
+    @staticmethod
+    def parse_query(text: str, categories) -> tuple:
+        """
+        Split an inline query in the categories it names and the address it is near.
+        Words are matched to the categories by prefix, like "shel" for Shelter. The address is the text
+        after "near", or else the words that are not categories.
+        Return: (list of categories, all of them if none is named; address or None)
+        """
+        parts = InlineSearchService.near_pattern.split(text.strip(), maxsplit=1)
+        words = [word for word in re.split(r'[\s,]+', parts[0]) if word]
+
+        named, other_words = [], []
+        for word in words:
+            matches = [
+                category for category in categories
+                if any(part.startswith(word.lower()) for part in category.lower().split())
+            ] if len(word) >= 3 else []
+            if matches:
+                named.extend(category for category in matches if category not in named)
+            else:
+                other_words.append(word)
+
+        address = parts[1].strip() if len(parts) > 1 else " ".join(other_words)
+        return named or list(categories), address or None
+
+    @staticmethod
+    def get_results_key(text: str, address: str, latitude: float, longitude: float) -> tuple:
+        """
+        Cache key of an inline query: its normalized text, and the user's location snapped to the
+        search cache grid unless the query names an address.
+        """
+        text = " ".join(text.lower().split())
+        if address is not None:
+            return text, None, None
+
+        latitude, longitude = SafeRefugeApiService.get_search_key(latitude, longitude)[:2]
+        return text, latitude, longitude
+
+    @staticmethod
+    def search(text: str, latitude: float = None, longitude: float = None) -> tuple:
+        """
+        Answers of an inline query, through the results cache.
+        Args:
+            text: the query text.
+            latitude, longitude: location of the user, if they share it with inline bots.
+        Return: (tuple of InlineQueryResultVenue, None if there is no location to search around;
+                 True if the answers depend on the user's location)
+        """
+        categories, address = InlineSearchService.parse_query(text, SafeRefugeApiService.get_category_list())
+        if address is None and latitude is None:
+            return None, False
+
+        def load():
+            search_latitude, search_longitude = latitude, longitude
+            if address is not None:
+                geocode = get_geocode(address)
+                if geocode == []:
+                    sampled_logger.debug("Inline query address was not recognised", address=address)
+                    return ()
+                search_latitude, search_longitude = geocode[1]["lat"], geocode[1]["lng"]
+
+            items = PoiIndexService.search_nearby(
+                chat_id=None,
+                latitude=search_latitude,
+                longitude=search_longitude,
+                categories=categories,
+                limit=InlineSearchService.settings.inline_results_limit
+            )
+            return tuple(ResultsService.render_inline_results(items))
+
+        key = InlineSearchService.get_results_key(text, address, latitude, longitude)
+        return InlineSearchService.results_cache.get(key, load), address is None
@@ -1,12 +1,36 @@
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton
+import zlib
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
 
 from src.services.safe_refuge_api_service import SafeRefugeApiService
 
+
+class FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    """
+    Reply keyboard built once and shared by every message that sends it.
+    Its JSON is serialized once, instead of on every send.
+    """
+
+    __slots__ = ('_json',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._json = super().to_json()
+
+    def to_json(self) -> str:
+        return self._json
+
+
 class KeyboardService:
     """
     Service class for keyboards.
     """
 
+    # Categories keyboards, built once per set of excluded categories and category list:
+    # (the category list they were built from, {(frozenset of excluded categories, placeholder): FrozenReplyKeyboardMarkup}),
+    # replaced as a whole so concurrent handlers never see the markups of another category list
+    _categories_markups = ((), {})
+
 
     @staticmethod
     def get_yes_no_keyboard() -> list:
@@ -17,30 +41,94 @@ class KeyboardService:
 
     
     @staticmethod
-    def get_categories_keyboard(except_categories: list = None) -> list:
+    def get_categories_markup(except_categories=(), placeholder: str = "Please choose:") -> FrozenReplyKeyboardMarkup:
         """
-        Creates a categories of interest keyboard - one line per category
-        Return: list of lists of buttons
+        Categories of interest reply keyboard - one line per category - without the excepted categories.
+        Markups are memoized per set of excepted categories, and rebuilt only when the category list changes.
+        Return: shared FrozenReplyKeyboardMarkup, not to be modified
         """
-        if except_categories is None:
-            except_categories = []
+        categories = tuple(SafeRefugeApiService.get_category_list())
+        built_from, markups = KeyboardService._categories_markups
+        if categories is not built_from:
+            # A refresh of the categories cache returns a new tuple, usually with the same categories
+            markups = markups if categories == built_from else {}
+            KeyboardService._categories_markups = (categories, markups)
+
+        key = (frozenset(except_categories), placeholder)
+        markup = markups.get(key)
+        if markup is None:
+            markup = markups.setdefault(key, KeyboardService.get_reply_markup(
+                [[KeyboardButton(category)] for category in sorted(categories) if category not in key[0]],
+                placeholder
+            ))
+
+        return markup
 
-        return [[KeyboardButton(category)] for category in sorted(SafeRefugeApiService.get_category_list()) if category not in except_categories]
+
+    @staticmethod
+    def get_reply_markup(keyboard: list, placeholder: str = None) -> FrozenReplyKeyboardMarkup:
+        """
+        Creates a shared one time reply keyboard markup, for a fixed keyboard.
+        """
+        return FrozenReplyKeyboardMarkup(
+            keyboard,
+            one_time_keyboard=True,
+            input_field_placeholder=placeholder,
+            resize_keyboard=True
+        )
 
     
     @staticmethod
-    def get_categories_inline_keyboard(except_categories: list = None) -> InlineKeyboardMarkup:
+    def get_categories_inline_keyboard(latitude: float, longitude: float) -> InlineKeyboardMarkup:
         """
-        Creates a categories of interest keyboard - one line per category
+        Creates a categories of interest keyboard for a search around a location - two categories per line.
+        The callback data holds the location, the index of the category in the sorted categories and the version
+        of the category list (see get_categories_version), so a tap is answered without any state kept for the message.
         Return: InlineKeyboardMarkup of categories
         """
-        if except_categories is None:
-            except_categories = []
-        
-        buttons = [[InlineKeyboardButton(text=category, callback_data=str(category))] for category in SafeRefugeApiService.get_category_list() if category not in except_categories]
-        return InlineKeyboardMarkup(buttons)
+        categories = sorted(SafeRefugeApiService.get_category_list())
+        version = KeyboardService.get_categories_version(categories)
+        buttons = [
+            InlineKeyboardButton(text=category, callback_data=f"poi_cat:{latitude:.5f}:{longitude:.5f}:{index}:{version}")
+            for index, category in enumerate(categories)
+        ]
+        return InlineKeyboardMarkup([buttons[row:row + 2] for row in range(0, len(buttons), 2)])
+
+    
+    @staticmethod
+    def get_categories_version(categories: list) -> str:
+        """
+        Get a short version of a sorted category list, changing when a category is added, removed or renamed.
+        Category names can be too long for the 64 bytes of callback data: buttons hold an index and this version.
+        Return: 8 hexadecimal digits
+        """
+        return f"{zlib.crc32(chr(0).join(categories).encode()):08x}"
 
     
+    @staticmethod
+    def get_results_inline_keyboard(token: int, skip: int, count: int, page_size: int, has_next: bool) -> InlineKeyboardMarkup:
+        """
+        Creates the keyboard of a page of search results:
+        one button per result to get its location pin, and previous/next page buttons
+        Return: InlineKeyboardMarkup of the results page
+        """
+        pins = [
+            InlineKeyboardButton(text=f"📍{skip + index + 1}", callback_data=f"poi_pin:{token}:{index}")
+            for index in range(count)
+        ]
+        buttons = [pins[row:row + 5] for row in range(0, len(pins), 5)]
+
+        navigation = []
+        if skip > 0:
+            navigation.append(InlineKeyboardButton(text="« Previous", callback_data=f"poi_page:{token}:{max(skip - page_size, 0)}"))
+        if has_next:
+            navigation.append(InlineKeyboardButton(text="Next »", callback_data=f"poi_page:{token}:{skip + count}"))
+        if navigation:
+            buttons.append(navigation)
+
+        return InlineKeyboardMarkup(buttons)
+
+
     @staticmethod
     def get_location_keyboard() -> list:
         """
@@ -0,0 +1,301 @@
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from config.settings import Settings, get_settings
+from src.services.container_service import LazyService
+from src.services.metrics_service import MetricsService
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Id of the update being handled by the current thread, added to its log records
+correlation_id = ContextVar('correlation_id', default=None)
+
+REDACTED = '[redacted]'
+
+# Record fields holding names, or text typed by the users: never written
+REDACTED_FIELDS = frozenset({'name', 'first_name', 'last_name', 'username', 'address', 'text', 'query'})
+
+# Record fields holding coordinates: rounded to one decimal, about 10 km
+COORDINATE_FIELDS = frozenset({'latitude', 'longitude', 'lat', 'lng'})
+COORDINATE_DECIMALS = 1
+
+
+def redact(key, value):
+    """
+    Redact the value of a record field, and of the fields of the dicts it holds, by field name.
+    Return: the value to write
+    """
+    if isinstance(value, dict):
+        return {item_key: redact(item_key, item) for item_key, item in value.items()}
+    if key in REDACTED_FIELDS:
+        return REDACTED if value else value
+    if key in COORDINATE_FIELDS and value is not None:
+        try:
+            return round(float(value), COORDINATE_DECIMALS)
+        except (TypeError, ValueError):
+            return REDACTED
+    if isinstance(value, (list, tuple)):
+        return [redact(key, item) for item in value]
+    return value
+
+
+def correlated(callback):
+    """
+    Wraps a handler callback so the records logged while it runs, on any thread, carry the id of its update.
+    """
+    @functools.wraps(callback)
+    def wrapper(update, *args, **kwargs):
+        token = correlation_id.set(getattr(update, 'update_id', None))
+        try:
+            return callback(update, *args, **kwargs)
+        finally:
+            correlation_id.reset(token)
+
+    return wrapper
+
+
+def parse_sample_rates(value: str) -> dict:
+    """
+    Parse sampling rates like "src.services.safe_refuge_api_service=0.01,src.conversations=0.5".
+    Return: dict of logger name -> rate
+    """
+    rates = {}
+    for item in value.split(','):
+        if item.strip():
+            name, _, rate = item.partition('=')
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class SampledLogger:
+    """
+    Logger for verbose per-request messages: they are logged at DEBUG level, and only a sample of them.
+    All the records of a sampled update are kept, so an update is either fully logged or not at all.
+    Messages take %-style arguments and keyword fields, formatted only by the log writer (see JsonFormatter).
+    """
+
+    def __init__(self, logger: logging.Logger, rate: float = None):
+        """
+        Args:
+            logger: logger the sampled messages go to.
+            rate: share of the messages emitted, between 0 and 1.
+                Default: None (LOG_SAMPLE_RATES or LOG_SAMPLE_RATE, read on first use)
+        """
+        self.logger = logger
+        self.rate = rate
+
+    def debug(self, msg: str, *args, **fields) -> None:
+        """
+        Args:
+            msg: the message, with %-style placeholders for args.
+            fields: values added to the record, redacted by name (see redact). Must not be changed afterwards.
+        """
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        rate = self.rate
+        if rate is None:
+            rate = self.rate = LoggingService.get_sample_rate(self.logger.name)
+        if rate <= 0 or rate < 1 and LoggingService.sample_point() >= rate:
+            return
+
+        # Built without looking up the calling frame, the slowest part of a record: its file and line are not logged
+        record = self.logger.makeRecord(self.logger.name, logging.DEBUG, '', 0, msg, args, None, extra={'fields': fields})
+        self.logger.handle(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object on one line: time, level, logger, correlation_id, message and its redacted fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "correlation_id": getattr(record, 'correlation_id', None),
+            "message": record.getMessage(),
+        }
+        for key, value in getattr(record, 'fields', {}).items():
+            entry.setdefault(key, redact(key, value))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Formats a record as a line of text, followed by its correlation id and redacted fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, 'fields', {})
+        extras = [f'{key}={redact(key, value)!r}' for key, value in fields.items()]
+        if getattr(record, 'correlation_id', None) is not None:
+            extras.insert(0, f'correlation_id={record.correlation_id}')
+        return f'{text} [{" ".join(extras)}]' if extras else text
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    Hands the records to the log writer as they are, with the correlation id of the thread logging them:
+    their message is formatted by the writer thread. Records are dropped, and counted, while the queue is full.
+    """
+
+    def __init__(self, records: queue.SimpleQueue, queue_size: int):
+        super().__init__(records)
+        self.queue_size = queue_size
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.correlation_id = correlation_id.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # The size is checked without a lock: a few more records may be queued when threads race
+        if self.queue.qsize() >= self.queue_size:
+            MetricsService.log_dropped.inc()
+            return
+        self.queue.put(record)
+
+
+class LogPipeline:
+    """
+    Queue of the log records, and the background writer formatting and writing them to a handler,
+    so the threads logging never wait for formatting or I/O.
+    """
+
+    def __init__(self, handler: logging.Handler, queue_size: int = 10000):
+        """
+        Args:
+            handler: handler the records are written to, by the writer thread.
+            queue_size: maximum number of records waiting for the writer; more are dropped.
+        """
+        self.target = handler
+        self.queue_size = queue_size
+        self.queue = queue.SimpleQueue()
+        self.handler = LogQueueHandler(self.queue, queue_size)
+        self.writer = None
+
+    def start(self) -> "LogPipeline":
+        self.writer = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.writer.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Write the waiting records, then stop the writer.
+        """
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+
+    def reset(self) -> None:
+        """
+        Start over with an empty queue and a new writer, in a forked process: the writer thread was not copied.
+        """
+        self.writer = None
+        self.queue = self.handler.queue = queue.SimpleQueue()
+        self.start()
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize()}
+
+
+class LoggingService:
+    """
+    Service for the loggers of the bot.
+    """
+
+    settings = LazyService(get_settings)
+
+    # Rates of LOG_SAMPLE_RATES, by logger name
+    sample_rates = LazyService(lambda: parse_sample_rates(LoggingService.settings.log_sample_rates))
+
+    # LogPipeline the root logger writes through, once configured
+    pipeline = None
+
+    @staticmethod
+    def configure(settings: Settings) -> LogPipeline:
+        """
+        Route the records of every logger through a LogPipeline writing to stderr,
+        in the LOG_FORMAT (json or text) and from the LOG_LEVEL.
+        """
+        stream = logging.StreamHandler()
+        stream.setFormatter(JsonFormatter() if settings.log_format == 'json' else TextFormatter(TEXT_FORMAT))
+        pipeline = LogPipeline(stream, settings.log_queue_size)
+
+        root = logging.getLogger()
+        if LoggingService.pipeline is None:
+            atexit.register(LoggingService.stop)
+            # The writer thread is stopped while the process forks (the webhook workers), and each process
+            # then writes its own records. Spawned workers, and the platforms without fork, configure their own
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(
+                    before=LoggingService.stop,
+                    after_in_parent=LoggingService.restart,
+                    after_in_child=LoggingService.reset
+                )
+        else:
+            LoggingService.pipeline.stop()
+        root.handlers[:] = [pipeline.handler]
+        root.setLevel(settings.log_level)
+
+        LoggingService.pipeline = pipeline.start()
+        MetricsService.register_logging(pipeline)
+        return pipeline
+
+    @staticmethod
+    def stop() -> None:
+        if LoggingService.pipeline is not None:
+            LoggingService.pipeline.stop()
+
+    @staticmethod
+    def restart() -> None:
+        if LoggingService.pipeline is not None and LoggingService.pipeline.writer is None:
+            LoggingService.pipeline.start()
+
+    @staticmethod
+    def reset() -> None:
+        if LoggingService.pipeline is not None:
+            LoggingService.pipeline.reset()
+
+    @staticmethod
+    def get_sample_rate(name: str) -> float:
+        """
+        Returns the LOG_SAMPLE_RATES rate of the logger, or of its nearest parent, else LOG_SAMPLE_RATE.
+        """
+        rates = LoggingService.sample_rates
+        while name:
+            if name in rates:
+                return rates[name]
+            name = name.rpartition('.')[0]
+        return LoggingService.settings.log_sample_rate
+
+    @staticmethod
+    def sample_point() -> float:
+        """
+        Returns a number in [0, 1): the same for every record of an update, random outside of one.
+        """
+        update_id = correlation_id.get()
+        if update_id is None:
+            return random.random()
+        return zlib.crc32(str(update_id).encode()) / 2 ** 32
+
+    @staticmethod
+    def get_sampled_logger(name: str) -> SampledLogger:
+        """
+        Returns a sampled DEBUG logger, emitting LOG_SAMPLE_RATES or LOG_SAMPLE_RATE of its messages.
+        """
+        return SampledLogger(logging.getLogger(name))
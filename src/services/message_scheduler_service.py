@@ -0,0 +1,360 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+from config.settings import Settings
+from src.services.metrics_service import MetricsService
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: allows bursts of `capacity` and `rate` events per second on average.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """
+        Return: seconds until a token is available, 0 if one is available now.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        """
+        Consume a token. Call delay() first to refill the bucket.
+        """
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated_at) * self.rate >= self.capacity
+
+
+class OutboundMessage:
+    """
+    A Bot API message waiting to be sent, with the futures of the callers waiting for it.
+    """
+
+    __slots__ = ('chat_id', 'endpoint', 'data', 'kwargs', 'send', 'futures', 'enqueued_at', 'attempts')
+
+    def __init__(self, chat_id, endpoint: str, data: dict, kwargs: dict, send, enqueued_at: float):
+        self.chat_id = chat_id
+        self.endpoint = endpoint
+        self.data = data
+        self.kwargs = kwargs
+        self.send = send
+        self.futures = [Future()]
+        self.enqueued_at = enqueued_at
+        self.attempts = 0
+
+
+class ChatQueue:
+    """
+    Pending messages of a single chat, with its rate limit state.
+    """
+
+    __slots__ = ('messages', 'bucket', 'paused_until', 'in_flight')
+
+    def __init__(self, bucket: TokenBucket):
+        self.messages = deque()
+        self.bucket = bucket
+        self.paused_until = 0.0
+        self.in_flight = False
+
+
+class MessageScheduler:
+    """
+    Outbound queue for Bot API messages that respects Telegram's rate limits.
+
+    Every chat has its own queue and token bucket, and all sends share a global token bucket.
+    Chats are served round-robin, one message in flight per chat so their order is kept.
+    Consecutive plain text messages of a chat are coalesced into one message when possible,
+    and messages rejected with RetryAfter are retried once the chat's flood wait is over.
+    """
+
+    max_text_length = 4096
+    coalesce_separator = '\n\n'
+
+    def __init__(self, global_rate: float = 30, global_burst: int = 30, chat_rate: float = 1, chat_burst: int = 3,
+        send_workers: int = 8, max_retries: int = 3):
+        """
+        Args:
+            global_rate: messages per second over all chats.
+            global_burst: messages that can be sent at once over all chats.
+            chat_rate: messages per second to a single chat.
+            chat_burst: messages that can be sent at once to a single chat.
+            send_workers: number of threads sending the messages.
+            max_retries: number of retries of a message rejected with RetryAfter.
+        """
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)
+
+        self._condition = threading.Condition()
+        self._global_bucket = TokenBucket(global_rate, global_burst, time.monotonic())
+        self._chats = OrderedDict()  # chat_id -> ChatQueue, in round-robin order
+        self._queue_depth = 0
+        self._running = False
+        self._thread = None
+        self._pool = ThreadPoolExecutor(max_workers=send_workers, thread_name_prefix='message-scheduler-send')
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "MessageScheduler":
+        """
+        Creates a scheduler configured by the SCHEDULER_* settings.
+        """
+        return cls(
+            global_rate=settings.scheduler_global_rate,
+            global_burst=settings.scheduler_global_burst,
+            chat_rate=settings.scheduler_chat_rate,
+            chat_burst=settings.scheduler_chat_burst,
+            send_workers=settings.scheduler_send_workers,
+            max_retries=settings.scheduler_max_retries
+        )
+
+    def start(self) -> None:
+        """
+        Start the scheduling thread.
+        """
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+
+        self._thread = threading.Thread(target=self._run, name='message-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the scheduling thread. The messages being sent are waited for, the ones still queued are failed.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+        # The sends in flight update their chat when they end
+        self._pool.shutdown(wait=True)
+
+        with self._condition:
+            for chat in self._chats.values():
+                for message in chat.messages:
+                    self._resolve(message, error=RuntimeError('Message scheduler stopped'))
+            self._chats.clear()
+            self._queue_depth = 0
+
+    def submit(self, chat_id, endpoint: str, data: dict, kwargs: dict, send) -> Future:
+        """
+        Queue a message.
+        Args:
+            chat_id: the chat the message is sent to.
+            endpoint: Bot API endpoint, like sendMessage.
+            data: request data of the endpoint.
+            kwargs: the other arguments of the send call (reply_markup, timeout...).
+            send: callable(endpoint, data, kwargs) that actually sends the message.
+        Return: Future resolved with the result of the send.
+        """
+        message = OutboundMessage(chat_id, endpoint, data, kwargs, send, time.monotonic())
+
+        with self._condition:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = ChatQueue(TokenBucket(self.chat_rate, self.chat_burst, message.enqueued_at))
+            chat.messages.append(message)
+            self._queue_depth += 1
+            self._condition.notify()
+
+        return message.futures[0]
+
+    def stats(self) -> dict:
+        """
+        Return: dict with the queue depth, send counters and send latency percentiles (seconds).
+        """
+        with self._condition:
+            latencies = sorted(self.latencies)
+            return {
+                "queue_depth": self._queue_depth,
+                "chats_waiting": sum(1 for chat in self._chats.values() if chat.messages),
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "retried": self.retried,
+                "failed": self.failed,
+                "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+                "latency_p99": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+            }
+
+    def _run(self) -> None:
+        """
+        Scheduling loop: hands the next sendable message to the send pool, or sleeps until one is.
+        """
+        with self._condition:
+            while self._running:
+                message, wait = self._next_message(time.monotonic())
+                if message is None:
+                    self._condition.wait(timeout=wait)
+                    continue
+
+                self._pool.submit(self._deliver, message)
+
+    def _next_message(self, now: float) -> tuple:
+        """
+        Pick the next message, round-robin over the chats. Call with the lock held.
+        Return: (message, None) or (None, seconds to wait before trying again)
+        """
+        global_delay = self._global_bucket.delay(now)
+        if global_delay:
+            return None, global_delay
+
+        wait = None
+        for chat_id in list(self._chats):
+            chat = self._chats[chat_id]
+            if not chat.messages:
+                # Forget idle chats once their bucket is full again
+                if not chat.in_flight and chat.bucket.is_full(now):
+                    del self._chats[chat_id]
+                continue
+            if chat.in_flight:
+                continue
+
+            delay = max(chat.paused_until - now, chat.bucket.delay(now))
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            chat.bucket.take()
+            self._global_bucket.take()
+            chat.in_flight = True
+            self._chats.move_to_end(chat_id)
+            return self._pop_coalesced(chat), None
+
+        return None, wait
+
+    def _pop_coalesced(self, chat: ChatQueue) -> OutboundMessage:
+        """
+        Pop the next message of the chat, merged with the following plain text messages that fit in it.
+        Call with the lock held.
+        """
+        message = chat.messages.popleft()
+        self._queue_depth -= 1
+
+        while chat.messages and self._can_coalesce(message, chat.messages[0]):
+            following = chat.messages.popleft()
+            self._queue_depth -= 1
+            message.data = dict(following.data, text=message.data['text'] + self.coalesce_separator + following.data['text'])
+            message.kwargs = following.kwargs
+            message.futures.extend(following.futures)
+            self.coalesced += 1
+
+        return message
+
+    def _can_coalesce(self, message: OutboundMessage, following: OutboundMessage) -> bool:
+        """
+        Two text messages can be merged when the first has no keyboard and both render the same way.
+        """
+        if message.endpoint != 'sendMessage' or following.endpoint != 'sendMessage' or message.send != following.send:
+            return False
+        if message.kwargs.get('reply_markup') is not None or message.kwargs.get('reply_to_message_id') is not None:
+            return False
+        if following.kwargs.get('reply_to_message_id') is not None:
+            return False
+        if 'entities' in message.data or 'entities' in following.data:
+            return False
+
+        same_format = all(
+            message.data.get(key) == following.data.get(key)
+            for key in ('parse_mode', 'disable_web_page_preview')
+        )
+        length = len(message.data['text']) + len(self.coalesce_separator) + len(following.data['text'])
+        return same_format and length <= self.max_text_length
+
+    def _deliver(self, message: OutboundMessage) -> None:
+        """
+        Send a message on a pool thread and resolve its futures, or queue it again after a RetryAfter.
+        """
+        message.attempts += 1
+        try:
+            result = message.send(message.endpoint, message.data, message.kwargs)
+        except RetryAfter as error:
+            with self._condition:
+                chat = self._chats[message.chat_id]
+                chat.in_flight = False
+                if message.attempts <= self.max_retries:
+                    logger.warning("Flood control on chat %s, retrying in %ss", message.chat_id, error.retry_after)
+                    self.retried += 1
+                    chat.paused_until = time.monotonic() + error.retry_after
+                    chat.messages.appendleft(message)
+                    self._queue_depth += 1
+                else:
+                    self._resolve(message, error=error)
+                self._condition.notify()
+        except Exception as error:
+            with self._condition:
+                self._chats[message.chat_id].in_flight = False
+                self._resolve(message, error=error)
+                self._condition.notify()
+        else:
+            with self._condition:
+                self._chats[message.chat_id].in_flight = False
+                self._resolve(message, result=result)
+                self._condition.notify()
+
+    def _resolve(self, message: OutboundMessage, result=None, error: Exception = None) -> None:
+        """
+        Resolve the futures of a message and record its stats. Call with the lock held.
+        """
+        if error is None:
+            latency = time.monotonic() - message.enqueued_at
+            self.sent += 1
+            self.latencies.append(latency)
+            MetricsService.scheduler_latency.observe(latency)
+        else:
+            self.failed += 1
+
+        for future in message.futures:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+class ScheduledBot(ExtBot):
+    """
+    Bot whose outgoing messages go through a MessageScheduler.
+    Send methods keep their usual blocking behaviour and return value.
+    """
+
+    def __init__(self, token: str, scheduler: MessageScheduler, **kwargs):
+        super().__init__(token, **kwargs)
+        self.scheduler = scheduler
+
+    def _message(self, endpoint: str, data: dict, **kwargs):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            # Inline messages are not bound to a chat
+            return super()._message(endpoint, data, **kwargs)
+
+        return self.scheduler.submit(chat_id, endpoint, data, kwargs, self._send_now).result()
+
+    def _send_now(self, endpoint: str, data: dict, kwargs: dict):
+        return super()._message(endpoint, data, **kwargs)
@@ -0,0 +1,438 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Values of the bot_circuit_state gauge, by CircuitBreaker state
+CIRCUIT_STATES = ('closed', 'half_open', 'open')
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labelnames: tuple, labels: tuple, extra: str = "") -> str:
+    """
+    Format a label set in the Prometheus text format, like: {endpoint="search",le="0.5"}
+    """
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """
+    Monotonic counter, with one value per label set.
+    """
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{format_labels(self.labelnames, labels)} {value}'
+
+
+class Histogram:
+    """
+    Distribution of observed values (latencies, in seconds), counted in cumulative buckets per label set.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [count per bucket (the last one is +Inf), sum]
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the with block.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames, labels, f'le="{bound}"')
+                yield f'{self.name}_bucket{bucket_labels} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}'
+
+
+class CallbackMetric:
+    """
+    Metric read when it is collected, from a callback returning {labels tuple: value}.
+    """
+
+    def __init__(self, name: str, help: str, type: str, labelnames: tuple, callback):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        for labels, value in self.callback().items():
+            yield f'{self.name}{format_labels(self.labelnames, labels)} {value}'
+
+
+class MetricsRegistry:
+    """
+    Set of metrics, rendered together in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # name -> metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, type: str, labelnames: tuple, callback) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, type, labelnames, callback))
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as error:
+                logger.warning("Failed to collect metric %s: %r", metric.name, error)
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(samples)
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsService:
+    """
+    Metrics of the bot: handler and upstream latencies, cache hit ratios and active conversations.
+    """
+
+    registry = MetricsRegistry()
+
+    handler_latency = registry.histogram(
+        'bot_handler_seconds', 'Time spent in conversation handlers, per conversation state.',
+        ('conversation', 'state', 'handler')
+    )
+    handler_errors = registry.counter(
+        'bot_handler_errors_total', 'Conversation handlers that raised an exception.', ('conversation', 'state', 'handler')
+    )
+    upstream_latency = registry.histogram(
+        'bot_upstream_seconds', 'Duration of upstream API calls, per endpoint.', ('endpoint',)
+    )
+    upstream_errors = registry.counter(
+        'bot_upstream_errors_total', 'Upstream API calls that failed, per endpoint.', ('endpoint',)
+    )
+    alerts_sent = registry.counter(
+        'bot_alerts_total', 'Subscription alerts sent to chats, per result: sent or failed.', ('result',)
+    )
+    gazetteer_lookups = registry.counter(
+        'bot_gazetteer_lookups_total', 'Addresses looked up in the offline gazetteer, per match: exact, prefix, fuzzy or miss.', ('match',)
+    )
+
+    prefetches = registry.counter(
+        'bot_prefetch_total', 'Speculative searches, per result: started, then used, wasted or failed.', ('result',)
+    )
+    admission_shed = registry.counter(
+        'bot_admission_shed_total', 'Updates answered "busy" instead of handled, per priority class and reason: queue_full, deadline or stopping.',
+        ('priority', 'reason')
+    )
+    admission_wait = registry.histogram(
+        'bot_admission_wait_seconds', 'Time the updates waited for a worker thread, per priority class.', ('priority',)
+    )
+    log_dropped = registry.counter(
+        'bot_log_dropped_total', 'Log records dropped because the queue of the log writer was full.'
+    )
+    scheduler_latency = registry.histogram(
+        'bot_scheduler_send_seconds', 'Time from queuing an outbound message to its successful send, retries included.'
+    )
+
+    _caches = {}  # name -> cache with a stats() method
+    _conversations = {}  # name -> ConversationHandler
+    _circuits = {}  # upstream name -> CircuitBreaker
+    _admission = []  # AdmissionQueue of the dispatcher, when it has one
+    _logging = []  # LogPipeline of the root logger, when it has one
+    _schedulers = []  # MessageScheduler of the bot, when it has one
+
+    @staticmethod
+    def instrument_handler(callback, conversation: str, state: str):
+        """
+        Wrap a handler callback to record its latency and errors.
+        Args:
+            callback: the handler callback.
+            conversation: name of the conversation.
+            state: name of the conversation state the callback handles.
+        """
+        labels = {'conversation': conversation, 'state': state, 'handler': callback.__name__}
+
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            except Exception:
+                MetricsService.handler_errors.inc(**labels)
+                raise
+            finally:
+                MetricsService.handler_latency.observe(time.perf_counter() - started_at, **labels)
+
+        return wrapper
+
+    @staticmethod
+    @contextmanager
+    def time_upstream(endpoint: str):
+        """
+        Record the duration of an upstream call made in the with block, and whether it failed.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            MetricsService.upstream_errors.inc(endpoint=endpoint)
+            raise
+        finally:
+            MetricsService.upstream_latency.observe(time.perf_counter() - started_at, endpoint=endpoint)
+
+    @staticmethod
+    def register_cache(name: str, cache):
+        """
+        Expose the hit/miss counters of a cache, from its stats().
+        Return: the cache
+        """
+        MetricsService._caches[name] = cache
+        return cache
+
+    @staticmethod
+    def register_conversation(handler) -> None:
+        """
+        Expose the number of active conversations of a ConversationHandler.
+        """
+        MetricsService._conversations[handler.name] = handler
+
+    @staticmethod
+    def register_circuit(name: str, breaker):
+        """
+        Expose the state and rejected calls of an upstream circuit breaker.
+        Return: the circuit breaker
+        """
+        MetricsService._circuits[name] = breaker
+        return breaker
+
+    @staticmethod
+    def register_admission(queue) -> None:
+        """
+        Expose the waiting and running updates of each priority class of the dispatcher's AdmissionQueue.
+        """
+        MetricsService._admission[:] = [queue]
+
+    @staticmethod
+    def register_logging(pipeline) -> None:
+        """
+        Expose the records waiting for the log writer of a LogPipeline.
+        """
+        MetricsService._logging[:] = [pipeline]
+
+    @staticmethod
+    def register_scheduler(scheduler):
+        """
+        Expose the queued messages and the send counters of the bot's MessageScheduler.
+        Return: the scheduler
+        """
+        MetricsService._schedulers[:] = [scheduler]
+        return scheduler
+
+    @staticmethod
+    def _scheduler_counters() -> dict:
+        return {
+            (field,): stats[field]
+            for stats in [scheduler.stats() for scheduler in list(MetricsService._schedulers)]
+            for field in ('sent', 'coalesced', 'retried', 'failed')
+        }
+
+    @staticmethod
+    def _cache_stats(field: str) -> dict:
+        return {(name,): cache.stats().get(field, 0) for name, cache in list(MetricsService._caches.items())}
+
+    @staticmethod
+    def _active_conversations() -> dict:
+        return {(name,): len(handler.conversations) for name, handler in list(MetricsService._conversations.items())}
+
+    @staticmethod
+    def _circuit_stats(field: str) -> dict:
+        return {(name,): breaker.stats()[field] for name, breaker in list(MetricsService._circuits.items())}
+
+    @staticmethod
+    def _admission_stats(field: str) -> dict:
+        return {
+            (priority,): stats[field]
+            for queue in list(MetricsService._admission) for priority, stats in queue.stats().items()
+        }
+
+    @staticmethod
+    def render() -> str:
+        return MetricsService.registry.render()
+
+
+MetricsService.registry.callback(
+    'bot_cache_hits_total', 'Cache lookups answered from the cache.', 'counter', ('cache',),
+    lambda: MetricsService._cache_stats('hits')
+)
+MetricsService.registry.callback(
+    'bot_cache_misses_total', 'Cache lookups that loaded the value.', 'counter', ('cache',),
+    lambda: MetricsService._cache_stats('misses')
+)
+MetricsService.registry.callback(
+    'bot_cache_hit_ratio', 'Share of the cache lookups answered without a new load.', 'gauge', ('cache',),
+    lambda: MetricsService._cache_stats('hit_ratio')
+)
+MetricsService.registry.callback(
+    'bot_cache_stale_total', 'Failed cache loads answered with an expired value.', 'counter', ('cache',),
+    lambda: MetricsService._cache_stats('stale')
+)
+MetricsService.registry.callback(
+    'bot_active_conversations', 'Conversations currently in progress.', 'gauge', ('conversation',),
+    MetricsService._active_conversations
+)
+MetricsService.registry.callback(
+    'bot_circuit_state', 'Circuit breaker state per upstream: 0 closed, 1 half-open, 2 open.', 'gauge', ('upstream',),
+    lambda: {labels: CIRCUIT_STATES.index(state) for labels, state in MetricsService._circuit_stats('state').items()}
+)
+MetricsService.registry.callback(
+    'bot_circuit_rejected_total', 'Upstream calls failed fast by an open circuit.', 'counter', ('upstream',),
+    lambda: MetricsService._circuit_stats('rejected')
+)
+
+MetricsService.registry.callback(
+    'bot_admission_queue_depth', 'Updates waiting for a worker thread, per priority class.', 'gauge', ('priority',),
+    lambda: MetricsService._admission_stats('queued')
+)
+MetricsService.registry.callback(
+    'bot_admission_running', 'Updates handled on the worker threads, per priority class.', 'gauge', ('priority',),
+    lambda: MetricsService._admission_stats('running')
+)
+MetricsService.registry.callback(
+    'bot_scheduler_queue_depth', 'Outbound messages waiting in the message scheduler.', 'gauge', (),
+    lambda: {(): scheduler.stats()['queue_depth'] for scheduler in list(MetricsService._schedulers)}
+)
+MetricsService.registry.callback(
+    'bot_scheduler_chats_waiting', 'Chats with outbound messages waiting in the message scheduler.', 'gauge', (),
+    lambda: {(): scheduler.stats()['chats_waiting'] for scheduler in list(MetricsService._schedulers)}
+)
+MetricsService.registry.callback(
+    'bot_scheduler_messages_total', 'Outbound messages per result: sent, coalesced into another, retried or failed.',
+    'counter', ('result',),
+    MetricsService._scheduler_counters
+)
+MetricsService.registry.callback(
+    'bot_log_queue_depth', 'Log records waiting for the log writer.', 'gauge', (),
+    lambda: {(): pipeline.stats()['queued'] for pipeline in list(MetricsService._logging)}
+)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics at /metrics.
+    """
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = MetricsService.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint exposing the metrics in the Prometheus text format.
+    """
+
+    def __init__(self, listen: str = '127.0.0.1', port: int = 9100):
+        """
+        Args:
+            listen: address to listen on.
+            port: port to listen on, 0 for any free port.
+        """
+        self.httpd = ThreadingHTTPServer((listen, port), MetricsRequestHandler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self) -> None:
+        threading.Thread(target=self.httpd.serve_forever, name='metrics-server', daemon=True).start()
+        logger.info('Metrics served on port %s', self.port)
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
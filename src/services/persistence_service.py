@@ -0,0 +1,618 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from contextlib import ExitStack
+
+import telegram
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, TypeHandler
+from telegram.ext.utils.promise import Promise
+
+from config.settings import Settings
+from src.services.shared_store_service import RespClient, SharedStoreService
+
+logger = logging.getLogger(__name__)
+
+STATE_TYPES = {}  # class name -> class, for the objects stored in chat data
+
+
+def register_state_type(cls):
+    """
+    Class decorator registering a type that can be stored in the persisted chat data.
+    The class provides a to_state() method returning a JSON value, and a from_state(state) classmethod.
+    """
+    STATE_TYPES[cls.__name__] = cls
+    return cls
+
+
+def encode_state(value) -> str:
+    """
+    Serialize chat data or a conversation state to compact JSON.
+    Registered objects are written as {"__type__": class name, "state": obj.to_state()}.
+    """
+    return json.dumps(value, separators=(',', ':'), default=_encode_object)
+
+
+def decode_state(text: str):
+    """
+    Deserialize a value written by encode_state.
+    """
+    return json.loads(text, object_hook=_decode_object)
+
+
+def _encode_object(obj):
+    cls = STATE_TYPES.get(type(obj).__name__)
+    if cls is not type(obj):
+        raise TypeError(f'{type(obj).__name__} can not be persisted, register it with register_state_type')
+
+    return {'__type__': cls.__name__, 'state': obj.to_state()}
+
+
+def _decode_object(obj: dict):
+    name = obj.get('__type__')
+    if name is None:
+        return obj
+
+    return STATE_TYPES[name].from_state(obj['state'])
+
+
+# Version of python-telegram-bot whose ConversationHandler internals conversations_lock relies on
+PTB_VERSION = '13.15'
+
+
+def conversation_key(handler: ConversationHandler, update: Update) -> tuple:
+    """
+    Get the key of the conversation of an update in a ConversationHandler, built from its public
+    per_chat, per_user and per_message attributes like the handler builds it.
+    Raises AttributeError when the update has no chat or callback query the key needs.
+    """
+    key = []
+    if handler.per_chat:
+        key.append(update.effective_chat.id)
+    if handler.per_user and update.effective_user is not None:
+        key.append(update.effective_user.id)
+    if handler.per_message:
+        key.append(update.callback_query.inline_message_id or update.callback_query.message.message_id)
+    return tuple(key)
+
+
+def conversations_lock(handler: ConversationHandler):
+    """
+    Get the lock a ConversationHandler holds while it changes its conversations. PTB has no public API for it:
+    this is the only place reading the private attribute, and only on the version it was checked against.
+    Return: the lock, or None on another PTB version
+    """
+    if telegram.__version__ != PTB_VERSION:
+        logger.warning("Conversation locks are not shared on python-telegram-bot %s", telegram.__version__)
+        return None
+    return handler._conversations_lock
+
+
+class SessionStore:
+    """
+    Storage backend of SessionPersistence.
+    Chat data and conversation states are stored as serialized strings, with the time they were last updated.
+    A shared store is used by several bot replicas at once: the state of a chat is read from it on every update
+    (see load_session) and written back at the end of the update.
+    """
+
+    shared = False
+
+    def load_chat_data(self, chat_id: int):
+        """
+        Return: the serialized chat data of a chat, or None if it has none.
+        """
+        raise NotImplementedError
+
+    def load_conversations(self, name: str, since: float) -> dict:
+        """
+        Return: dict of the serialized conversation key -> serialized state, for the conversations
+        of the handler updated since the given time.
+        """
+        raise NotImplementedError
+
+    def load_session(self, chat_id: int, conversations: list) -> tuple:
+        """
+        Read the chat data of a chat and some of its conversations at once. Needed by shared stores only.
+        Args:
+            conversations: list of (handler name, serialized key).
+        Return: (serialized chat data or None, dict of (handler name, serialized key) -> serialized state)
+        """
+        raise NotImplementedError
+
+    def save(self, chat_data: dict, conversations: dict, now: float) -> None:
+        """
+        Write a batch of changes at once.
+        Args:
+            chat_data: chat id -> serialized chat data, None to delete it.
+            conversations: (handler name, serialized key) -> serialized state, None to delete it.
+            now: time of the update.
+        """
+        raise NotImplementedError
+
+    def expire(self, before: float) -> None:
+        """
+        Delete the chat data and conversations not updated since the given time.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    SessionStore in a SQLite file. Several processes can share the file, as long as they handle different chats.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite file, created if needed.
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS conversations (name TEXT NOT NULL, key TEXT NOT NULL, state TEXT NOT NULL, '
+                'updated_at REAL NOT NULL, PRIMARY KEY (name, key)) WITHOUT ROWID'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS chat_data_updated_at ON chat_data (updated_at)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)')
+
+    def load_chat_data(self, chat_id: int):
+        with self._lock:
+            row = self._db.execute('SELECT data FROM chat_data WHERE chat_id = ?', (chat_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def load_conversations(self, name: str, since: float) -> dict:
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT key, state FROM conversations WHERE name = ? AND updated_at >= ?', (name, since)
+            ).fetchall()
+        return dict(rows)
+
+    def save(self, chat_data: dict, conversations: dict, now: float) -> None:
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO chat_data (chat_id, data, updated_at) VALUES (?, ?, ?)',
+                [(chat_id, data, now) for chat_id, data in chat_data.items() if data is not None]
+            )
+            self._db.executemany(
+                'DELETE FROM chat_data WHERE chat_id = ?',
+                [(chat_id,) for chat_id, data in chat_data.items() if data is None]
+            )
+            self._db.executemany(
+                'INSERT OR REPLACE INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?)',
+                [(name, key, state, now) for (name, key), state in conversations.items() if state is not None]
+            )
+            self._db.executemany(
+                'DELETE FROM conversations WHERE name = ? AND key = ?',
+                [(name, key) for (name, key), state in conversations.items() if state is None]
+            )
+
+    def expire(self, before: float) -> None:
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM chat_data WHERE updated_at < ?', (before,))
+            self._db.execute('DELETE FROM conversations WHERE updated_at < ?', (before,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class RespSessionStore(SessionStore):
+    """
+    Shared SessionStore in a Redis-compatible server. Every value has its own key, expiring after the session TTL:
+        {prefix}chat:{chat id} -> chat data
+        {prefix}conv:{handler name}:{serialized key} -> conversation state
+    Values of compress_min_bytes or more are compressed with zlib.
+    """
+
+    shared = True
+
+    def __init__(self, client: RespClient, prefix: str = "", ttl: float = 86400, compress_min_bytes: int = 512):
+        """
+        Args:
+            client: client of the server.
+            prefix: prefix of the keys.
+            ttl: seconds a session is kept after its last update.
+            compress_min_bytes: size from which the values are compressed.
+        """
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.compress_min_bytes = compress_min_bytes
+
+    def encode(self, value: str) -> bytes:
+        data = value.encode()
+        return zlib.compress(data) if len(data) >= self.compress_min_bytes else data
+
+    @staticmethod
+    def decode(data: bytes) -> str:
+        # zlib streams start with 0x78 ("x"), which no JSON text starts with
+        return (zlib.decompress(data) if data[:1] == b'x' else data).decode()
+
+    def chat_key(self, chat_id: int) -> str:
+        return f'{self.prefix}chat:{chat_id}'
+
+    def conversation_key(self, name: str, key: str) -> str:
+        return f'{self.prefix}conv:{name}:{key}'
+
+    def load_chat_data(self, chat_id: int):
+        data = self.client.execute('GET', self.chat_key(chat_id))
+        return self.decode(data) if data is not None else None
+
+    def load_conversations(self, name: str, since: float) -> dict:
+        # The conversations are read on each update, see load_session
+        return {}
+
+    def load_session(self, chat_id: int, conversations: list) -> tuple:
+        keys = [self.chat_key(chat_id)] + [self.conversation_key(name, key) for name, key in conversations]
+        values = self.client.execute('MGET', *keys)
+        states = {
+            conversation: self.decode(value) for conversation, value in zip(conversations, values[1:]) if value is not None
+        }
+        return (self.decode(values[0]) if values[0] is not None else None), states
+
+    def save(self, chat_data: dict, conversations: dict, now: float) -> None:
+        ttl = max(1, int(self.ttl))
+        commands = [
+            ('SET', self.chat_key(chat_id), self.encode(data), 'EX', ttl) if data is not None else ('DEL', self.chat_key(chat_id))
+            for chat_id, data in chat_data.items()
+        ]
+        commands.extend(
+            ('SET', self.conversation_key(name, key), self.encode(state), 'EX', ttl) if state is not None
+            else ('DEL', self.conversation_key(name, key))
+            for (name, key), state in conversations.items()
+        )
+        for reply in self.client.pipeline(commands):
+            if isinstance(reply, Exception):
+                raise reply
+
+    def expire(self, before: float) -> None:
+        # Keys expire on the server
+        pass
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class LazyChatData(defaultdict):
+    """
+    The dispatcher's chat_data: the data of a chat is loaded from the store the first time the chat is seen.
+    """
+
+    def __init__(self, loader):
+        """
+        Args:
+            loader: callable(chat_id) returning the chat data of a chat.
+        """
+        super().__init__(dict)
+        self.loader = loader
+        self._lock = threading.Lock()
+
+    def __missing__(self, chat_id):
+        with self._lock:
+            if dict.__contains__(self, chat_id):
+                return dict.__getitem__(self, chat_id)
+
+            data = self[chat_id] = self.loader(chat_id)
+            return data
+
+
+class SessionPersistence(BasePersistence):
+    """
+    Persistence of the conversation states and chat data, so conversations survive a restart.
+
+    Changes are buffered in memory and written to the store in batches, every flush_interval seconds.
+    On startup only the conversations active in the last session_ttl seconds are loaded, and the chat data
+    of a chat is loaded when it is first needed. Sessions idle for more than session_ttl are evicted
+    from memory and from the store.
+
+    With a shared store, several replicas serve the same chats: the session of a chat is read in one round-trip
+    before each update (see get_prefetch_handler), and written in one round-trip after it.
+    """
+
+    def __init__(self, store: SessionStore, flush_interval: float = 5, session_ttl: float = 86400):
+        """
+        Args:
+            store: storage backend.
+            flush_interval: seconds between two writes to the store.
+            session_ttl: seconds of inactivity after which a session is forgotten.
+        """
+        super().__init__(store_user_data=False, store_chat_data=True, store_bot_data=False)
+        self.store = store
+        self.flush_interval = flush_interval
+        self.session_ttl = session_ttl
+
+        self._lock = threading.Lock()
+        # Shared sessions are loaded by the prefetch handler, on every update
+        self._chat_data = LazyChatData((lambda chat_id: {}) if store.shared else self._load_chat_data)
+        self._conversations = {}  # handler name -> conversations dict of the handler
+        self._pending_chat_data = {}  # chat id -> serialized chat data, None to delete it
+        self._pending_conversations = {}  # (handler name, key) -> state
+        self._chat_seen = {}  # chat id -> monotonic time of its last update
+        self._conversation_seen = {}  # (handler name, key) -> monotonic time of its last update
+        self._conversation_locks = {}  # handler name -> lock of the handler's conversations
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "SessionPersistence":
+        """
+        Creates a persistence in the shared store of SHARED_STORE_URL if it is set,
+        else in the SQLite file of the PERSISTENCE_* settings.
+        """
+        if settings.shared_store_url:
+            store = RespSessionStore(SharedStoreService.client, settings.shared_store_prefix, settings.persistence_session_ttl)
+        else:
+            store = SqliteSessionStore(settings.persistence_path)
+
+        return cls(
+            store=store,
+            flush_interval=settings.persistence_flush_interval,
+            session_ttl=settings.persistence_session_ttl
+        )
+
+    def start(self) -> None:
+        """
+        Start flushing the changes in the background.
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stopped.wait(self.flush_interval):
+                try:
+                    self.flush()
+                except Exception as error:
+                    # The changes stay buffered until the next flush
+                    logger.warning("Failed to flush the conversations: %r", error)
+
+        self._thread = threading.Thread(target=run, name='persistence-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background flush, write the last changes and close the store.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        self.store.close()
+
+    # Only JSON is stored, so there is never a Bot instance to replace
+    def insert_bot(self, obj):
+        return obj
+
+    def replace_bot(self, obj):
+        return obj
+
+    def get_user_data(self) -> defaultdict:
+        return defaultdict(dict)
+
+    def get_chat_data(self) -> defaultdict:
+        return self._chat_data
+
+    def get_bot_data(self) -> dict:
+        return {}
+
+    def get_conversations(self, name: str) -> dict:
+        since = time.time() - self.session_ttl
+        conversations = {
+            tuple(json.loads(key)): decode_state(state)
+            for key, state in self.store.load_conversations(name, since).items()
+        }
+
+        now = time.monotonic()
+        with self._lock:
+            self._conversations[name] = conversations
+            for key in conversations:
+                self._conversation_seen[(name, key)] = now
+
+        logger.info("Loaded %s active %s conversations", len(conversations), name)
+        return conversations
+
+    def add_conversation_handlers(self, handlers: list) -> None:
+        """
+        Register the persistent ConversationHandlers: the conversations evicted, or read from a shared store,
+        are changed under the lock of their handler, like the handler changes them.
+        """
+        with self._lock:
+            for handler in handlers:
+                lock = conversations_lock(handler)
+                if lock is not None:
+                    self._conversation_locks[handler.name] = lock
+
+    def _get_conversations_lock(self, name: str):
+        with self._lock:
+            return self._conversation_locks.setdefault(name, threading.Lock())
+
+    def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        with self._lock:
+            self._pending_conversations[(name, key)] = new_state
+            self._conversation_seen[(name, key)] = time.monotonic()
+
+    def update_user_data(self, user_id: int, data: dict) -> None:
+        pass
+
+    def update_chat_data(self, chat_id: int, data: dict) -> None:
+        serialized = encode_state(data) if data else None
+        with self._lock:
+            self._pending_chat_data[chat_id] = serialized
+            self._chat_seen[chat_id] = time.monotonic()
+
+        # Called at the end of every update: the next update of the chat may reach another replica
+        if self.store.shared:
+            self.flush()
+
+    def update_bot_data(self, data: dict) -> None:
+        pass
+
+    def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    def prefetch(self, chat_id: int, chat_data: dict, conversations: dict) -> None:
+        """
+        Read the session of a chat from a shared store, in one round-trip, before its update is handled.
+        Conversations and chat data with changes not written yet are kept as they are.
+        Args:
+            chat_id: the chat of the update.
+            chat_data: the chat data of the chat, updated in place.
+            conversations: handler name -> conversation key of the update.
+        """
+        keys = [(name, json.dumps(key)) for name, key in conversations.items()]
+        serialized_data, states = self.store.load_session(chat_id, keys)
+
+        now = time.monotonic()
+        with ExitStack() as locks:
+            # The handler locks are taken first: the handlers hold theirs when they call update_conversation
+            for name in sorted(conversations):
+                locks.enter_context(self._get_conversations_lock(name))
+            locks.enter_context(self._lock)
+
+            if chat_id not in self._pending_chat_data:
+                chat_data.clear()
+                chat_data.update(decode_state(serialized_data) if serialized_data is not None else {})
+            self._chat_seen[chat_id] = now
+
+            for (name, key), stored_key in zip(conversations.items(), keys):
+                if (name, key) in self._pending_conversations:
+                    continue
+                handler_conversations = self._conversations.setdefault(name, {})
+                state = states.get(stored_key)
+                if state is None:
+                    handler_conversations.pop(key, None)
+                else:
+                    handler_conversations[key] = decode_state(state)
+                    self._conversation_seen[(name, key)] = now
+
+    def get_prefetch_handler(self, conversation_handlers: list) -> TypeHandler:
+        """
+        Returns the handler reading the session of the chat of each update from a shared store.
+        Add it in a group before the conversation handlers, like -1.
+        Args:
+            conversation_handlers: the persistent ConversationHandler.
+        """
+        self.add_conversation_handlers(conversation_handlers)
+
+        def prefetch(update: Update, context) -> None:
+            chat = update.effective_chat
+            if chat is None:
+                return
+
+            conversations = {}
+            for handler in conversation_handlers:
+                try:
+                    conversations[handler.name] = conversation_key(handler, update)
+                except AttributeError:
+                    # The update has no user or chat for this handler
+                    continue
+            try:
+                self.prefetch(chat.id, context.chat_data, conversations)
+            except Exception as error:
+                logger.warning("Failed to read the session of chat %s: %r", chat.id, error)
+
+        return TypeHandler(Update, prefetch)
+
+    def flush(self) -> None:
+        """
+        Write the buffered changes to the store in one batch, then evict the idle sessions.
+        """
+        with self._lock:
+            chat_data, self._pending_chat_data = self._pending_chat_data, {}
+            pending, self._pending_conversations = self._pending_conversations, {}
+
+        conversations = {}
+        unresolved = {}
+        for (name, key), state in pending.items():
+            resolved, done = self._resolve_state(state)
+            conversations[(name, json.dumps(key))] = None if resolved is None else encode_state(resolved)
+            if not done:
+                unresolved[(name, key)] = state
+
+        try:
+            if chat_data or conversations:
+                self.store.save(chat_data, conversations, time.time())
+            self.store.expire(time.time() - self.session_ttl)
+        except Exception:
+            # Keep the changes for the next flush, unless newer ones arrived meanwhile
+            with self._lock:
+                for chat_id, data in chat_data.items():
+                    self._pending_chat_data.setdefault(chat_id, data)
+                for conversation, state in pending.items():
+                    self._pending_conversations.setdefault(conversation, state)
+            raise
+
+        with self._lock:
+            for conversation, state in unresolved.items():
+                self._pending_conversations.setdefault(conversation, state)
+        self._evict(time.monotonic() - self.session_ttl)
+
+    def _load_chat_data(self, chat_id: int) -> dict:
+        """
+        Load the chat data of a chat the dispatcher has not seen yet.
+        """
+        with self._lock:
+            self._chat_seen[chat_id] = time.monotonic()
+
+        serialized = self.store.load_chat_data(chat_id)
+        return decode_state(serialized) if serialized is not None else {}
+
+    def _evict(self, idle_before: float) -> None:
+        """
+        Forget the sessions idle since the given monotonic time. Call without the lock held, after a flush.
+        """
+        with self._lock:
+            for chat_id in [chat_id for chat_id, seen in self._chat_seen.items() if seen < idle_before]:
+                if chat_id not in self._pending_chat_data:
+                    del self._chat_seen[chat_id]
+                    self._chat_data.pop(chat_id, None)
+
+            idle = [conversation for conversation, seen in self._conversation_seen.items() if seen < idle_before]
+
+        for conversation in idle:
+            name, key = conversation
+            # Under the lock of the handler first, like update_conversation is called; it may have moved on meanwhile
+            with self._get_conversations_lock(name), self._lock:
+                seen = self._conversation_seen.get(conversation)
+                if seen is None or seen >= idle_before or conversation in self._pending_conversations:
+                    continue
+                del self._conversation_seen[conversation]
+                self._conversations.get(name, {}).pop(key, None)
+
+    @classmethod
+    def _resolve_state(cls, state) -> tuple:
+        """
+        Get the state to store for a conversation. A run_async handler gives a (previous state, Promise) pair,
+        which stands for the previous state until the handler is done.
+        Return: (state, None to delete the conversation; False if the handler is still running)
+        """
+        if not (isinstance(state, tuple) and len(state) == 2 and isinstance(state[1], Promise)):
+            return state, True
+
+        previous, promise = state
+        previous, _ = cls._resolve_state(previous)
+        if not promise.done.is_set():
+            return previous, False
+        if promise.exception is not None:
+            return previous, True
+
+        result = promise.result()
+        if result is None:
+            return previous, True
+        if result == ConversationHandler.END:
+            return None, True
+
+        return result, True
@@ -0,0 +1,214 @@
+import heapq
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+
+from config.settings import get_settings
+from src.services.container_service import LazyService
+from src.services.ranking_service import RankingService, haversine
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_DEGREE = 111320
+
+
+class PoiIndex:
+    """
+    Immutable in-memory spatial index of points of interest.
+    Points are bucketed in a grid of cell_degrees cells, and every cell keeps a posting list per category,
+    so a nearby search only looks at the points of the requested categories in the cells around the location.
+    """
+
+    def __init__(self, items: list, cell_degrees: float = 0.25):
+        """
+        Args:
+            items: PoiRecord of every point of interest.
+            cell_degrees: size of a grid cell, in degrees.
+        """
+        self.cell_degrees = cell_degrees
+        self.items = items
+        self.categories = set()
+        self._cells = defaultdict(lambda: defaultdict(list))  # (x, y) -> category -> [item index]
+        self._points = []  # item index -> (latitude, longitude)
+
+        for index, item in enumerate(items):
+            self._points.append((item.latitude, item.longitude))
+            cell = self._cells[self._cell(item.latitude, item.longitude)]
+            for category in item.category:
+                cell[category].append(index)
+                self.categories.add(category)
+
+        self._cells = {key: dict(cell) for key, cell in self._cells.items()}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def search(self, latitude: float, longitude: float, categories: list = None, skip: int = 0, limit: int = 20,
+        min_distance: int = 0, max_distance: int = 500000) -> list:
+        """
+        Nearby search, with the same semantics as SafeRefugeApiService.get_points_of_interest.
+        Cells are visited in rings around the location, and the search stops as soon as
+        no point of the next ring can be closer than the results found so far.
+        Return: list of PoiRecord with their distance in meters, nearest first.
+        """
+        wanted = list(categories) if categories else None
+        needed = skip + limit
+        center_x, center_y = self._cell(latitude, longitude)
+
+        # Smallest cell side around the location, so ring r is at least (r - 1) cells away
+        lat_span = max_distance / METERS_PER_DEGREE
+        far_latitude = min(89.0, abs(latitude) + lat_span)
+        cell_meters = self.cell_degrees * METERS_PER_DEGREE * math.cos(math.radians(far_latitude))
+        max_ring = math.ceil(max_distance / max(cell_meters, 1.0)) + 1
+
+        results = []
+        seen = set()  # A point with several wanted categories is in several posting lists
+        for ring in range(max_ring + 1):
+            if len(results) >= needed and heapq.nsmallest(needed, results)[-1][0] <= (ring - 1) * cell_meters:
+                break
+
+            for x, y in self._ring(center_x, center_y, ring):
+                cell = self._cells.get((x, y))
+                if cell is None:
+                    continue
+                for category in (wanted or cell):
+                    for index in cell.get(category, ()):
+                        if index in seen:
+                            continue
+                        seen.add(index)
+                        item_latitude, item_longitude = self._points[index]
+                        distance = haversine(latitude, longitude, item_latitude, item_longitude)
+                        if min_distance <= distance <= max_distance:
+                            results.append((distance, index))
+
+        nearest = heapq.nsmallest(needed, results)
+        return [self.items[index].with_distance(distance) for distance, index in nearest[skip:]]
+
+    @staticmethod
+    def _ring(center_x: int, center_y: int, ring: int):
+        """
+        Cells at Chebyshev distance `ring` from the center cell.
+        """
+        if ring == 0:
+            yield center_x, center_y
+            return
+
+        for x in range(center_x - ring, center_x + ring + 1):
+            yield x, center_y - ring
+            yield x, center_y + ring
+        for y in range(center_y - ring + 1, center_y + ring):
+            yield center_x - ring, y
+            yield center_x + ring, y
+
+    def _cell(self, latitude: float, longitude: float) -> tuple:
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+
+class PoiIndexService:
+    """
+    Service keeping a local replica of the points of interest, synced periodically from safe-refuge API.
+    Nearby searches are answered from the replica when it is enabled and loaded, and from the API otherwise.
+    """
+
+    settings = LazyService(get_settings)
+
+    index = None
+    synced_at = None
+    _sync_thread = None
+    _listeners = []  # callables(list of added or changed PoiRecord)
+
+    @staticmethod
+    def add_listener(callback) -> None:
+        """
+        Call callback(items) with the points of interest added or changed by each sync, after the first one.
+        """
+        PoiIndexService._listeners.append(callback)
+
+    @staticmethod
+    def get_changes(previous: PoiIndex, items: list) -> list:
+        """
+        Return: list of the items that are not in the previous index, or differ from it.
+        """
+        states = {item.id: item.to_state() for item in previous.items}
+        return [item for item in items if states.get(item.id) != item.to_state()]
+
+    @staticmethod
+    def sync() -> PoiIndex:
+        """
+        Download every point of interest, page by page, and replace the index with a new one.
+        """
+        page_size = PoiIndexService.settings.poi_index_page_size
+        items = []
+        while True:
+            count = len(items)
+            items.extend(SafeRefugeApiService.get_points_of_interest(chat_id=None, skip=count, limit=page_size, add_distance=False))
+            if len(items) - count < page_size:
+                break
+
+        index = PoiIndex(items, PoiIndexService.settings.poi_index_cell_degrees)
+        previous, PoiIndexService.index = PoiIndexService.index, index
+        PoiIndexService.synced_at = time.time()
+        logger.info("Synced %s points of interest in %s categories", len(index), len(index.categories))
+
+        changes = PoiIndexService.get_changes(previous, items) if previous is not None else []
+        for listener in (PoiIndexService._listeners if changes else ()):
+            try:
+                listener(changes)
+            except Exception as error:
+                logger.warning("Points of interest listener failed: %r", error)
+        return index
+
+    @staticmethod
+    def start_sync() -> None:
+        """
+        Start syncing the index in the background, every POI_INDEX_SYNC_INTERVAL seconds.
+        """
+        if PoiIndexService._sync_thread is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    PoiIndexService.sync()
+                except Exception as error:
+                    # Keep serving the previous replica
+                    logger.warning("Failed to sync points of interest: %r", error)
+                time.sleep(PoiIndexService.settings.poi_index_sync_interval)
+
+        PoiIndexService._sync_thread = threading.Thread(target=run, name="poi-index-sync", daemon=True)
+        PoiIndexService._sync_thread.start()
+
+    @staticmethod
+    def get_search_index() -> PoiIndex | None:
+        """
+        Returns the index answering the nearby searches: the replica once loaded, when POI_INDEX_ENABLED.
+        The replica synced for the subscription alerts alone does not change where searches are answered from.
+        """
+        return PoiIndexService.index if PoiIndexService.settings.poi_index_enabled else None
+
+    @staticmethod
+    def search_nearby(chat_id: int, latitude: float, longitude: float, categories: list = None, skip: int = 0,
+        limit: int = 20) -> list:
+        """
+        Search points of interest around a location, from the local index if it is enabled and loaded,
+        and from the API through the search cache otherwise.
+        A pool of candidates is fetched from the first one, and ranked, see RankingService.
+        Return: list of PoiRecord with their distance in meters, nearest first.
+        """
+        pool_size = RankingService.get_pool_size(skip + limit)
+        index = PoiIndexService.get_search_index()
+        if index is not None:
+            candidates = index.search(latitude, longitude, categories, limit=pool_size)
+        else:
+            candidates = SafeRefugeApiService.search_nearby(
+                chat_id=chat_id,
+                limit=pool_size,
+                latitude=latitude,
+                longitude=longitude,
+                categories=categories
+            )
+
+        return RankingService.rank(latitude, longitude, candidates, skip + limit)[skip:]
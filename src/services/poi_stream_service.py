@@ -0,0 +1,189 @@
+import codecs
+import json
+
+
+class PoiRecord:
+    """
+    Compact point of interest, with only the fields the bot uses.
+    """
+
+    __slots__ = ('id', 'name', 'category', 'coordinates', 'distance')
+
+    def __init__(self, id, name: str, category: tuple, coordinates: tuple, distance: float = None):
+        """
+        Args:
+            id: id of the point in safe-refuge API.
+            name: name of the point.
+            category: tuple of its categories.
+            coordinates: (longitude, latitude), in the order of the API.
+            distance: distance from the searched location, in meters. Default: None
+        """
+        self.id = id
+        self.name = name
+        self.category = category
+        self.coordinates = coordinates
+        self.distance = distance
+
+    @classmethod
+    def from_item(cls, item: dict) -> "PoiRecord":
+        """
+        Creates a record from a point of interest item, as returned by the API.
+        """
+        category = item.get("categories") or item.get("category") or ()
+        longitude, latitude = item["geo"]["coordinates"][:2]
+        return cls(
+            item.get("id"),
+            item["name"],
+            (category,) if isinstance(category, str) else tuple(category),
+            (longitude, latitude),
+            item.get("distance")
+        )
+
+    @property
+    def longitude(self) -> float:
+        return self.coordinates[0]
+
+    @property
+    def latitude(self) -> float:
+        return self.coordinates[1]
+
+    def with_distance(self, distance: float) -> "PoiRecord":
+        return PoiRecord(self.id, self.name, self.category, self.coordinates, distance)
+
+    def to_state(self) -> list:
+        return [self.id, self.name, list(self.category), list(self.coordinates), self.distance]
+
+    @classmethod
+    def from_state(cls, state: list) -> "PoiRecord":
+        id, name, category, coordinates, distance = state
+        return cls(id, name, tuple(category), tuple(coordinates), distance)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PoiRecord) and self.to_state() == other.to_state()
+
+    def __repr__(self) -> str:
+        return f'PoiRecord({self.id!r}, {self.name!r}, distance={self.distance!r})'
+
+
+class JsonItemsReader:
+    """
+    Incremental reader of a JSON document arriving in chunks.
+    Values are decoded one at a time with JSONDecoder.raw_decode, and the text already decoded is dropped,
+    so memory stays bounded by the size of the largest value rather than the size of the document.
+    """
+
+    def __init__(self, chunks):
+        """
+        Args:
+            chunks: iterable of UTF-8 encoded bytes.
+        """
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+
+    def peek(self) -> str:
+        """
+        Return: the next non-whitespace character, without consuming it.
+        """
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in ' \t\n\r':
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read():
+                raise ValueError('Unexpected end of JSON document')
+
+    def expect(self, char: str) -> None:
+        """
+        Consume the next non-whitespace character, which must be `char`.
+        """
+        found = self.peek()
+        if found != char:
+            raise ValueError(f'Expected {char!r} in JSON document, found {found!r}')
+        self._position += 1
+
+    def value(self):
+        """
+        Decode the next JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+
+            # A number ending with the buffer may go on in the next chunk
+            if end == len(self._buffer) and self._read():
+                continue
+
+            self._position = end
+            return value
+
+    def iter_array(self, key: str):
+        """
+        Iterate over the values of the array `key` of the top level object.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            return
+
+        while True:
+            name = self.value()
+            self.expect(':')
+            if name == key:
+                yield from self._iter_values()
+                return
+
+            self.value()
+            if self.peek() == '}':
+                return
+            self.expect(',')
+
+    def _iter_values(self):
+        self.expect('[')
+        if self.peek() == ']':
+            return
+
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                return
+            self.expect(',')
+
+    def _read(self) -> bool:
+        """
+        Append the next chunk to the buffer, dropping the part already decoded.
+        Return: False at the end of the document.
+        """
+        if self._eof:
+            return False
+
+        for chunk in self._chunks:
+            text = self._text_decoder.decode(chunk)
+            if text:
+                self._buffer = self._buffer[self._position:] + text
+                self._position = 0
+                return True
+
+        self._eof = True
+        text = self._text_decoder.decode(b'', final=True)
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+        return bool(text)
+
+
+def iter_json_items(chunks, key: str = "items"):
+    """
+    Incrementally parse the items of the array `key` of a JSON object, like an API response body.
+    Args:
+        chunks: iterable of UTF-8 encoded bytes, like requests.Response.iter_content().
+        key: name of the array.
+    Return: iterator of the decoded items.
+    """
+    return JsonItemsReader(chunks).iter_array(key)
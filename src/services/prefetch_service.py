@@ -0,0 +1,243 @@
+import contextvars
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config.settings import get_settings
+from src.services.container_service import LazyService
+from src.services.metrics_service import MetricsService
+from src.services.poi_index_service import PoiIndexService
+from src.services.ranking_service import RankingService
+from src.services.results_service import ResultsService
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchedSearch:
+    """
+    Speculative searches of a chat around a location: one pool of candidates per set of categories.
+    """
+
+    __slots__ = ('location', 'queries', 'expires_at')
+
+    def __init__(self, location: tuple, expires_at: float):
+        self.location = location
+        self.queries = {}  # frozenset of categories -> Future of the candidates
+        self.expires_at = expires_at
+
+    def covered(self) -> frozenset:
+        return frozenset().union(*self.queries)
+
+
+class SearchPrefetcher:
+    """
+    Runs the searches of the chats in the background before they are asked for, one entry per chat.
+    The search of each new set of categories only fetches the categories not prefetched yet: the candidates
+    of a search are the nearest ones of the union of the pools of its categories, since a point among the
+    nearest of several categories is among the nearest of its own.
+    """
+
+    def __init__(self, search, workers: int = 8, ttl: float = 120, max_chats: int = 10000):
+        """
+        Args:
+            search: search(chat_id, latitude, longitude, categories) returning the candidates of a search.
+            workers: threads running the prefetches.
+            ttl: seconds a prefetched search is kept.
+            max_chats: maximum number of chats with prefetched searches, the oldest ones are dropped.
+        """
+        self.search = search
+        self.ttl = ttl
+        self.max_chats = max_chats
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        self._chats = OrderedDict()  # chat id -> PrefetchedSearch
+
+    def prefetch(self, chat_id: int, location: tuple, categories: list) -> None:
+        """
+        Start the search of the categories not prefetched yet around a location, in the background.
+        The prefetched searches of the chat around another location are dropped.
+        Args:
+            location: (latitude, longitude), snapped like the search cache keys.
+        """
+        now = time.monotonic()
+        dropped = []
+        with self._lock:
+            entry = self._chats.get(chat_id)
+            if entry is None or entry.location != location or entry.expires_at <= now:
+                if entry is not None:
+                    dropped.append(entry)
+                entry = self._chats[chat_id] = PrefetchedSearch(location, now + self.ttl)
+            self._chats.move_to_end(chat_id)
+
+            missing = frozenset(categories) - entry.covered()
+            if missing:
+                # Run in the context of the caller, so the search logs the id of the update that started it
+                context = contextvars.copy_context()
+                entry.queries[missing] = self._executor.submit(context.run, self.search, chat_id, *location, sorted(missing))
+                MetricsService.prefetches.inc(result='started')
+
+            while len(self._chats) > self.max_chats:
+                dropped.append(self._chats.popitem(last=False)[1])
+
+        for entry in dropped:
+            self._discard(entry.queries.values())
+
+    def take(self, chat_id: int, location: tuple, categories: list):
+        """
+        Get the candidates of a search from the prefetched searches of the chat, waiting for the ones still
+        running and fetching the categories that were not prefetched. The prefetched searches are forgotten.
+        Return: list of the candidate pools, or None if no prefetched search is of use
+        """
+        with self._lock:
+            entry = self._chats.pop(chat_id, None)
+        if entry is None:
+            return None
+
+        requested = frozenset(categories)
+        if entry.location != location or entry.expires_at <= time.monotonic():
+            self._discard(entry.queries.values())
+            return None
+
+        used = {query: future for query, future in entry.queries.items() if query <= requested}
+        self._discard(future for query, future in entry.queries.items() if query not in used)
+        if not used:
+            return None
+
+        pools = []
+        for query, future in used.items():
+            # Not started yet: searched here rather than waiting for a free prefetch thread
+            if future.cancel():
+                pools.append(self.search(chat_id, *location, sorted(query)))
+            else:
+                try:
+                    pools.append(future.result())
+                except Exception as error:
+                    # Searched again by the caller, which handles the errors
+                    logger.warning("Prefetched search failed: %r", error)
+                    MetricsService.prefetches.inc(result='failed')
+                    return None
+            MetricsService.prefetches.inc(result='used')
+
+        missing = requested.difference(*used)
+        if missing:
+            pools.append(self.search(chat_id, *location, sorted(missing)))
+        return pools
+
+    def cancel(self, chat_id: int) -> None:
+        """
+        Drop the prefetched searches of a chat. The ones not started yet are cancelled.
+        """
+        with self._lock:
+            entry = self._chats.pop(chat_id, None)
+        if entry is not None:
+            self._discard(entry.queries.values())
+
+    def _discard(self, futures) -> None:
+        for future in futures:
+            future.cancel()
+            MetricsService.prefetches.inc(result='wasted')
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"chats": len(self._chats), "searches": sum(len(entry.queries) for entry in self._chats.values())}
+
+
+class PrefetchService:
+    """
+    Service prefetching the nearby searches of the chats, when PREFETCH_ENABLED and the points of interest
+    are searched through the API (the local index answers at once).
+    """
+
+    settings = LazyService(get_settings)
+
+    # SearchPrefetcher, or None when it is disabled
+    prefetcher = LazyService(lambda: SearchPrefetcher(
+        search=PrefetchService.search_candidates,
+        workers=PrefetchService.settings.prefetch_workers,
+        ttl=PrefetchService.settings.prefetch_ttl,
+        max_chats=PrefetchService.settings.prefetch_max_chats
+    ) if PrefetchService.settings.prefetch_enabled else None)
+
+    @staticmethod
+    def get_pool_size() -> int:
+        """
+        Number of candidates of the first page of results, see fetch_results_page.
+        """
+        return RankingService.get_pool_size(ResultsService.page_size + 1)
+
+    @staticmethod
+    def get_location(latitude: float, longitude: float) -> tuple:
+        """
+        Return: the location of a search, snapped like the search cache keys
+        """
+        return SafeRefugeApiService.get_search_key(latitude, longitude)[:2]
+
+    @staticmethod
+    def search_candidates(chat_id: int, latitude: float, longitude: float, categories: list) -> list:
+        return SafeRefugeApiService.search_nearby(
+            chat_id=chat_id,
+            limit=PrefetchService.get_pool_size(),
+            latitude=latitude,
+            longitude=longitude,
+            categories=categories
+        )
+
+    @staticmethod
+    def prefetch(chat_id: int, latitude: float, longitude: float, categories: list) -> None:
+        """
+        Start searching points of interest of the categories around a location, in the background,
+        so they are ready when the chat asks for them.
+        """
+        prefetcher = PrefetchService.prefetcher
+        if prefetcher is None or PoiIndexService.get_search_index() is not None or not categories:
+            return
+        prefetcher.prefetch(chat_id, PrefetchService.get_location(latitude, longitude), categories)
+
+    @staticmethod
+    def cancel(chat_id: int) -> None:
+        """
+        Drop the prefetched searches of a chat.
+        """
+        prefetcher = PrefetchService.prefetcher
+        if prefetcher is not None:
+            prefetcher.cancel(chat_id)
+
+    @staticmethod
+    def search_nearby(chat_id: int, latitude: float, longitude: float, categories: list = None, skip: int = 0,
+        limit: int = 20) -> list:
+        """
+        Search points of interest around a location like PoiIndexService.search_nearby, from the prefetched
+        searches of the chat when they are of use. The merged candidates are cached like the ones of an API
+        search, so the next pages of the results are served from the cache.
+        Return: list of PoiRecord with their distance in meters, nearest first.
+        """
+        prefetcher = PrefetchService.prefetcher
+        pool_size = RankingService.get_pool_size(skip + limit)
+        if prefetcher is None or skip or not categories or pool_size != PrefetchService.get_pool_size():
+            return PoiIndexService.search_nearby(chat_id, latitude, longitude, categories, skip, limit)
+
+        key = SafeRefugeApiService.get_search_key(latitude, longitude, categories, 0, pool_size)
+        pools = prefetcher.take(chat_id, key[:2], categories)
+        if pools is None:
+            return PoiIndexService.search_nearby(chat_id, latitude, longitude, categories, skip, limit)
+
+        candidates = SafeRefugeApiService.search_cache.get(key, lambda: PrefetchService.merge(key[0], key[1], pools, pool_size))
+        return RankingService.rank(latitude, longitude, list(candidates), limit)
+
+    @staticmethod
+    def merge(latitude: float, longitude: float, pools: list, pool_size: int) -> tuple:
+        """
+        Return: the pool_size points of the pools nearest to the location, each once
+        """
+        items = list({item.id: item for pool in pools for item in pool}.values())
+        if len(pools) == 1:
+            return tuple(items[:pool_size])
+
+        distances = RankingService.distances(latitude, longitude, items)
+        nearest = heapq.nsmallest(pool_size, range(len(items)), key=distances.__getitem__)
+        return tuple(items[index] for index in nearest)
@@ -0,0 +1,111 @@
+import heapq
+import math
+from functools import lru_cache
+
+from config.settings import get_settings
+from src.services.container_service import LazyService
+
+EARTH_RADIUS = 6371008.8  # meters
+
+
+def haversine(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """
+    Great-circle distance between two points, in meters.
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+@lru_cache(maxsize=None)
+def get_numpy():
+    """
+    Return: the numpy module, imported on first use, or None if it is not installed (see the "fast" extra)
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class RankingService:
+    """
+    Service ranking candidate points of interest around a location: nearest first, with points at about
+    the same distance ordered to vary the categories shown, and near-identical points (same name, a few
+    meters apart) shown once. Distances are computed in-process from the exact location, since the searches
+    are cached by a snapped one, see SEARCH_CACHE_GRID_DEGREES.
+    """
+
+    settings = LazyService(get_settings)
+
+    @staticmethod
+    def get_pool_size(needed: int) -> int:
+        """
+        Number of candidates to fetch to rank the first `needed` points: a multiple of RANKING_CANDIDATES,
+        so the pages of a search share their candidates.
+        """
+        candidates = max(RankingService.settings.ranking_candidates, 1)
+        return max(1, math.ceil(needed / candidates)) * candidates
+
+    @staticmethod
+    def distances(latitude: float, longitude: float, items: list) -> list:
+        """
+        Haversine distances from a location to points of interest, in meters. Vectorized with NumPy for
+        RANKING_NUMPY_MIN_ITEMS points or more, when it is installed.
+        """
+        numpy = get_numpy()
+        if numpy is None or len(items) < RankingService.settings.ranking_numpy_min_items:
+            return [haversine(latitude, longitude, item.latitude, item.longitude) for item in items]
+
+        coordinates = numpy.radians(numpy.array([item.coordinates[:2] for item in items], dtype=float))
+        item_longitudes, item_latitudes = coordinates[:, 0], coordinates[:, 1]
+        latitude, longitude = math.radians(latitude), math.radians(longitude)
+        a = (numpy.sin((item_latitudes - latitude) / 2) ** 2
+            + math.cos(latitude) * numpy.cos(item_latitudes) * numpy.sin((item_longitudes - longitude) / 2) ** 2)
+        return (2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))).tolist()
+
+    @staticmethod
+    def rank(latitude: float, longitude: float, items: list, limit: int) -> list:
+        """
+        The best `limit` points of interest around a location. The candidates are heapified and popped
+        until enough are selected, so only the selected ones are ordered.
+        Args:
+            items: candidate PoiRecord.
+            limit: number of points returned.
+        Return: list of PoiRecord with their distance from the location, in meters.
+        """
+        tie_meters = RankingService.settings.ranking_tie_meters
+        dedup_meters = RankingService.settings.ranking_dedup_meters
+
+        distances = RankingService.distances(latitude, longitude, items)
+        heap = [(distance // tie_meters if tie_meters else distance, distance, index) for index, distance in enumerate(distances)]
+        heapq.heapify(heap)
+
+        ranked = []
+        shown = {}  # category -> points selected in it
+        kept = {}  # normalized name -> locations of the points selected with it
+        while heap and len(ranked) < limit:
+            # Points at about the same distance: the ones of the categories shown the least go first
+            tie = heap[0][0]
+            group = []
+            while heap and heap[0][0] == tie:
+                group.append(heapq.heappop(heap)[1:])
+
+            while group and len(ranked) < limit:
+                best = min(group, key=lambda entry: (sum(shown.get(category, 0) for category in items[entry[1]].category), entry))
+                group.remove(best)
+                distance, index = best
+                item = items[index]
+
+                name = " ".join(item.name.casefold().split())
+                if any(
+                    haversine(item.latitude, item.longitude, *location) <= dedup_meters for location in kept.get(name, ())
+                ):
+                    continue
+                kept.setdefault(name, []).append((item.latitude, item.longitude))
+                for category in item.category:
+                    shown[category] = shown.get(category, 0) + 1
+                ranked.append(item.with_distance(distance))
+
+        return ranked
@@ -0,0 +1,117 @@
+from html import escape
+
+from telegram import InlineQueryResultVenue, Location
+
+from config.settings import get_settings
+from src.services.container_service import LazyService
+from src.services.keyboards_service import KeyboardService
+from src.services.poi_stream_service import PoiRecord
+
+
+class ResultsService:
+    """
+    Service for rendering points of interest search results.
+    """
+
+    settings = LazyService(get_settings)
+
+    page_size = LazyService(lambda: ResultsService.settings.results_page_size)
+    map_url = 'https://www.google.com/maps/search/?api=1&query={latitude},{longitude}'
+
+    @staticmethod
+    def get_location(item: PoiRecord) -> Location:
+        """
+        Return: Location of a point of interest.
+        """
+        return Location(item.longitude, item.latitude)
+
+    @staticmethod
+    def get_categories(item: PoiRecord) -> str:
+        """
+        Return: comma separated categories of a point of interest.
+        """
+        return ", ".join(item.category)
+
+    @staticmethod
+    def format_distance(distance) -> str:
+        """
+        Format a distance in meters, like: 350 m, 12.4 km
+        """
+        if distance is None:
+            return ""
+        if distance < 1000:
+            return f"{distance:.0f} m"
+
+        return f"{distance / 1000:.1f} km"
+
+    @staticmethod
+    def _format_item(item: PoiRecord) -> str:
+        """
+        Format a point of interest as HTML: its name, then its categories, distance and map link.
+        """
+        location = ResultsService.get_location(item)
+        map_url = ResultsService.map_url.format(latitude=location.latitude, longitude=location.longitude)
+        details = " · ".join(
+            detail for detail in (
+                escape(ResultsService.get_categories(item)),
+                ResultsService.format_distance(item.distance),
+                f'<a href="{map_url}">map</a>'
+            ) if detail
+        )
+        return f'<b>{escape(item.name)}</b>\n{details}'
+
+    @staticmethod
+    def render_page(items: list, token: int, skip: int, page_size: int, has_next: bool) -> tuple:
+        """
+        Render one page of results as a single HTML message.
+        Args:
+            items: PoiRecord of the page.
+            token: id of the search, echoed in the callback data of the buttons.
+            skip: index of the first item of the page in the whole result list.
+            page_size: number of items per page.
+            has_next: whether there is a page after this one.
+        Return: (text, InlineKeyboardMarkup) of the message
+        """
+        lines = ['<b>Here are the nearest points of interest:</b>\n']
+        for index, item in enumerate(items, start=skip + 1):
+            lines.append(f'{index}. {ResultsService._format_item(item)}')
+
+        keyboard = KeyboardService.get_results_inline_keyboard(token, skip, len(items), page_size, has_next)
+        return "\n".join(lines), keyboard
+
+    @staticmethod
+    def render_alert(items: list, total: int = None) -> str:
+        """
+        Render the alert of new points of interest near a subscription, as a single HTML message.
+        Args:
+            items: PoiRecord listed, with their distance from the subscribed location.
+            total: number of new points, when only some are listed.
+        """
+        lines = ['<b>New points of interest near you:</b>\n']
+        for item in items:
+            lines.append(ResultsService._format_item(item))
+
+        if total is not None and total > len(items):
+            lines.append(f'\n…and {total - len(items)} more, /search to see them all.')
+        lines.append('\n/unsubscribe to stop these alerts.')
+        return "\n".join(lines)
+
+    @staticmethod
+    def render_inline_results(items: list) -> list:
+        """
+        Render results as answers of an inline query: a venue per point of interest, sent as a map pin when picked.
+        Return: list of InlineQueryResultVenue
+        """
+        results = []
+        for index, item in enumerate(items):
+            details = " · ".join(
+                detail for detail in (ResultsService.get_categories(item), ResultsService.format_distance(item.distance)) if detail
+            )
+            results.append(InlineQueryResultVenue(
+                id=str(index),
+                latitude=item.latitude,
+                longitude=item.longitude,
+                title=item.name,
+                address=details or item.name
+            ))
+        return results
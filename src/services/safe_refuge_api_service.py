@@ -1,12 +1,19 @@
 import logging
-import os
 import requests
 
-from telegram import Location
 from urllib.parse import unquote
-from config.settings import Settings
+from config.settings import get_settings
+from src.services.cache_service import SingleFlightCache, TTLValueCache
+from src.services.circuit_breaker_service import CircuitBreaker
+from src.services.container_service import LazyService
+from src.services.http_client_service import HttpClient
+from src.services.logging_service import LoggingService
+from src.services.metrics_service import MetricsService
+from src.services.poi_stream_service import iter_json_items, PoiRecord
+from src.services.shared_store_service import SharedStoreService
 
 logger = logging.getLogger(__name__)
+sampled_logger = LoggingService.get_sampled_logger(__name__)
 
 
 class SafeRefugeApiService:
@@ -14,21 +21,52 @@ class SafeRefugeApiService:
     Service for safe-refuge API.
     """
 
-    settings = Settings(_env_file="config/.env")
+    # The settings, clients and caches are built on first use, see LazyService
+    settings = LazyService(get_settings)
 
-    api_root_url = settings.safe_refuge_root_url
+    # Pooled keep-alive session shared by every API call
+    http = LazyService(lambda: HttpClient.from_settings(SafeRefugeApiService.settings))
+
+    # Every API call goes through the circuit breaker, so handlers fail fast while the API is down
+    breaker = LazyService(lambda: MetricsService.register_circuit(
+        'safe_refuge', CircuitBreaker.from_settings("safe_refuge", SafeRefugeApiService.settings)
+    ))
+
+    api_root_url = LazyService(lambda: SafeRefugeApiService.settings.safe_refuge_root_url)
     # api_current_version = 'v1'
 
     # Common urls
-    category_list = f'{api_root_url}common'
+    category_list = LazyService(lambda: f'{SafeRefugeApiService.api_root_url}common')
 
     # User urls
-    user_list = f'{api_root_url}user'
+    user_list = LazyService(lambda: f'{SafeRefugeApiService.api_root_url}user')
 
     # Nearby point of interest urls
-    point_of_interest = f'{api_root_url}poi/'
-    nearby = f'{point_of_interest}nearby'
-    search = f'{point_of_interest}search'
+    point_of_interest = LazyService(lambda: f'{SafeRefugeApiService.api_root_url}poi/')
+    nearby = LazyService(lambda: f'{SafeRefugeApiService.point_of_interest}nearby')
+    search = LazyService(lambda: f'{SafeRefugeApiService.point_of_interest}search')
+
+    # Size of the chunks streamed responses are parsed by
+    stream_chunk_size = 16384
+
+    # Categories rarely change, so they are cached in-process and refreshed in the background.
+    # With a shared store, the replicas share them too
+    shared_category_cache = LazyService(lambda: SharedStoreService.get_cache('category'))
+    category_cache = LazyService(lambda: MetricsService.register_cache('category', TTLValueCache(
+        loader=lambda: tuple(SafeRefugeApiService.load_category_list()),
+        ttl=SafeRefugeApiService.settings.category_cache_ttl,
+        error_ttl=SafeRefugeApiService.settings.category_cache_error_ttl,
+        name="category_cache"
+    )))
+
+    # Identical nearby searches, from any chat, share one API call for a few seconds.
+    # While the API is unavailable, the last results of a search keep being served
+    search_cache = LazyService(lambda: MetricsService.register_cache('search', SingleFlightCache(
+        ttl=SafeRefugeApiService.settings.search_cache_ttl,
+        max_size=SafeRefugeApiService.settings.search_cache_size,
+        name="search_cache",
+        stale_ttl=SafeRefugeApiService.settings.search_cache_stale_ttl
+    )))
 
     
     @staticmethod
@@ -42,16 +80,42 @@ class SafeRefugeApiService:
             str: url address with the params.
         """
         params = {k: v for k, v in params.items() if v is not None}
-        logger.info(f"Request params: {params}")
+        sampled_logger.debug("Request params", params=params)
         return f'{url}?{requests.compat.urlencode(params)}'
     
+    @staticmethod
+    def fetch_category_list():
+        """
+        Fetch the list of categories from safe-refuge API, bypassing the cache.
+        Raises CircuitOpenError while the API is unavailable.
+        """
+        with SafeRefugeApiService.breaker.guard(), MetricsService.time_upstream('category'):
+            response = SafeRefugeApiService.http.get(SafeRefugeApiService.category_list)
+            response.raise_for_status()
+            return [item['category'] for item in response.json()['items']]
+
+    @staticmethod
+    def load_category_list() -> list:
+        """
+        Load the list of categories from the shared store if another replica fetched it recently,
+        from safe-refuge API otherwise.
+        """
+        shared = SafeRefugeApiService.shared_category_cache
+        categories = shared.get('list') if shared is not None else None
+        if categories is None:
+            categories = SafeRefugeApiService.fetch_category_list()
+            if shared is not None:
+                shared.set('list', categories, SafeRefugeApiService.settings.category_cache_ttl)
+        return categories
+
     @staticmethod
     def get_category_list():
         """
-        Get a list of categories from safe-refuge API.
+        Get the categories from safe-refuge API.
+        Served from the categories cache, see CATEGORY_CACHE_TTL.
+        Return: tuple of categories, the same object until the cache is refreshed
         """
-        response = requests.get(SafeRefugeApiService.category_list)
-        return [item['category'] for item in response.json()['items']]
+        return SafeRefugeApiService.category_cache.get()
 
     @staticmethod
     def get_remaining_categories(except_categories: list = None) -> list:
@@ -67,16 +131,14 @@ class SafeRefugeApiService:
         return [category for category in categories if category not in except_categories]
 
     @staticmethod
-    def get_points_of_interest(chat_id: int, skip: int = 0, limit: int = 20, latitude: float = None,
-        longitude: float = None, min_distance: int = 0, max_distance: int = 500000, categories: dict = None, organizations: str = None,
+    def get_search_url(skip: int = 0, limit: int = 20, latitude: float = None, longitude: float = None,
+        min_distance: int = 0, max_distance: int = 500000, categories: dict = None, organizations: str = None,
         city: str = None, country: str = None, approved: bool = None, active: bool = None, author: str = None, admin: str = None,
         add_distance: bool = True,  fields: str = "basic"):
         """
-        Search point. Nearby and/or by filtering.
-        Get a list of points of interest from safe-refuge API.
+        Url of a points search. Nearby and/or by filtering.
 
         Args:
-            chat_id: chat id.
             skip: skip items (Pagination start item index). Default: 0
             limit: Limit the number of items to return (Pagination page size). Default: 20
             latitude: Geo latitude for nearby search. Like: 32.0897. Default: None
@@ -95,7 +157,7 @@ class SafeRefugeApiService:
             fields: (optional) Format of the returned points. "compact", "basic" or "full". Default: "basic"
 
         Returns:
-            Dictionary: points of interest dict -> {"location name:Location object", ...}
+            str: url address of the search.
         """
 
         params = {
@@ -117,10 +179,68 @@ class SafeRefugeApiService:
             "fields": fields
         }
 
-        api_url = SafeRefugeApiService.generate_url_address(SafeRefugeApiService.search, params)
-        response = requests.get(api_url)
-        logger.info(f'Calling API: {api_url}')
+        return SafeRefugeApiService.generate_url_address(SafeRefugeApiService.search, params)
 
-        items = response.json()["items"]
-        return {item["name"]:Location(item["geo"]["coordinates"][0], item["geo"]["coordinates"][1]) for item in items}
+    @staticmethod
+    def get_points_of_interest(chat_id: int, fields: str = "compact", **kwargs):
+        """
+        Stream points of interest from safe-refuge API.
+        Takes the same arguments as get_search_url, and asks for the "compact" fields by default.
+        The response body is parsed item by item while it downloads, so memory stays bounded whatever the limit.
 
+        Returns:
+            Iterator of PoiRecord, nearest first. Points with the same name are all kept.
+        """
+        api_url = SafeRefugeApiService.get_search_url(fields=fields, **kwargs)
+        sampled_logger.debug("Calling API: %s", SafeRefugeApiService.search)
+
+        # Timed until the whole body is read
+        with SafeRefugeApiService.breaker.guard(), MetricsService.time_upstream('search'):
+            response = SafeRefugeApiService.http.get(api_url, stream=True)
+            try:
+                response.raise_for_status()
+                for item in iter_json_items(response.iter_content(SafeRefugeApiService.stream_chunk_size)):
+                    yield PoiRecord.from_item(item)
+            finally:
+                response.close()
+
+    @staticmethod
+    def get_search_key(latitude: float, longitude: float, categories: list = None, skip: int = 0, limit: int = 20,
+        min_distance: int = 0, max_distance: int = 500000) -> tuple:
+        """
+        Normalized nearby search: categories are sorted and the location is snapped to the
+        SEARCH_CACHE_GRID_DEGREES grid, so searches from close locations share a cache entry.
+        Return: (latitude, longitude, categories, skip, limit, min_distance, max_distance)
+        """
+        grid = SafeRefugeApiService.settings.search_cache_grid_degrees
+        if grid:
+            latitude = round(round(latitude / grid) * grid, 7)
+            longitude = round(round(longitude / grid) * grid, 7)
+
+        return latitude, longitude, tuple(sorted(categories or ())), skip, limit, min_distance, max_distance
+
+    @staticmethod
+    def search_nearby(chat_id: int, latitude: float, longitude: float, categories: list = None, skip: int = 0,
+        limit: int = 20, min_distance: int = 0, max_distance: int = 500000) -> list:
+        """
+        Nearby search of points of interest, through the search cache (see SEARCH_CACHE_*).
+        Concurrent identical searches share a single API call.
+        While the API is unavailable, the last results of the search are served if they are in the cache.
+
+        Returns:
+            list: PoiRecord, nearest first.
+        """
+        key = SafeRefugeApiService.get_search_key(latitude, longitude, categories, skip, limit, min_distance, max_distance)
+        latitude, longitude, categories, skip, limit, min_distance, max_distance = key
+
+        records = SafeRefugeApiService.search_cache.get(key, lambda: tuple(SafeRefugeApiService.get_points_of_interest(
+            chat_id,
+            skip=skip,
+            limit=limit,
+            latitude=latitude,
+            longitude=longitude,
+            min_distance=min_distance,
+            max_distance=max_distance,
+            categories=list(categories)
+        )))
+        return list(records)
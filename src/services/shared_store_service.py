@@ -0,0 +1,383 @@
+import base64
+import fnmatch
+import json
+import logging
+import queue
+import socket
+import socketserver
+import threading
+import time
+from urllib.parse import urlparse
+
+from config.settings import get_settings
+from src.services.container_service import LazyService
+
+logger = logging.getLogger(__name__)
+
+
+class RespError(Exception):
+    """
+    Error reply of the server.
+    """
+
+
+def encode_command(args) -> bytes:
+    """
+    Encode a command as a RESP array of bulk strings, like: *2\r\n$3\r\nGET\r\n$3\r\nkey\r\n
+    """
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+def read_reply(reader):
+    """
+    Read a RESP reply. Error replies are returned as RespError, not raised, so a pipeline reads all its replies.
+    Return: str (simple strings), int, bytes or None (bulk strings), list (arrays) or RespError
+    """
+    line = reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('Connection closed by the server')
+
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest.decode()
+    if kind == b'-':
+        return RespError(rest.decode())
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        length = int(rest)
+        return None if length < 0 else reader.read(length + 2)[:-2]
+    if kind == b'*':
+        length = int(rest)
+        return None if length < 0 else [read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f'Unexpected reply {line[:32]!r}')
+
+
+class RespConnection:
+    """
+    A connection to a Redis-compatible server.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self.socket = socket.create_connection((host, port), timeout=timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.socket.makefile('rb')
+
+    def call(self, commands: list) -> list:
+        """
+        Send the commands at once, then read their replies.
+        """
+        self.socket.sendall(b''.join(encode_command(command) for command in commands))
+        return [read_reply(self.reader) for _ in commands]
+
+    def close(self) -> None:
+        self.reader.close()
+        self.socket.close()
+
+
+class RespClient:
+    """
+    Minimal client of a Redis-compatible server (RESP protocol), safe to share between threads.
+    Commands are pipelined: pipeline() sends a batch of commands in a single round-trip.
+    Idle connections are pooled; a connection that failed is dropped.
+    """
+
+    def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0, password: str = None,
+        timeout: float = 2, pool_size: int = 16):
+        """
+        Args:
+            host, port: address of the server.
+            db: database number, selected on every new connection.
+            password: sent with AUTH on every new connection. Default: None (no AUTH)
+            timeout: seconds to connect, and to wait for replies.
+            pool_size: idle connections kept open.
+        """
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+
+        self.round_trips = 0
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RespClient":
+        """
+        Creates a client from a URL, like: redis://:password@localhost:6379/0
+        """
+        parsed = urlparse(url)
+        return cls(
+            host=parsed.hostname or 'localhost',
+            port=parsed.port or 6379,
+            db=int(parsed.path.strip('/') or 0),
+            password=parsed.password,
+            **kwargs
+        )
+
+    def pipeline(self, commands: list) -> list:
+        """
+        Run commands in a single round-trip.
+        Args:
+            commands: list of commands, each a tuple of arguments like ('SET', key, value, 'EX', 60).
+        Return: list of the replies, RespError for the commands that failed
+        """
+        if not commands:
+            return []
+
+        connection = self._acquire()
+        try:
+            replies = connection.call(commands)
+        except Exception:
+            connection.close()
+            raise
+        self.round_trips += 1
+        self._release(connection)
+        return replies
+
+    def execute(self, *args):
+        """
+        Run a single command.
+        Return: its reply. Raises RespError if it failed.
+        """
+        reply = self.pipeline([args])[0]
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _acquire(self) -> RespConnection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        connection = RespConnection(self.host, self.port, self.timeout)
+        setup = ([('AUTH', self.password)] if self.password else []) + ([('SELECT', self.db)] if self.db else [])
+        for reply in connection.call(setup) if setup else ():
+            if isinstance(reply, RespError):
+                connection.close()
+                raise reply
+        return connection
+
+    def _release(self, connection: RespConnection) -> None:
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+class SharedCache:
+    """
+    Cache shared by the bot replicas, in the shared store: values are compact JSON, expired by the server.
+    Best effort: a failing store is a cache miss.
+    """
+
+    def __init__(self, client: RespClient, namespace: str, prefix: str = ""):
+        """
+        Args:
+            client: client of the shared store.
+            namespace: name of the cache, in its keys.
+            prefix: prefix of every key of the bot.
+        """
+        self.client = client
+        self.key_prefix = f'{prefix}cache:{namespace}:'
+
+    def get(self, key: str):
+        """
+        Return: the cached value, or None
+        """
+        try:
+            value = self.client.execute('GET', self.key_prefix + key)
+        except Exception as error:
+            logger.warning("Shared cache read failed: %r", error)
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value, ttl: float) -> None:
+        try:
+            self.client.execute(
+                'SET', self.key_prefix + key, json.dumps(value, separators=(',', ':')), 'PX', max(1, int(ttl * 1000))
+            )
+        except Exception as error:
+            logger.warning("Shared cache write failed: %r", error)
+
+
+class SharedStoreService:
+    """
+    Service for the store shared by the bot replicas, at SHARED_STORE_URL (disabled when empty).
+    """
+
+    settings = LazyService(get_settings)
+
+    # RespClient, or None when there is no shared store
+    client = LazyService(lambda: RespClient.from_url(
+        SharedStoreService.settings.shared_store_url,
+        timeout=SharedStoreService.settings.shared_store_timeout,
+        pool_size=SharedStoreService.settings.shared_store_pool_size
+    ) if SharedStoreService.settings.shared_store_url else None)
+
+    @staticmethod
+    def get_cache(namespace: str):
+        """
+        Return: SharedCache of the namespace, or None when there is no shared store
+        """
+        client = SharedStoreService.client
+        if client is None:
+            return None
+        return SharedCache(client, namespace, SharedStoreService.settings.shared_store_prefix)
+
+
+class RespStandInServer(socketserver.ThreadingTCPServer):
+    """
+    In-process stand-in of a Redis server, for tests and single host setups. Implements the commands the bot
+    uses (GET, SET with EX/PX, MGET, DEL, EXPIRE, PTTL, SCAN, PING, SELECT, AUTH, FLUSHDB).
+    With a path, the data is loaded from the file on start and written to it on stop.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, listen: str = '127.0.0.1', port: int = 0, path: str = ""):
+        super().__init__((listen, port), _RespStandInHandler)
+        self.path = path
+        self.data = {}  # key -> (value, expires_at monotonic time or None)
+        self.lock = threading.Lock()
+        self.commands = 0
+        if path:
+            self._load()
+
+    @property
+    def url(self) -> str:
+        return f'redis://{self.server_address[0]}:{self.server_address[1]}/0'
+
+    def start(self) -> "RespStandInServer":
+        threading.Thread(target=self.serve_forever, name='resp-stand-in', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self.path:
+            self._save()
+
+    def run(self, args: list):
+        """
+        Run a command.
+        Return: its reply
+        """
+        command = args[0].upper().decode()
+        now = time.monotonic()
+        with self.lock:
+            self.commands += 1
+            if command == 'PING':
+                return 'PONG'
+            if command in ('SELECT', 'AUTH'):
+                return 'OK'
+            if command == 'FLUSHDB':
+                self.data.clear()
+                return 'OK'
+            if command == 'GET':
+                return self._get(args[1], now)
+            if command == 'MGET':
+                return [self._get(key, now) for key in args[1:]]
+            if command == 'SET':
+                expires_at = None
+                options = [arg.upper() for arg in args[3::2]]
+                for option, value in zip(options, args[4::2]):
+                    expires_at = now + (int(value) if option == b'EX' else int(value) / 1000)
+                self.data[args[1]] = (args[2], expires_at)
+                return 'OK'
+            if command == 'DEL':
+                return sum(1 for key in args[1:] if self._get(key, now) is not None and self.data.pop(key))
+            if command == 'EXPIRE':
+                if self._get(args[1], now) is None:
+                    return 0
+                self.data[args[1]] = (self.data[args[1]][0], now + int(args[2]))
+                return 1
+            if command == 'PTTL':
+                if self._get(args[1], now) is None:
+                    return -2
+                expires_at = self.data[args[1]][1]
+                return -1 if expires_at is None else int((expires_at - now) * 1000)
+            if command == 'SCAN':
+                # Single pass: every matching key is returned with cursor 0
+                options = dict(zip((arg.upper() for arg in args[2::2]), args[3::2]))
+                pattern = options.get(b'MATCH', b'*').decode()
+                keys = [key for key in list(self.data) if self._get(key, now) is not None and fnmatch.fnmatchcase(key.decode(), pattern)]
+                return [b'0', keys]
+        return RespError(f"ERR unknown command '{command}'")
+
+    def _get(self, key: bytes, now: float):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self.data[key]
+            return None
+        return entry[0]
+
+    def _load(self) -> None:
+        try:
+            with open(self.path) as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return
+
+        now, wall = time.monotonic(), time.time()
+        for key, (value, expires_at) in snapshot.items():
+            if expires_at is None or expires_at > wall:
+                self.data[base64.b64decode(key)] = (
+                    base64.b64decode(value), None if expires_at is None else now + expires_at - wall
+                )
+
+    def _save(self) -> None:
+        now, wall = time.monotonic(), time.time()
+        with self.lock:
+            snapshot = {
+                base64.b64encode(key).decode(): [base64.b64encode(value).decode(), None if expires_at is None else wall + expires_at - now]
+                for key, (value, expires_at) in self.data.items()
+            }
+        with open(self.path, 'w') as file:
+            json.dump(snapshot, file)
+
+
+class _RespStandInHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                args = read_reply(self.rfile)
+            except (ConnectionError, OSError, ValueError):
+                return
+            if not isinstance(args, list) or not args:
+                return
+
+            self.wfile.write(self._encode(self.server.run(args)))
+
+    @classmethod
+    def _encode(cls, reply) -> bytes:
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, RespError):
+            return b'-%s\r\n' % str(reply).encode()
+        if isinstance(reply, str):
+            return b'+%s\r\n' % reply.encode()
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if isinstance(reply, bytes):
+            return b'$%d\r\n%s\r\n' % (len(reply), reply)
+        return b'*%d\r\n' % len(reply) + b''.join(cls._encode(item) for item in reply)
@@ -0,0 +1,382 @@
+import logging
+import math
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from telegram import ParseMode
+from telegram.error import Unauthorized
+
+from config.settings import Settings, get_settings
+from src.services.container_service import LazyService
+from src.services.message_scheduler_service import TokenBucket
+from src.services.metrics_service import MetricsService
+from src.services.ranking_service import haversine
+from src.services.results_service import ResultsService
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_DEGREE = 111320
+
+
+class Subscription:
+    """
+    Alerts a chat asked for: new points of interest of some categories, within a radius of a location.
+    """
+
+    __slots__ = ('chat_id', 'latitude', 'longitude', 'categories', 'radius')
+
+    def __init__(self, chat_id: int, latitude: float, longitude: float, categories: tuple, radius: float):
+        self.chat_id = chat_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.categories = tuple(categories)
+        self.radius = radius
+
+    def __repr__(self) -> str:
+        return f'Subscription({self.chat_id!r}, {self.categories!r}, radius={self.radius!r})'
+
+
+class SubscriptionIndex:
+    """
+    Spatial index of the subscriptions: a grid of cell_degrees cells per category, listing the chats
+    subscribed around each cell. A point of interest is matched against the subscriptions of its categories
+    in the cells within the largest radius only, whatever the number of subscriptions.
+    """
+
+    def __init__(self, cell_degrees: float = 0.25):
+        self.cell_degrees = cell_degrees
+        self.max_radius = 0.0
+        self._lock = threading.RLock()
+        self._subscriptions = {}  # chat_id -> Subscription
+        self._cells = {}  # category -> (x, y) -> set of chat_id
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def get(self, chat_id: int):
+        return self._subscriptions.get(chat_id)
+
+    def add(self, subscription: Subscription) -> None:
+        """
+        Add a subscription, replacing the previous one of the chat.
+        """
+        with self._lock:
+            self.remove(subscription.chat_id)
+            self._subscriptions[subscription.chat_id] = subscription
+            self.max_radius = max(self.max_radius, subscription.radius)
+            cell = self._cell(subscription.latitude, subscription.longitude)
+            for category in subscription.categories:
+                self._cells.setdefault(category, {}).setdefault(cell, set()).add(subscription.chat_id)
+
+    def reset(self, subscriptions: list) -> None:
+        """
+        Replace every subscription.
+        """
+        with self._lock:
+            self.max_radius = 0.0
+            self._subscriptions = {}
+            self._cells = {}
+            for subscription in subscriptions:
+                self.add(subscription)
+
+    def remove(self, chat_id: int) -> bool:
+        """
+        Return: True if the chat had a subscription.
+        """
+        with self._lock:
+            subscription = self._subscriptions.pop(chat_id, None)
+            if subscription is None:
+                return False
+
+            cell = self._cell(subscription.latitude, subscription.longitude)
+            for category in subscription.categories:
+                chats = self._cells[category][cell]
+                chats.discard(chat_id)
+                if not chats:
+                    del self._cells[category][cell]
+            return True
+
+    def match(self, item) -> list:
+        """
+        Subscriptions a point of interest is of interest to.
+        Args:
+            item: PoiRecord.
+        Return: list of (Subscription, distance in meters)
+        """
+        with self._lock:
+            if not self._subscriptions:
+                return []
+
+            # Cells of the bounding box of the largest radius around the point
+            lat_span = self.max_radius / METERS_PER_DEGREE
+            lng_span = lat_span / max(math.cos(math.radians(min(89.0, abs(item.latitude) + lat_span))), 0.01)
+            min_x, min_y = self._cell(item.latitude - lat_span, item.longitude - lng_span)
+            max_x, max_y = self._cell(item.latitude + lat_span, item.longitude + lng_span)
+
+            chats = set()
+            for category in item.category:
+                cells = self._cells.get(category)
+                if not cells:
+                    continue
+                for x in range(min_x, max_x + 1):
+                    for y in range(min_y, max_y + 1):
+                        chats.update(cells.get((x, y), ()))
+
+            matches = []
+            for chat_id in chats:
+                subscription = self._subscriptions[chat_id]
+                distance = haversine(subscription.latitude, subscription.longitude, item.latitude, item.longitude)
+                if distance <= subscription.radius:
+                    matches.append((subscription, distance))
+            return matches
+
+    def _cell(self, latitude: float, longitude: float) -> tuple:
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+
+class SubscriptionStore:
+    """
+    SQLite table of the subscriptions, shared by the webhook worker processes. Without a path they are kept in memory.
+    """
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS subscription '
+            '(chat_id INTEGER PRIMARY KEY, latitude REAL NOT NULL, longitude REAL NOT NULL, categories TEXT NOT NULL, radius REAL NOT NULL)'
+        )
+        self._db.commit()
+
+    def load(self) -> list:
+        """
+        Return: list of every Subscription
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT chat_id, latitude, longitude, categories, radius FROM subscription').fetchall()
+        return [
+            Subscription(chat_id, latitude, longitude, tuple(categories.split('\n')), radius)
+            for chat_id, latitude, longitude, categories, radius in rows
+        ]
+
+    def save(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO subscription (chat_id, latitude, longitude, categories, radius) VALUES (?, ?, ?, ?, ?)',
+                (subscription.chat_id, subscription.latitude, subscription.longitude, '\n'.join(subscription.categories), subscription.radius)
+            )
+            self._db.commit()
+
+    def delete(self, chat_id: int) -> None:
+        with self._lock:
+            self._db.execute('DELETE FROM subscription WHERE chat_id = ?', (chat_id,))
+            self._db.commit()
+
+
+class FanOutEngine:
+    """
+    Delivers the alerts of changed points of interest, in a background thread so the handlers never wait for it.
+    Changes published within batch_window seconds are matched together, every chat gets a single message
+    listing its points, and the messages are sent in batches of batch_size, at most `rate` per second,
+    so the alerts leave most of the Telegram rate limit to the conversations.
+    """
+
+    def __init__(self, index: SubscriptionIndex, send, rate: float = 10, batch_size: int = 50, max_items: int = 5,
+        batch_window: float = 1, on_blocked=None):
+        """
+        Args:
+            index: the subscriptions.
+            send: callable(chat_id, text) sending an HTML message.
+            rate: messages per second.
+            batch_size: messages sent concurrently, and burst of the rate limit.
+            max_items: points of interest listed per message.
+            batch_window: seconds to wait for more changes before matching them.
+            on_blocked: callable(chat_id) called when a chat blocked the bot.
+        """
+        self.index = index
+        self.send = send
+        self.batch_size = batch_size
+        self.max_items = max_items
+        self.batch_window = batch_window
+        self.on_blocked = on_blocked
+
+        self.matched = 0
+        self.sent = 0
+        self.failed = 0
+
+        self._bucket = TokenBucket(rate, batch_size, time.monotonic())
+        self._changes = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=batch_size, thread_name_prefix='fan-out-send')
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='fan-out', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop after the changes already published are delivered.
+        """
+        if self._thread is not None:
+            self._changes.put(None)
+            self._thread.join()
+            self._thread = None
+        self._pool.shutdown(wait=True)
+
+    def publish(self, items: list) -> None:
+        """
+        Queue added or changed points of interest (PoiRecord) for delivery. Returns at once.
+        """
+        if items:
+            self._changes.put(list(items))
+
+    def stats(self) -> dict:
+        return {"pending": self._changes.qsize(), "matched": self.matched, "sent": self.sent, "failed": self.failed}
+
+    def _run(self) -> None:
+        while True:
+            items = self._changes.get()
+            if items is None:
+                return
+
+            # Changes published meanwhile are delivered together
+            deadline = time.monotonic() + self.batch_window
+            stopping = False
+            while not stopping and (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    more = self._changes.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if more is None:
+                    stopping = True
+                else:
+                    items.extend(more)
+
+            try:
+                self.deliver(items)
+            except Exception as error:
+                logger.warning("Failed to deliver alerts: %r", error)
+            if stopping:
+                return
+
+    def deliver(self, items: list) -> None:
+        """
+        Match points of interest against the subscriptions and send the alerts, nearest points first.
+        """
+        alerts = {}  # chat_id -> list of PoiRecord with their distance
+        for item in items:
+            for subscription, distance in self.index.match(item):
+                alerts.setdefault(subscription.chat_id, []).append(item.with_distance(distance))
+                self.matched += 1
+
+        chats = list(alerts.items())
+        for start in range(0, len(chats), self.batch_size):
+            futures = {}
+            for chat_id, chat_items in chats[start:start + self.batch_size]:
+                self._wait_for_token()
+                chat_items.sort(key=lambda item: item.distance)
+                text = ResultsService.render_alert(chat_items[:self.max_items], len(chat_items))
+                futures[self._pool.submit(self.send, chat_id, text)] = chat_id
+
+            wait(futures)
+            for future, chat_id in futures.items():
+                error = future.exception()
+                if error is None:
+                    self.sent += 1
+                    MetricsService.alerts_sent.inc(result='sent')
+                    continue
+
+                self.failed += 1
+                MetricsService.alerts_sent.inc(result='failed')
+                if isinstance(error, Unauthorized) and self.on_blocked is not None:
+                    self.on_blocked(chat_id)
+                else:
+                    logger.warning("Failed to send an alert to chat %s: %r", chat_id, error)
+
+    def _wait_for_token(self) -> None:
+        delay = self._bucket.delay(time.monotonic())
+        while delay:
+            time.sleep(delay)
+            delay = self._bucket.delay(time.monotonic())
+        self._bucket.take()
+
+
+class SubscriptionService:
+    """
+    Service for the /subscribe alerts: stores the subscriptions, and fans out the points of interest changed
+    by each sync of the local replica (see PoiIndexService) to the chats subscribed around them.
+    """
+
+    settings = LazyService(get_settings)
+
+    store = LazyService(lambda: SubscriptionStore(SubscriptionService.settings.subscription_path))
+    index = LazyService(lambda: SubscriptionService.load_index(SubscriptionService.store, SubscriptionService.settings))
+
+    # FanOutEngine, once started
+
+    engine = None
+
+    @staticmethod
+    def load_index(store: SubscriptionStore, settings: Settings) -> SubscriptionIndex:
+        index = SubscriptionIndex(settings.subscription_cell_degrees)
+        for subscription in store.load():
+            index.add(subscription)
+        return index
+
+    @staticmethod
+    def subscribe(chat_id: int, latitude: float, longitude: float, categories: list) -> Subscription:
+        """
+        Subscribe a chat to the new points of interest of the categories around a location,
+        within SUBSCRIPTION_RADIUS meters. Replaces the previous subscription of the chat.
+        """
+        subscription = Subscription(chat_id, latitude, longitude, tuple(categories), SubscriptionService.settings.subscription_radius)
+        SubscriptionService.store.save(subscription)
+        SubscriptionService.index.add(subscription)
+        return subscription
+
+    @staticmethod
+    def unsubscribe(chat_id: int) -> bool:
+        """
+        Return: True if the chat had a subscription.
+        """
+        SubscriptionService.store.delete(chat_id)
+        return SubscriptionService.index.remove(chat_id)
+
+    @staticmethod
+    def publish(items: list) -> None:
+        """
+        Queue changed points of interest for the alerts. Listener of PoiIndexService.
+        """
+        engine = SubscriptionService.engine
+        if engine is None:
+            return
+        if SubscriptionService.settings.subscription_path:
+            # Other worker processes may have changed the subscriptions
+            SubscriptionService.index.reset(SubscriptionService.store.load())
+        engine.publish(items)
+
+    @staticmethod
+    def start(bot) -> FanOutEngine:
+        """
+        Start delivering the alerts with the bot.
+        """
+        settings = SubscriptionService.settings
+
+        def send(chat_id, text):
+            return bot.send_message(chat_id, text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+        engine = SubscriptionService.engine = FanOutEngine(
+            SubscriptionService.index,
+            send,
+            rate=settings.subscription_fanout_rate,
+            batch_size=settings.subscription_batch_size,
+            max_items=settings.subscription_max_items,
+            on_blocked=SubscriptionService.unsubscribe
+        )
+        engine.start()
+        return engine
@@ -0,0 +1,217 @@
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+from src.services.logging_service import LoggingService
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys (chat ids) to worker indexes.
+    Adding or removing a worker only moves the keys of that worker.
+    """
+
+    def __init__(self, nodes: int, replicas: int = 100):
+        """
+        Args:
+            nodes: number of workers.
+            replicas: virtual points per worker on the ring, for an even spread.
+        """
+        points = sorted(
+            (self.hash(f'{node}:{replica}'), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+    def node_for(self, key) -> int:
+        """
+        Return: index of the worker owning the key.
+        """
+        index = bisect.bisect(self._hashes, self.hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+
+def get_routing_key(data: dict):
+    """
+    Get the key an update is routed by: its chat id, or its user id for updates without a chat.
+    Every update of a conversation has the same key, so a conversation always stays on one worker.
+    """
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                  'my_chat_member', 'chat_member', 'chat_join_request'):
+        if field in data:
+            return data[field]['chat']['id']
+
+    callback_query = data.get('callback_query')
+    if callback_query is not None:
+        if 'message' in callback_query:
+            return callback_query['message']['chat']['id']
+        return callback_query['from']['id']
+
+    for field in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll_answer'):
+        if field in data:
+            return data[field]['user' if field == 'poll_answer' else 'from']['id']
+
+    return data.get('update_id')
+
+
+def run_worker(index: int, updates, dispatcher_factory) -> None:
+    """
+    Worker process: feeds the updates routed to it to its own dispatcher until it gets None.
+    """
+    # A forked worker writes through the pipeline it inherited, a spawned one (macOS, Windows) starts without one
+    if LoggingService.pipeline is None:
+        LoggingService.configure(LoggingService.settings)
+
+    dispatcher = dispatcher_factory(index)
+    thread = threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True)
+    thread.start()
+
+    while True:
+        data = updates.get()
+        if data is None:
+            break
+        dispatcher.update_queue.put(Update.de_json(data, dispatcher.bot))
+
+    dispatcher.stop()
+    thread.join()
+
+    if dispatcher.persistence:
+        dispatcher.update_persistence()
+        dispatcher.persistence.flush()
+
+    # The worker process exits without running the atexit hooks: write the last log records
+    LoggingService.stop()
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    """
+    Accepts the updates Telegram posts to the webhook.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if self.path != webhook.url_path:
+            return self._reply(404)
+        if webhook.secret_token and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != webhook.secret_token:
+            return self._reply(403)
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return self._reply(400)
+
+        # A full queue makes Telegram retry the update later
+        self._reply(200 if webhook.route(data) else 503)
+
+    def _reply(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class WebhookHTTPServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a listen backlog large enough for Telegram's concurrent webhook connections.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class WebhookServer:
+    """
+    Serves the Telegram webhook and spreads the updates over several worker processes.
+    Updates are routed by a consistent hash of their chat id, so each conversation stays on one worker.
+    """
+
+    def __init__(self, listen: str, port: int, url_path: str, workers: int, dispatcher_factory,
+        secret_token: str = "", queue_size: int = 1000, enqueue_timeout: float = 1):
+        """
+        Args:
+            listen: address to listen on.
+            port: port to listen on.
+            url_path: path Telegram posts the updates to, like: /telegram
+            workers: number of worker processes.
+            dispatcher_factory: picklable callable(worker index), building the dispatcher of a worker.
+            secret_token: expected X-Telegram-Bot-Api-Secret-Token header. Default: "" (not checked)
+            queue_size: maximum number of updates waiting for a worker.
+            enqueue_timeout: seconds to wait for room in a full worker queue before rejecting the update.
+        """
+        self.url_path = url_path
+        self.secret_token = secret_token
+        self.enqueue_timeout = enqueue_timeout
+        self.ring = HashRing(workers)
+        self.queues = [multiprocessing.Queue(queue_size) for _ in range(workers)]
+        self.processes = [
+            multiprocessing.Process(
+                target=run_worker, args=(index, updates, dispatcher_factory), name=f'webhook-worker-{index}', daemon=True
+            )
+            for index, updates in enumerate(self.queues)
+        ]
+
+        self.httpd = WebhookHTTPServer((listen, port), WebhookRequestHandler)
+        self.httpd.webhook = self
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def route(self, data: dict) -> bool:
+        """
+        Queue an update for the worker owning its chat.
+        Return: False if the worker queue stayed full.
+        """
+        worker = self.ring.node_for(get_routing_key(data))
+        try:
+            self.queues[worker].put(data, timeout=self.enqueue_timeout)
+        except queue.Full:
+            logger.warning('Webhook worker %s is overloaded, rejecting update', worker)
+            return False
+
+        return True
+
+    def start(self) -> None:
+        """
+        Start the worker processes and serve the webhook on a background thread.
+        """
+        # Workers are started before the server thread. The bot, its scheduler and persistence threads are built by
+        # each worker (see dispatcher_factory); the only thread running here is the log writer, paused while forking
+        for process in self.processes:
+            process.start()
+
+        threading.Thread(target=self.httpd.serve_forever, name='webhook-server', daemon=True).start()
+        logger.info('Webhook listening on port %s with %s workers', self.port, len(self.processes))
+
+    def stop(self) -> None:
+        """
+        Stop accepting updates and let the workers finish the queued ones.
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.processes:
+            process.join()
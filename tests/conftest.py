@@ -0,0 +1,35 @@
+import os
+import threading
+
+import pytest
+
+# The Google client validates the key format when it is constructed, so this is set before importing the services
+os.environ.setdefault("GOOGLE_API_KEY", "AIza-test-key")
+
+from src.services.cache_service import SingleFlightCache
+from src.services.poi_stream_service import PoiRecord
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+from tests.fakes import CATEGORIES
+
+
+@pytest.fixture
+def search_calls(monkeypatch):
+    """
+    Answers the API searches with 25 points per search, and records their categories per chat.
+    """
+    calls = {}
+    lock = threading.Lock()
+
+    def get_points_of_interest(chat_id, categories=None, skip=0, limit=20, **kwargs):
+        with lock:
+            calls.setdefault(chat_id, []).append(list(categories))
+        items = [
+            PoiRecord(index, f'poi-{chat_id}-{index}', tuple(categories), (kwargs['longitude'], kwargs['latitude']), index * 100)
+            for index in range(25)
+        ]
+        return iter(items[skip:skip + limit])
+
+    monkeypatch.setattr(SafeRefugeApiService, 'get_category_list', staticmethod(lambda: list(CATEGORIES)))
+    monkeypatch.setattr(SafeRefugeApiService, 'get_points_of_interest', staticmethod(get_points_of_interest))
+    monkeypatch.setattr(SafeRefugeApiService, 'search_cache', SingleFlightCache(ttl=30))
+    return calls
@@ -0,0 +1,94 @@
+"""
+Fakes of the Telegram bot and updates shared by the tests.
+"""
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from telegram import Chat, Location, Message, MessageEntity, Update, User
+
+CATEGORIES = ['Clothes', 'Food', 'Medical', 'Shelter', 'Transport', 'Legal']
+
+
+class FakeBot:
+    """
+    Bot that never touches the network. Records every message the handlers send, per chat, and the query answers.
+    Also used by the benchmarks, which only count the messages.
+    """
+
+    id = 1
+    username = 'safe_refuge_test_bot'
+    first_name = 'Safe Refuge'
+    defaults = None
+
+    def __init__(self, sent_counter=None, record: bool = True):
+        """
+        Args:
+            sent_counter: optional multiprocessing.Value incremented for every message sent.
+            record: keep the messages sent, else only count them.
+        """
+        self.sent_counter = sent_counter
+        self.record = record
+        self.lock = threading.Lock()
+        self.sent = defaultdict(list)
+        self.sent_count = 0
+        self.answers = []
+
+    def _record(self, chat_id, message) -> None:
+        with self.lock:
+            self.sent_count += 1
+            if self.record:
+                self.sent[chat_id].append(message)
+        if self.sent_counter is not None:
+            with self.sent_counter.get_lock():
+                self.sent_counter.value += 1
+
+    def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self._record(chat_id, (text, reply_markup))
+
+    def send_location(self, chat_id, location=None, **kwargs):
+        self._record(chat_id, ('location', location))
+
+    def send_venue(self, chat_id, venue=None, **kwargs):
+        self._record(chat_id, ('venue', venue))
+
+    def edit_message_text(self, text, chat_id=None, reply_markup=None, **kwargs):
+        self._record(chat_id, (text, reply_markup))
+
+    def answer_inline_query(self, inline_query_id, results, **kwargs):
+        with self.lock:
+            self.answers.append((results, kwargs))
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        with self.lock:
+            self.answers.append((text, kwargs))
+
+
+def make_update(bot, update_id, chat_id, text=None, location=None):
+    entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text))] if text and text.startswith('/') else []
+    message = Message(
+        update_id,
+        datetime.now(),
+        Chat(chat_id, Chat.PRIVATE),
+        from_user=User(chat_id, f'user{chat_id}', False),
+        text=text,
+        entities=entities,
+        location=location,
+        bot=bot,
+    )
+    return Update(update_id, message=message)
+
+
+def chat_script(chat_id, rng):
+    first, second = rng.sample(CATEGORIES, 2)
+    location = Location(longitude=24.0 + chat_id / 1000, latitude=49.8)
+    steps = [
+        {'text': '/search'},
+        {'text': first},
+        {'text': 'Yes'},
+        {'text': second},
+        {'text': 'No'},
+        {'location': location},
+        {'text': 'No'},
+    ]
+    return (first, second), steps
@@ -0,0 +1,110 @@
+import hashlib
+import inspect
+import threading
+import time
+from queue import Queue
+
+from telegram import Location
+from telegram.ext import Dispatcher, Handler
+
+from src.conversations import search_conversation
+from src.services.admission_service import BUSY_TEXT, AdmissionDispatcher, AdmissionQueue
+from src.services.metrics_service import MetricsService
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+from tests.fakes import FakeBot, make_update
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_queue_serves_the_highest_class_first_and_keeps_workers_for_it():
+    queue = AdmissionQueue(queue_size=2, deadline=0.2, low_priority_slots=1)
+    assert queue.put('search 1', 'search') and queue.put('search 2', 'search')
+    assert not queue.put('search 3', 'search')
+    queue.put('yes', 'reply')
+    queue.put('/cancel', 'command')
+
+    assert [queue.get().item for _ in range(3)] == ['/cancel', 'yes', 'search 1']
+
+    # The second search waits for the slot of the first one, until its deadline
+    entry = queue.get()
+    assert entry.item == 'search 2' and entry.expired(time.monotonic())
+    assert queue.stats()['search'] == {"queued": 0, "running": 1}
+
+    queue.close()
+    assert queue.get() is None and not queue.put('search 4', 'search')
+
+
+def test_cancels_go_through_while_searches_are_shed(search_calls, monkeypatch):
+    gate = threading.Event()
+    get_points_of_interest = SafeRefugeApiService.get_points_of_interest
+
+    def slow_points_of_interest(*args, **kwargs):
+        gate.wait(5)
+        return get_points_of_interest(*args, **kwargs)
+
+    monkeypatch.setattr(SafeRefugeApiService, 'get_points_of_interest', staticmethod(slow_points_of_interest))
+
+    bot = FakeBot()
+    admission = AdmissionQueue(queue_size=1, deadline=0.5, low_priority_slots=1)
+    dispatcher = AdmissionDispatcher(bot, Queue(), workers=2, admission=admission, use_context=True)
+    dispatcher.add_handler(search_conversation.get_search_conv_handler(run_async=True))
+    thread = threading.Thread(target=dispatcher.start, daemon=True)
+    thread.start()
+    wait_for(lambda: dispatcher.running)
+
+    update_ids = iter(range(1, 100))
+
+    def send(chat_id, replies=1, **step):
+        sent = len(bot.sent[chat_id])
+        dispatcher.process_update(make_update(bot, next(update_ids), chat_id, **step))
+        wait_for(lambda: len(bot.sent[chat_id]) >= sent + replies)
+        return bot.sent[chat_id][-1][0] if replies else None
+
+    for chat_id in (1, 2):
+        for text in ('/search', 'Food', 'No'):
+            send(chat_id, text=text)
+
+    # The search of chat 1 takes the only slot of the searches
+    send(1, replies=0, location=Location(24.03, 49.84))
+    wait_for(lambda: admission.stats()['search']['running'] == 1)
+    send(3, replies=0, text='/search')
+    assert send(4, text='/search') == BUSY_TEXT
+
+    # Commands have their own worker
+    assert send(2, text='/cancel').startswith('The current search has been cancelled.')
+    wait_for(lambda: bot.sent[3] == [(BUSY_TEXT, None)])
+
+    gate.set()
+    wait_for(lambda: any('poi-1-0' in text for text, _ in bot.sent[1]))
+    assert search_calls[1] == [['Food']] and 2 not in search_calls
+
+    # The shed /search left no conversation behind, it can be sent again
+    assert send(3, text='/search').startswith('Hi! What kind of point of interest are you looking for?')
+
+    dispatcher.stop()
+    thread.join()
+
+    metrics = MetricsService.render()
+    assert 'bot_admission_shed_total{priority="search",reason="queue_full"}' in metrics
+    assert 'bot_admission_shed_total{priority="search",reason="deadline"}' in metrics
+    assert 'bot_admission_queue_depth{priority="search"} 0' in metrics
+
+
+def test_the_worker_loop_of_the_dispatcher_is_the_one_checked():
+    # The admission tokens rely on how handlers queue work and how the workers run it and store its changes:
+    # review AdmissionDispatcher.run_async before updating these digests
+    digests = {
+        function.__qualname__: hashlib.sha256(inspect.getsource(function).encode()).hexdigest()[:16]
+        for function in (Dispatcher.run_async, Dispatcher._run_async, Dispatcher._pooled, Handler.handle_update)
+    }
+    assert digests == {
+        'Dispatcher.run_async': 'ddb7f21476a4142d',
+        'Dispatcher._run_async': '8a3a9990f0d380d5',
+        'Dispatcher._pooled': '79bf1ab09b4e7b0e',
+        'Handler.handle_update': 'ee97f490344af383',
+    }
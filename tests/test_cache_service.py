@@ -0,0 +1,173 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from src.services import cache_service
+from src.services.cache_service import SingleFlightCache, TTLValueCache
+from src.services.poi_stream_service import PoiRecord
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+
+
+def test_concurrent_identical_searches_share_one_call(monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def get_points_of_interest(chat_id, **kwargs):
+        calls.append(kwargs)
+        release.wait(5)
+        return iter([PoiRecord(1, 'Shelter', ('Shelter',), (kwargs['longitude'], kwargs['latitude']), 10)])
+
+    monkeypatch.setattr(SafeRefugeApiService, 'get_points_of_interest', staticmethod(get_points_of_interest))
+    monkeypatch.setattr(SafeRefugeApiService, 'search_cache', SingleFlightCache(ttl=30))
+
+    # Same categories in another order, from a few meters away, in 50 chats
+    with ThreadPoolExecutor(max_workers=50) as executor:
+        searches = [
+            executor.submit(
+                SafeRefugeApiService.search_nearby, chat_id, 49.84191 + chat_id * 1e-6, 24.03112,
+                ['Shelter', 'Food'] if chat_id % 2 else ['Food', 'Shelter']
+            )
+            for chat_id in range(50)
+        ]
+        release.set()
+        results = [search.result() for search in searches]
+
+    assert len(calls) == 1
+    assert calls[0]['categories'] == ['Food', 'Shelter']
+    assert (calls[0]['latitude'], calls[0]['longitude']) == (49.842, 24.031)
+    assert all(result == results[0] for result in results)
+
+    stats = SafeRefugeApiService.search_cache.stats()
+    assert stats['misses'] == 1 and stats['hits'] + stats['coalesced'] == 49
+
+    # Another location is another search
+    SafeRefugeApiService.search_nearby(1, 50.45, 30.52, ['Food', 'Shelter'])
+    assert len(calls) == 2
+
+
+def test_failures_are_shared_but_not_cached():
+    cache = SingleFlightCache(ttl=30)
+
+    def fail():
+        raise ConnectionError('upstream down')
+
+    with pytest.raises(ConnectionError):
+        cache.get('key', fail)
+    assert cache.get('key', lambda: 'value') == 'value'
+    assert cache.get('key', fail) == 'value'
+
+
+def test_expired_values_are_served_while_loads_fail():
+    cache = SingleFlightCache(ttl=0, stale_ttl=30)
+
+    def fail():
+        raise ConnectionError('upstream down')
+
+    with pytest.raises(ConnectionError):
+        cache.get('key', fail)
+    assert cache.get('key', lambda: 'value') == 'value'
+    assert cache.get('key', fail) == 'value'
+    assert cache.stats()['stale'] == 1
+    assert cache.get('key', lambda: 'new value') == 'new value'
+
+
+class Loader:
+    """Loader of a TTLValueCache returning value 1, 2... or raising the errors queued, on the thread it records."""
+
+    def __init__(self):
+        self.calls = []
+        self.errors = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self):
+        self.calls.append(threading.current_thread().name)
+        assert self.release.wait(5)
+        if self.errors:
+            raise self.errors.pop(0)
+        return len(self.calls)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(cache_service, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def wait_refreshed(cache):
+    deadline = time.monotonic() + 5
+    while cache._inflight is not None:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_stale_values_are_served_while_a_background_thread_refreshes_them(clock):
+    loader = Loader()
+    cache = TTLValueCache(loader, ttl=60, name='categories')
+    assert cache.get() == 1 and cache.get() == 1
+    assert loader.calls == [threading.current_thread().name]
+
+    # Expired: served stale, refreshed once however many callers
+    clock.now += 60
+    loader.release.clear()
+    assert [cache.get() for _ in range(5)] == [1] * 5
+    loader.release.set()
+    wait_refreshed(cache)
+    assert loader.calls[1:] == ['categories-refresh'] and cache.get() == 2
+
+    # Refreshed early after an invalidate
+    cache.invalidate()
+    assert cache.get() == 2
+    wait_refreshed(cache)
+    assert cache.get() == 3
+    assert cache.stats() == {"hits": 9, "misses": 1, "hit_ratio": 0.9}
+
+
+def test_failed_refreshes_keep_the_value_and_retry_after_the_error_ttl(clock):
+    loader = Loader()
+    cache = TTLValueCache(loader, ttl=60, error_ttl=5)
+    assert cache.get() == 1
+
+    clock.now += 60
+    loader.errors.append(ConnectionError('upstream down'))
+    assert cache.get() == 1
+    wait_refreshed(cache)
+    assert cache.get() == 1 and len(loader.calls) == 2
+
+    # Not retried before error_ttl
+    clock.now += 4
+    assert cache.get() == 1 and len(loader.calls) == 2
+    clock.now += 1
+    assert cache.get() == 1
+    wait_refreshed(cache)
+    assert cache.get() == 3
+
+
+def test_callers_share_the_first_load_and_its_error(clock):
+    loader = Loader()
+    loader.release.clear()
+    loader.errors.append(ConnectionError('upstream down'))
+    cache = TTLValueCache(loader, ttl=60, error_ttl=5)
+
+    def get():
+        try:
+            return cache.get()
+        except ConnectionError as error:
+            return error
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = [executor.submit(get) for _ in range(8)]
+        deadline = time.monotonic() + 5
+        while cache.stats()['misses'] < 8:
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+        loader.release.set()
+    assert len(loader.calls) == 1
+    assert all(isinstance(result.result(), ConnectionError) for result in results)
+
+    # Without a value to serve, the next caller loads it again at once
+    assert cache.get() == 2
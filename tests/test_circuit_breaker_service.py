@@ -0,0 +1,81 @@
+import time
+
+import googlemaps.exceptions
+import pytest
+import requests
+
+from src.services.circuit_breaker_service import CircuitBreaker, CircuitOpenError, is_upstream_failure
+from src.services.concurrency_service import UpstreamBusyError
+
+
+def call(breaker, error=None, seconds=0):
+    with breaker.guard():
+        time.sleep(seconds)
+        if error is not None:
+            raise error
+
+
+def test_circuit_opens_on_errors_and_closes_after_a_probe():
+    breaker = CircuitBreaker('test', window=30, min_calls=4, error_rate=0.5, open_seconds=0.05)
+    call(breaker)
+    call(breaker)
+    with pytest.raises(ConnectionError):
+        call(breaker, ConnectionError('down'))
+    assert breaker.state == CircuitBreaker.CLOSED
+    with pytest.raises(ConnectionError):
+        call(breaker, ConnectionError('down'))
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # Fails fast without calling the upstream
+    with pytest.raises(CircuitOpenError):
+        call(breaker)
+    assert breaker.stats()['rejected'] == 1
+
+    # A failed probe opens the circuit again, a successful one closes it
+    time.sleep(0.06)
+    with pytest.raises(ConnectionError):
+        call(breaker, ConnectionError('still down'))
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    call(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()['calls'] == 0
+
+
+def http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f'{status_code} error', response=response)
+
+
+def test_only_upstream_failures_open_the_circuit():
+    breaker = CircuitBreaker('test', min_calls=4, error_rate=0.5)
+    # Rejected requests, a full limiter and bugs are not the upstream failing
+    for error in (http_error(404), http_error(429), UpstreamBusyError('busy'), KeyError('items'),
+                  googlemaps.exceptions.ApiError('INVALID_REQUEST')):
+        assert not is_upstream_failure(error)
+        with pytest.raises(type(error)):
+            call(breaker, error)
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.stats()['failures'] == 0
+
+    failures = (http_error(503), requests.ConnectTimeout(), requests.ReadTimeout(), requests.ConnectionError(),
+                googlemaps.exceptions.HTTPError(502), googlemaps.exceptions.Timeout())
+    assert all(is_upstream_failure(error) for error in failures)
+    for error in failures[:5]:
+        with pytest.raises(type(error)):
+            call(breaker, error)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_only_one_probe_at_a_time_and_slow_calls_open_the_circuit():
+    breaker = CircuitBreaker('test', min_calls=2, slow_call_seconds=0.01, slow_call_rate=1, open_seconds=0.05)
+    call(breaker, seconds=0.02)
+    call(breaker, seconds=0.02)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    with breaker.guard():
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            call(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
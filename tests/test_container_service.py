@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+import threading
+
+from src.services.container_service import LazyService, ServiceContainer
+
+
+def test_lazy_service_is_built_once_on_first_use():
+    calls = []
+    started = threading.Barrier(8)
+
+    class Service:
+        client = LazyService(lambda: calls.append(1) or object())
+
+    assert calls == []
+
+    clients = []
+
+    def use():
+        started.wait()
+        clients.append(Service.client)
+
+    threads = [threading.Thread(target=use) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(client is clients[0] for client in clients)
+    assert Service.__dict__['client'] is clients[0]
+    assert 'Service.client' in ServiceContainer.built()
+
+
+def test_importing_the_bot_builds_no_client():
+    code = (
+        "import sys, main\n"
+        "from src.services.container_service import ServiceContainer\n"
+        "assert ServiceContainer.built() == {}, ServiceContainer.built()\n"
+        "assert 'googlemaps' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
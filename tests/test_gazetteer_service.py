@@ -0,0 +1,84 @@
+import pytest
+
+from src.services.gazetteer_service import Gazetteer, GazetteerService, Place
+from src.services.geocode_cache_service import GeocodeCache
+from src.services.geocode_service import GeocodeService
+
+PLACES = [
+    Place('Lviv', 'city', 49.8397, 24.0297, 'Lviv, Lviv Oblast, Ukraine', 717000),
+    Place('Львів', 'city', 49.8397, 24.0297, 'Lviv, Lviv Oblast, Ukraine', 717000),
+    Place('Lviv Oblast', 'region', 49.6496, 23.8800, 'Lviv Oblast, Ukraine', 2500000),
+    Place('Lvivska', 'city', 48.5, 25.1, 'Lvivska, Ukraine', 100),
+    Place('Przemyśl', 'city', 49.7838, 22.7678, 'Przemyśl, Poland', 58000),
+    Place('Medyka', 'border_crossing', 49.8036, 22.9317, 'Medyka border crossing, Poland', 0),
+    Place('Ukraine', 'country', 48.3794, 31.1656, 'Ukraine', 0),
+]
+
+
+@pytest.fixture
+def gazetteer(tmp_path):
+    path = tmp_path / 'gazetteer.bin'
+    assert Gazetteer.write(str(path), PLACES) == len(PLACES)
+    gazetteer = Gazetteer(str(path))
+    yield gazetteer
+    gazetteer.close()
+
+
+def test_names_match_exactly_by_prefix_or_with_typos(gazetteer):
+    assert gazetteer.find('lviv') == (PLACES[0]._replace(name='lviv'), 'exact')
+    assert gazetteer.find('львів')[0].display == 'Lviv, Lviv Oblast, Ukraine'
+    assert gazetteer.find(GeocodeCache.normalize('PRZEMYŚL'))[1] == 'exact'
+
+    # The heaviest name of the prefix
+    assert gazetteer.find('lviv o')[0].kind == 'region'
+    assert gazetteer.find('lvivs')[0].name == 'lvivska'
+    assert gazetteer.find('medy') == (gazetteer.find('medyka')[0], 'prefix')
+
+    assert gazetteer.find('lvov')[0].name == 'lviv'
+    assert gazetteer.find('przemysl')[0].name == 'przemyśl'
+    assert gazetteer.find('mdeyka') == (gazetteer.find('medyka')[0], 'fuzzy')
+
+    assert gazetteer.find('lv') == (None, 'miss')
+    assert gazetteer.find('kharkiv') == (None, 'miss')
+
+
+def test_short_names_match_with_a_short_min_prefix(tmp_path):
+    path = str(tmp_path / 'gazetteer.bin')
+    Gazetteer.write(path, PLACES)
+    gazetteer = Gazetteer(path, min_prefix=1)
+    try:
+        assert gazetteer.find('m') == (gazetteer.find('medyka')[0], 'prefix')
+        assert gazetteer.find('u')[0].name == 'ukraine'
+        assert gazetteer.find('x') == (None, 'miss')
+        assert gazetteer.find('xy') == (None, 'miss')
+    finally:
+        gazetteer.close()
+
+
+def test_addresses_resolve_locally_and_misses_are_counted(gazetteer):
+    assert gazetteer.lookup('Lviv, Ukraine') == (['Lviv, Lviv Oblast, Ukraine', {"lat": pytest.approx(49.8397), "lng": pytest.approx(24.0297)}], 'exact')
+    assert gazetteer.lookup('Medyka, Lviv oblast')[0][0] == 'Medyka border crossing, Poland'
+
+    # Streets, and places of other countries, are left to Google
+    assert gazetteer.lookup('Shevchenka 5, Lviv') == (None, 'miss')
+    assert gazetteer.lookup('Lviv, Narnia') == (None, 'miss')
+    assert gazetteer.stats() == {"hits": 2, "misses": 2, "hit_ratio": 0.5, "size": len(PLACES)}
+
+
+def test_google_is_only_called_for_misses(gazetteer, monkeypatch):
+    class FakeClient:
+        def __init__(self):
+            self.addresses = []
+
+        def geocode(self, address):
+            self.addresses.append(address)
+            return [{"formatted_address": "Kharkiv, Ukraine", "geometry": {"location": {"lat": 49.99, "lng": 36.23}}}]
+
+    client = FakeClient()
+    monkeypatch.setattr(GeocodeService, 'gmaps', client)
+    monkeypatch.setattr(GeocodeService, 'cache', GeocodeCache())
+    monkeypatch.setattr(GazetteerService, 'gazetteer', gazetteer)
+
+    assert GeocodeService.get_geocode('lvov')[0] == 'Lviv, Lviv Oblast, Ukraine'
+    assert GeocodeService.get_geocode('Kharkiv')[0] == 'Kharkiv, Ukraine'
+    assert client.addresses == ['Kharkiv']
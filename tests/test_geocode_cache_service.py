@@ -0,0 +1,85 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from src.services import geocode_cache_service
+from src.services.geocode_cache_service import GeocodeCache
+
+LVIV = ['Lviv, Lviv Oblast, Ukraine', {'lat': 49.84, 'lng': 24.03}]
+KYIV = ['Kyiv, Ukraine', {'lat': 50.45, 'lng': 30.52}]
+
+
+class Clock:
+    """Stands for the time module of the cache: time() is set by the test."""
+
+    def __init__(self, now: float = 1_000_000):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(geocode_cache_service, 'time', clock)
+    return clock
+
+
+def test_least_recently_used_addresses_are_evicted(clock):
+    cache = GeocodeCache(max_size=2)
+    cache.set('Lviv', LVIV)
+    cache.set('Kyiv', KYIV)
+    # Spelled differently, used last
+    assert cache.get('  LVIV!') == LVIV
+
+    cache.set('Unknown place', [])
+    assert cache.get('Kyiv') is None
+    assert cache.get('lviv') == LVIV and cache.get('unknown place') == []
+    assert cache.stats() == {"hits": 3, "misses": 1, "hit_ratio": 0.75, "size": 2}
+
+
+def test_recognised_and_unrecognised_addresses_have_their_own_ttl(clock):
+    cache = GeocodeCache(ttl=100, negative_ttl=10)
+    cache.set('Lviv', LVIV)
+    cache.set('Nowhere', [])
+
+    clock.now += 9
+    assert cache.get('Nowhere') == [] and cache.get('Lviv') == LVIV
+    clock.now += 1
+    assert cache.get('Nowhere') is None and cache.get('Lviv') == LVIV
+    clock.now += 90
+    assert cache.get('Lviv') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_entries_are_reloaded_from_sqlite_and_expired_rows_deleted(clock, tmp_path):
+    path = str(tmp_path / 'geocode.sqlite')
+    cache = GeocodeCache(ttl=100, negative_ttl=10, path=path, purge_interval=100)
+    cache.set('Lviv', LVIV)
+    cache.set('Nowhere', [])
+
+    # A restarted bot reads the entries still valid
+    clock.now += 20
+    restarted = GeocodeCache(ttl=100, negative_ttl=10, path=path, purge_interval=100)
+    assert restarted.get('lviv') == LVIV and restarted.get('Nowhere') is None
+
+    def rows():
+        with closing(sqlite3.connect(path)) as db:
+            return sorted(key for key, in db.execute('SELECT key FROM geocode'))
+
+    # Opening the cache deleted the expired row
+    assert rows() == ['lviv']
+
+    # Writes delete the expired rows once per purge_interval
+    clock.now += 85
+    restarted.set('Kyiv', KYIV)
+    assert restarted.get('Lviv') is None and rows() == ['kyiv', 'lviv']
+    clock.now += 20
+    restarted.set('Nowhere', [])
+    assert rows() == ['kyiv', 'nowhere']
+
+    clock.now += 100
+    assert restarted.purge() == 2 and rows() == []
+    assert GeocodeCache(path=path).get('Kyiv') is None
@@ -0,0 +1,132 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from src.services import http_client_service
+from src.services.concurrency_service import UpstreamBusyError
+from src.services.http_client_service import HttpClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers every GET with the next (status, body, delay) of the server script, then with 200 "ok".
+    A None status closes the connection without answering.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            status, body, delay = self.server.script.pop(0) if self.server.script else (200, b'ok', 0)
+        time.sleep(delay)
+        if status is None:
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.script = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_a_streamed_response_holds_its_request_slot_until_closed(stub_server):
+    client = HttpClient(max_concurrency=1, acquire_timeout=0.05)
+
+    # A response read at once frees its slot on return
+    assert client.get(f'{stub_server.url}/search').text == 'ok'
+
+    response = client.get(f'{stub_server.url}/search', stream=True)
+    with pytest.raises(UpstreamBusyError):
+        client.get(f'{stub_server.url}/search')
+    assert b''.join(response.iter_content(2)) == b'ok'
+    response.close()
+    # Closing again does not free another slot
+    response.close()
+
+    with client.get(f'{stub_server.url}/search', stream=True) as response:
+        assert response.text == 'ok'
+    assert client.get(f'{stub_server.url}/search').status_code == 200
+    assert len(stub_server.requests) == 4
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays slept by the client."""
+    sleeps = []
+    monkeypatch.setattr(http_client_service, 'time', SimpleNamespace(sleep=sleeps.append))
+    return sleeps
+
+
+def test_failures_are_retried_with_backoff_until_a_success(stub_server, sleeps, monkeypatch):
+    # Every backoff delay is its upper bound
+    monkeypatch.setattr(http_client_service, 'random', SimpleNamespace(uniform=lambda low, high: high))
+    client = HttpClient(max_retries=3, backoff_factor=0.1, backoff_max=0.3)
+    stub_server.script = [(503, b'busy', 0), (None, b'', 0), (500, b'error', 0)]
+
+    response = client.get(f'{stub_server.url}/search')
+    assert (response.status_code, response.text) == (200, 'ok')
+    assert len(stub_server.requests) == 4
+    assert sleeps == [0.1, 0.2, 0.3]
+
+
+def test_retries_are_logged_without_the_query_string(stub_server, sleeps, caplog):
+    client = HttpClient(max_retries=2)
+    stub_server.script = [(503, b'busy', 0), (None, b'', 0)]
+
+    with caplog.at_level('WARNING', logger=http_client_service.__name__):
+        client.get(f'{stub_server.url}/search?lat=49.8412&lng=24.0315')
+    assert [record.getMessage() for record in caplog.records] == [
+        'Got 503 from /search, retrying',
+        'Connection error on /search, retrying: ConnectionError',
+    ]
+
+
+def test_the_last_failure_is_returned_or_raised(stub_server, sleeps):
+    client = HttpClient(max_retries=1, backoff_factor=0.1)
+
+    stub_server.script = [(502, b'bad gateway', 0), (503, b'busy', 0)]
+    assert client.get(f'{stub_server.url}/search').status_code == 503
+
+    # Client errors are not retried
+    stub_server.script = [(404, b'not found', 0)]
+    assert client.get(f'{stub_server.url}/search').status_code == 404
+
+    stub_server.script = [(None, b'', 0), (None, b'', 0)]
+    with pytest.raises(requests.ConnectionError):
+        client.get(f'{stub_server.url}/search')
+    assert len(stub_server.requests) == 5 and len(sleeps) == 2
+    assert all(0 <= delay <= 0.1 for delay in sleeps)
+
+
+def test_slow_responses_time_out(stub_server, sleeps):
+    client = HttpClient(read_timeout=0.1, max_retries=2)
+    stub_server.script = [(200, b'late', 0.5)]
+    with pytest.raises(requests.ReadTimeout):
+        client.get(f'{stub_server.url}/search')
+    # Read timeouts are not retried: the request may have been handled
+    assert len(stub_server.requests) == 1 and sleeps == []
+
+    # The limiter slot was released
+    assert client.get(f'{stub_server.url}/search', timeout=1).text == 'ok'
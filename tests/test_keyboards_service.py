@@ -0,0 +1,20 @@
+from src.services.keyboards_service import KeyboardService
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+
+
+def test_categories_markups_are_shared_until_the_categories_change(monkeypatch):
+    categories = ('Food', 'Clothes', 'Shelter')
+    monkeypatch.setattr(SafeRefugeApiService, 'get_category_list', staticmethod(lambda: categories))
+
+    markup = KeyboardService.get_categories_markup({'Food': 'Food'})
+    assert [row[0].text for row in markup.keyboard] == ['Clothes', 'Shelter']
+    assert KeyboardService.get_categories_markup(['Food']) is markup
+    assert markup.to_json() is markup.to_json()
+    assert KeyboardService.get_categories_markup(['Food'], placeholder='Category:') is not markup
+
+    # An equal category list keeps the markups, a new one rebuilds them
+    categories = ('Food', 'Clothes', 'Shelter')
+    assert KeyboardService.get_categories_markup(['Food']) is markup
+    categories = ('Food', 'Clothes', 'Shelter', 'Legal')
+    rebuilt = KeyboardService.get_categories_markup(['Food'])
+    assert [row[0].text for row in rebuilt.keyboard] == ['Clothes', 'Legal', 'Shelter']
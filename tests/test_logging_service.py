@@ -0,0 +1,168 @@
+import ast
+import io
+import json
+import logging
+import os
+from pathlib import Path
+from queue import Queue
+
+import pytest
+from telegram import Location
+from telegram.ext import Dispatcher
+
+from config.settings import Settings
+from src.conversations import search_conversation, start_conversation
+from src.services import geocode_service, safe_refuge_api_service
+from src.services.geocode_cache_service import GeocodeCache
+from src.services.geocode_service import GeocodeService
+from src.services.logging_service import JsonFormatter, LoggingService, LogPipeline, REDACTED, SampledLogger, correlated
+from src.services.metrics_service import MetricsService
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+from tests.fakes import FakeBot, make_update
+
+
+def json_pipeline(queue_size=10000):
+    output = io.StringIO()
+    stream = logging.StreamHandler(output)
+    stream.setFormatter(JsonFormatter())
+    return LogPipeline(stream, queue_size), output
+
+
+@pytest.fixture
+def log_to():
+    """
+    Sends the DEBUG records of loggers to a handler only, for the test.
+    """
+    saved = []
+
+    def log_to(name, handler):
+        logger = logging.getLogger(name)
+        saved.append((logger, logger.handlers, logger.level, logger.propagate))
+        logger.handlers, logger.propagate = [handler], False
+        logger.setLevel(logging.DEBUG)
+        return logger
+
+    yield log_to
+    for logger, handlers, level, propagate in reversed(saved):
+        logger.handlers, logger.propagate = handlers, propagate
+        logger.setLevel(level)
+
+
+def test_records_are_written_as_redacted_json_by_the_writer(search_calls, log_to, monkeypatch):
+    pipeline, output = json_pipeline()
+    monkeypatch.setattr(search_conversation.sampled_logger, 'rate', 1)
+    monkeypatch.setattr(safe_refuge_api_service.sampled_logger, 'rate', 1)
+    for name in ('src.conversations', 'src.services.safe_refuge_api_service'):
+        log_to(name, pipeline.handler)
+    pipeline.start()
+
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=0, use_context=True)
+    dispatcher.add_handler(search_conversation.get_search_conv_handler())
+    steps = [{'text': '/search'}, {'text': 'Food'}, {'text': 'No'}, {'location': Location(24.031234, 49.842345)}]
+    for update_id, step in enumerate(steps, start=1):
+        dispatcher.process_update(make_update(bot, update_id, 7, **step))
+    correlated(lambda update: SafeRefugeApiService.get_search_url(latitude=49.842345, longitude=24.031234))(make_update(bot, 5, 7))
+    pipeline.stop()
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [(record['correlation_id'], record['message']) for record in records] == [
+        (1, 'Search started'), (2, 'Category selected'), (3, 'Categories selected'),
+        (4, 'Location received'), (5, 'Request params')
+    ]
+    assert records[1]['category'] == 'Food' and records[2]['categories'] == ['Food']
+    assert (records[3]['latitude'], records[3]['longitude']) == (49.8, 24.0)
+    assert (records[4]['params']['latitude'], records[4]['params']['limit']) == (49.8, 20)
+    assert 'user7' not in output.getvalue() and '49.84' not in output.getvalue()
+
+
+def test_sampling_rates_per_logger_keep_whole_updates_and_full_queues_drop(log_to, monkeypatch):
+    monkeypatch.setattr(LoggingService, 'sample_rates', {'src.services': 0.0, 'src.services.geocode_service': 1.0})
+    assert LoggingService.get_sample_rate('src.services.geocode_service') == 1.0
+    assert LoggingService.get_sample_rate('src.services.gazetteer_service') == 0.0
+    assert LoggingService.get_sample_rate('main') == LoggingService.settings.log_sample_rate
+
+    # An update is logged by every logger sampling it, or by none
+    pipeline, output = json_pipeline()
+    loggers = [SampledLogger(log_to(f'tests.sampled.{index}', pipeline.handler), rate=0.5) for index in range(3)]
+    pipeline.start()
+
+    def handle(update):
+        for sampled in loggers:
+            sampled.debug('Handled', name='Taras')
+
+    bot = FakeBot()
+    for update_id in range(200):
+        correlated(handle)(make_update(bot, update_id, 1))
+    pipeline.stop()
+
+    per_update = {}
+    for line in output.getvalue().splitlines():
+        record = json.loads(line)
+        per_update[record['correlation_id']] = per_update.get(record['correlation_id'], 0) + 1
+        assert record['name'] == REDACTED
+    assert set(per_update.values()) == {3} and 50 < len(per_update) < 150
+
+    # Until the writer starts, the records beyond the queue size are dropped
+    pipeline, output = json_pipeline(queue_size=2)
+    logger = log_to('tests.sampled.0', pipeline.handler)
+    dropped = MetricsService.log_dropped._values.get((), 0)
+    for index in range(5):
+        logger.info('Record %s', index)
+    assert MetricsService.log_dropped._values[()] == dropped + 3
+
+    pipeline.start()
+    pipeline.stop()
+    assert [json.loads(line)['message'] for line in output.getvalue().splitlines()] == ['Record 0', 'Record 1']
+
+
+class FakeGoogleMaps:
+    def geocode(self, address):
+        return [{"formatted_address": "Shevchenka St 12, Lviv", "geometry": {"location": {"lat": 49.842345, "lng": 24.031234}}}]
+
+
+def test_configure_works_without_fork_and_never_writes_names_or_addresses(capsys, monkeypatch):
+    root = logging.getLogger()
+    monkeypatch.setattr(root, 'handlers', list(root.handlers))
+    monkeypatch.setattr(LoggingService, 'pipeline', None)
+    # Like on Windows
+    monkeypatch.delattr(os, 'register_at_fork', raising=False)
+    monkeypatch.setattr(geocode_service.sampled_logger, 'rate', 1)
+    monkeypatch.setattr(GeocodeService, 'gmaps', FakeGoogleMaps())
+    monkeypatch.setattr(GeocodeService, 'cache', GeocodeCache())
+
+    level = root.level
+    pipeline = LoggingService.configure(Settings(_env_file=None, log_format='json', log_level='DEBUG'))
+    try:
+        assert root.handlers == [pipeline.handler] and pipeline.writer is not None
+
+        bot = FakeBot()
+        start_conversation.gender(make_update(bot, 1, 7, text='Girl'), None)
+        start_conversation.location(make_update(bot, 2, 7, location=Location(24.031234, 49.842345)), None)
+        GeocodeService.get_geocode('Shevchenka St 12')
+    finally:
+        root.setLevel(level)
+        pipeline.stop()
+
+    records = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    by_message = {record['message']: record for record in records}
+    assert by_message['Gender selected']['first_name'] == REDACTED
+    assert (by_message['Location received']['latitude'], by_message['Location received']['longitude']) == (49.8, 24.0)
+    assert by_message['Geocode recognised address']['location'] == {"lat": 49.8, "lng": 24.0}
+    for text in ('user7', 'Girl', 'Shevchenka', '49.84', '24.03'):
+        assert all(text not in json.dumps(record) for record in records), text
+
+
+def test_log_messages_are_formatted_lazily():
+    # Formatting is left to the log writer, after sampling and level filtering
+    eager = []
+    for path in sorted(Path(__file__).parent.parent.joinpath('src').rglob('*.py')):
+        for node in ast.walk(ast.parse(path.read_text(), str(path))):
+            if (
+                isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ('debug', 'info', 'warning', 'error', 'exception', 'critical', 'log')
+                and any(isinstance(arg, ast.JoinedStr) for arg in node.args[:2])
+            ):
+                eager.append(f'{path.name}:{node.lineno}')
+    assert eager == []
@@ -0,0 +1,182 @@
+import threading
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from src.services.message_scheduler_service import MessageScheduler
+from src.services.metrics_service import MetricsService
+
+
+class Sends:
+    """Send callable recording the messages sent, and when."""
+
+    def __init__(self, fail=None):
+        self.lock = threading.Lock()
+        self.sent = []
+        self.fail = fail
+
+    def __call__(self, endpoint, data, kwargs):
+        with self.lock:
+            self.sent.append((time.monotonic(), data['chat_id'], endpoint, data.get('text'), kwargs.get('reply_markup')))
+            attempt = len(self.sent)
+        if self.fail is not None:
+            self.fail(attempt)
+        return attempt
+
+
+@pytest.fixture
+def new_scheduler():
+    schedulers = []
+
+    def new_scheduler(**kwargs):
+        scheduler = MessageScheduler(**kwargs)
+        scheduler.start()
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield new_scheduler
+    for scheduler in schedulers:
+        scheduler.stop()
+
+
+def send_text(scheduler, send, chat_id, text, **kwargs):
+    return scheduler.submit(chat_id, 'sendMessage', {'chat_id': chat_id, 'text': text}, kwargs, send)
+
+
+def test_chats_are_sent_at_their_rate_without_waiting_for_each_other(new_scheduler):
+    scheduler = new_scheduler(global_rate=1000, global_burst=1000, chat_rate=20, chat_burst=1)
+    send = Sends()
+    started_at = time.monotonic()
+    # Keyboards are not coalesced
+    futures = [send_text(scheduler, send, 1, f'Message {index}', reply_markup='keyboard') for index in range(5)]
+    futures.append(send_text(scheduler, send, 2, 'Other chat'))
+    for future in futures:
+        future.result(timeout=5)
+
+    first_chat = [sent_at for sent_at, chat_id, *_ in send.sent if chat_id == 1]
+    assert [text for _, chat_id, _, text, _ in send.sent if chat_id == 1] == [f'Message {index}' for index in range(5)]
+    # One message every 1/20 s, after the first
+    assert first_chat[-1] - started_at >= 4 / 20
+    other_chat = [sent_at for sent_at, chat_id, *_ in send.sent if chat_id == 2]
+    assert other_chat[0] < first_chat[1]
+
+
+def test_all_chats_share_the_global_rate(new_scheduler):
+    started_at = time.monotonic()
+    scheduler = new_scheduler(global_rate=20, global_burst=2, chat_rate=1000, chat_burst=1000)
+    send = Sends()
+    futures = [send_text(scheduler, send, chat_id, 'Hello') for chat_id in range(6)]
+    for future in futures:
+        future.result(timeout=5)
+
+    # A burst of 2, then one message every 1/20 s
+    assert sorted(chat_id for _, chat_id, *_ in send.sent) == list(range(6))
+    assert max(sent_at for sent_at, *_ in send.sent) - started_at >= 4 / 20
+    assert scheduler.stats()['sent'] == 6 and scheduler.stats()['queue_depth'] == 0
+
+
+def test_consecutive_texts_of_a_chat_are_coalesced(new_scheduler):
+    scheduler = new_scheduler(chat_rate=1000, chat_burst=1000)
+    sending, release = threading.Event(), threading.Event()
+
+    def fail(attempt):
+        # Hold the first send, so the next messages queue behind it
+        if attempt == 1:
+            sending.set()
+            release.wait(5)
+
+    send = Sends(fail)
+    first = send_text(scheduler, send, 1, 'First')
+    assert sending.wait(5)
+    futures = [
+        send_text(scheduler, send, 1, 'Second'),
+        send_text(scheduler, send, 1, 'Third', reply_markup='keyboard'),
+        send_text(scheduler, send, 1, 'After the keyboard'),
+        scheduler.submit(1, 'sendLocation', {'chat_id': 1, 'latitude': 49.8, 'longitude': 24.0}, {}, send),
+        send_text(scheduler, send, 1, 'After the location'),
+    ]
+    assert scheduler.stats()['queue_depth'] == 5
+    release.set()
+
+    assert first.result(timeout=5) == 1
+    assert [future.result(timeout=5) for future in futures] == [2, 2, 3, 4, 5]
+    assert [(endpoint, text, markup) for _, _, endpoint, text, markup in send.sent] == [
+        ('sendMessage', 'First', None),
+        ('sendMessage', 'Second\n\nThird', 'keyboard'),
+        ('sendMessage', 'After the keyboard', None),
+        ('sendLocation', None, None),
+        ('sendMessage', 'After the location', None),
+    ]
+    assert scheduler.stats()['coalesced'] == 1
+
+
+def test_flood_waits_pause_the_chat_then_retry(new_scheduler):
+    scheduler = new_scheduler(max_retries=2)
+
+    def fail(attempt):
+        if attempt == 1:
+            raise RetryAfter(0.2)
+
+    send = Sends(fail)
+    first = send_text(scheduler, send, 1, 'Rejected once', reply_markup='keyboard')
+    second = send_text(scheduler, send, 1, 'Queued behind it')
+    other = send_text(scheduler, send, 2, 'Other chat')
+    for future in (first, second, other):
+        future.result(timeout=5)
+
+    first_chat = [(sent_at, text) for sent_at, chat_id, _, text, _ in send.sent if chat_id == 1]
+    # The order of the chat is kept, after its flood wait
+    assert [text for _, text in first_chat] == ['Rejected once', 'Rejected once', 'Queued behind it']
+    assert first_chat[1][0] - first_chat[0][0] >= 0.2
+    assert [sent_at for sent_at, chat_id, *_ in send.sent if chat_id == 2][0] < first_chat[1][0]
+    assert scheduler.stats()['retried'] == 1
+
+    # Rejected more than max_retries times: the caller gets the error
+    def always_fail(attempt):
+        raise RetryAfter(0.01)
+
+    scheduler = new_scheduler(max_retries=2)
+    send = Sends(always_fail)
+    with pytest.raises(RetryAfter):
+        send_text(scheduler, send, 1, 'Never sent').result(timeout=5)
+    assert len(send.sent) == 3 and scheduler.stats()['failed'] == 1
+
+
+def test_stopping_waits_for_the_sends_in_flight(new_scheduler):
+    scheduler = new_scheduler(chat_rate=1000, chat_burst=1000)
+    sending, release = threading.Event(), threading.Event()
+
+    def fail(attempt):
+        if attempt == 1:
+            sending.set()
+            release.wait(5)
+
+    send = Sends(fail)
+    in_flight = send_text(scheduler, send, 1, 'Being sent', reply_markup='keyboard')
+    queued = send_text(scheduler, send, 1, 'Queued')
+    assert sending.wait(5)
+
+    stopping = threading.Thread(target=scheduler.stop)
+    stopping.start()
+    time.sleep(0.05)
+    release.set()
+    stopping.join(5)
+
+    assert in_flight.result(timeout=1) == 1
+    with pytest.raises(RuntimeError):
+        queued.result(timeout=1)
+    assert scheduler.stats()['queue_depth'] == 0
+
+
+def test_the_scheduler_is_exposed_in_the_metrics(new_scheduler, monkeypatch):
+    monkeypatch.setattr(MetricsService, '_schedulers', [])
+    count = sum(MetricsService.scheduler_latency._values.get((), [[0], 0])[0])
+    scheduler = MetricsService.register_scheduler(new_scheduler())
+    send = Sends()
+    send_text(scheduler, send, 1, 'Hello').result(timeout=5)
+
+    metrics = MetricsService.render()
+    assert 'bot_scheduler_queue_depth 0' in metrics
+    assert 'bot_scheduler_messages_total{result="sent"} 1' in metrics
+    assert sum(MetricsService.scheduler_latency._values[()][0]) == count + 1
@@ -0,0 +1,43 @@
+import urllib.request
+
+from src.services.metrics_service import MetricsRegistry, MetricsServer, MetricsService
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    latency = registry.histogram('test_seconds', 'Test latency.', ('endpoint',), buckets=(0.1, 1))
+    latency.observe(0.05, endpoint='search')
+    latency.observe(0.5, endpoint='search')
+    latency.observe(5, endpoint='search')
+    errors = registry.counter('test_errors_total', 'Test errors.', ('endpoint',))
+    errors.inc(endpoint='say "hi"\n')
+
+    lines = registry.render().splitlines()
+
+    assert '# TYPE test_seconds histogram' in lines
+    assert 'test_seconds_bucket{endpoint="search",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{endpoint="search",le="1"} 2' in lines
+    assert 'test_seconds_bucket{endpoint="search",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{endpoint="search"} 3' in lines
+    assert 'test_errors_total{endpoint="say \\"hi\\"\\n"} 1' in lines
+
+
+def test_metrics_endpoint_serves_handler_and_upstream_metrics():
+    handler = MetricsService.instrument_handler(lambda update, context: 1, 'test', 'CHECK_INFO')
+    assert handler(None, None) == 1
+    with MetricsService.time_upstream('category'):
+        pass
+
+    server = MetricsServer(port=0)
+    server.start()
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+            body = response.read().decode()
+            content_type = response.headers['Content-Type']
+    finally:
+        server.stop()
+
+    assert content_type.startswith('text/plain; version=0.0.4')
+    assert 'bot_handler_seconds_count{conversation="test",state="CHECK_INFO",handler="<lambda>"} 1' in body
+    assert 'bot_upstream_seconds_count{endpoint="category"}' in body
+    assert '# TYPE bot_cache_hit_ratio gauge' in body
@@ -0,0 +1,110 @@
+import threading
+from queue import Queue
+
+import pytest
+import telegram
+from telegram import CallbackQuery, Location, Update, User
+from telegram.ext import ConversationHandler, Dispatcher
+
+from src.conversations import search_conversation
+from src.services import persistence_service
+from src.services.persistence_service import SessionPersistence, SqliteSessionStore, conversation_key, conversations_lock
+from tests.fakes import CATEGORIES, FakeBot, make_update
+
+CHAT_ID = 42
+
+
+def start_dispatcher(path, session_ttl=3600):
+    bot = FakeBot()
+    persistence = SessionPersistence(SqliteSessionStore(str(path)), flush_interval=60, session_ttl=session_ttl)
+    dispatcher = Dispatcher(bot, Queue(), workers=0, persistence=persistence, use_context=True)
+    conv_handler = search_conversation.get_search_conv_handler(persistent=True)
+    dispatcher.add_handler(conv_handler)
+    persistence.add_conversation_handlers([conv_handler])
+    return bot, dispatcher, conv_handler
+
+
+def test_conversation_survives_restart(tmp_path, search_calls):
+    path = tmp_path / 'sessions.db'
+
+    bot, dispatcher, conv_handler = start_dispatcher(path)
+    dispatcher.process_update(make_update(bot, 1, CHAT_ID, text='/search'))
+    dispatcher.process_update(make_update(bot, 2, CHAT_ID, text='Food'))
+    dispatcher.persistence.stop()
+
+    bot, dispatcher, conv_handler = start_dispatcher(path)
+    assert conv_handler.conversations == {(CHAT_ID, CHAT_ID): search_conversation.ADD_CATEGORY}
+    assert dict(dispatcher.chat_data) == {}
+
+    dispatcher.process_update(make_update(bot, 3, CHAT_ID, text='Yes'))
+    text, markup = bot.sent[CHAT_ID][-1]
+    assert text == 'OK, select another category.'
+    assert [row[0].text for row in markup.keyboard] == [category for category in sorted(CATEGORIES) if category != 'Food']
+
+    dispatcher.process_update(make_update(bot, 4, CHAT_ID, text='Legal'))
+    dispatcher.process_update(make_update(bot, 5, CHAT_ID, text='No'))
+    dispatcher.process_update(make_update(bot, 6, CHAT_ID, location=Location(longitude=24.0, latitude=49.8)))
+    assert search_calls[CHAT_ID] == [['Food', 'Legal']]
+    dispatcher.persistence.stop()
+
+    # The results are still there to page through
+    bot, dispatcher, conv_handler = start_dispatcher(path)
+    results = dispatcher.chat_data[CHAT_ID][search_conversation.SEARCH_RESULTS_KEY]
+    assert results.token == 6
+    assert results.categories == ['Food', 'Legal']
+    assert results.items[0].name == f'poi-{CHAT_ID}-0'
+
+
+def test_idle_sessions_are_evicted(tmp_path, search_calls):
+    path = tmp_path / 'sessions.db'
+
+    bot, dispatcher, conv_handler = start_dispatcher(path, session_ttl=0)
+    dispatcher.process_update(make_update(bot, 1, CHAT_ID, text='/search'))
+    assert CHAT_ID in dispatcher.chat_data
+
+    # The conversations are evicted under the lock of their handler
+    with conv_handler._conversations_lock:
+        flush = threading.Thread(target=dispatcher.persistence.flush)
+        flush.start()
+        flush.join(0.2)
+        assert flush.is_alive() and conv_handler.conversations
+    flush.join()
+    assert CHAT_ID not in dispatcher.chat_data
+    assert conv_handler.conversations == {}
+
+    dispatcher.persistence.flush()
+    store = dispatcher.persistence.store
+    assert store.load_chat_data(CHAT_ID) is None
+    assert store.load_conversations('search', 0) == {}
+
+
+@pytest.mark.parametrize('per_chat, per_user, per_message', [
+    (True, True, False), (True, False, False), (False, True, False), (True, True, True), (False, False, True),
+])
+def test_conversation_keys_are_the_keys_of_the_handler(per_chat, per_user, per_message):
+    handler = ConversationHandler([], {}, [], per_chat=per_chat, per_user=per_user, per_message=per_message)
+    message = make_update(FakeBot(), 1, CHAT_ID, text='Food').message
+    updates = [
+        Update(1, callback_query=CallbackQuery('1', User(7, 'user', False), 'instance', message=message)),
+        Update(2, callback_query=CallbackQuery('2', User(7, 'user', False), 'instance', inline_message_id='inline')),
+    ]
+    if not per_message:
+        updates.append(make_update(FakeBot(), 3, CHAT_ID, text='Food'))
+
+    for update in updates:
+        try:
+            expected = handler._get_key(update)
+        except AttributeError:
+            with pytest.raises(AttributeError):
+                conversation_key(handler, update)
+        else:
+            assert conversation_key(handler, update) == expected
+
+
+def test_conversation_locks_are_only_shared_on_the_checked_version(monkeypatch):
+    handler = search_conversation.get_search_conv_handler(persistent=True)
+    assert telegram.__version__ == persistence_service.PTB_VERSION
+    assert conversations_lock(handler) is handler._conversations_lock
+
+    monkeypatch.setattr(telegram, '__version__', '20.0')
+    assert conversations_lock(handler) is None
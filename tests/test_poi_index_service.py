@@ -0,0 +1,112 @@
+import random
+
+from config.settings import Settings
+from src.services.poi_index_service import PoiIndex, PoiIndexService
+from src.services.poi_stream_service import PoiRecord
+from src.services.prefetch_service import PrefetchService, SearchPrefetcher
+from src.services.ranking_service import haversine
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+
+LOCATION = (49.84, 24.03)
+CATEGORIES = ['Clothes', 'Food', 'Medical', 'Shelter']
+
+
+def random_points(rng, count: int) -> list:
+    # Clustered around a few cities, some points in several categories
+    centers = [(49.84, 24.03), (50.45, 30.52), (48.29, 25.94)]
+    points = []
+    for index in range(count):
+        latitude, longitude = rng.choice(centers)
+        categories = tuple(rng.sample(CATEGORIES, rng.choice((1, 1, 2))))
+        coordinates = (longitude + rng.gauss(0, 0.3), latitude + rng.gauss(0, 0.2))
+        points.append(PoiRecord(index, f'poi-{index}', categories, coordinates))
+    return points
+
+
+def brute_force(points, latitude, longitude, categories=None, skip=0, limit=20, min_distance=0, max_distance=500000):
+    found = []
+    for index, item in enumerate(points):
+        if categories and not set(categories) & set(item.category):
+            continue
+        distance = haversine(latitude, longitude, item.latitude, item.longitude)
+        if min_distance <= distance <= max_distance:
+            found.append((distance, index))
+    found.sort()
+    return [(points[index].id, round(distance, 6)) for distance, index in found[skip:skip + limit]]
+
+
+def test_ring_search_finds_the_same_points_as_a_brute_force_search():
+    rng = random.Random(9)
+    points = random_points(rng, 2000)
+    index = PoiIndex(points, cell_degrees=0.1)
+
+    queries = [
+        dict(),
+        dict(categories=['Food']),
+        dict(categories=['Medical', 'Shelter'], limit=50),
+        dict(categories=['Clothes'], skip=15, limit=10),
+        dict(min_distance=20000, limit=30),
+        dict(max_distance=15000, limit=500),
+        dict(categories=['Food', 'Clothes'], min_distance=5000, max_distance=60000, skip=5, limit=40),
+        dict(max_distance=1),
+    ]
+    for query in queries:
+        for _ in range(5):
+            latitude, longitude = rng.uniform(48, 51), rng.uniform(23, 31)
+            found = [(item.id, round(item.distance, 6)) for item in index.search(latitude, longitude, **query)]
+            assert found == brute_force(points, latitude, longitude, **query), query
+
+    # A point of two requested categories is found once
+    both = [item for item in points if {'Medical', 'Shelter'} <= set(item.category)]
+    assert both
+    found = index.search(both[0].latitude, both[0].longitude, ['Medical', 'Shelter'], limit=5)
+    assert [item.id for item in found].count(both[0].id) == 1
+
+
+def test_sync_pages_through_the_api_and_reports_the_changes(monkeypatch):
+    points = random_points(random.Random(3), 25)
+    pages = []
+
+    def get_points_of_interest(chat_id, skip=0, limit=20, **kwargs):
+        pages.append((skip, limit))
+        return iter(points[skip:skip + limit])
+
+    changes = []
+    monkeypatch.setattr(SafeRefugeApiService, 'get_points_of_interest', staticmethod(get_points_of_interest))
+    monkeypatch.setattr(PoiIndexService, 'settings', Settings(_env_file=None, poi_index_page_size=10))
+    monkeypatch.setattr(PoiIndexService, 'index', None)
+    monkeypatch.setattr(PoiIndexService, '_listeners', [changes.append])
+
+    assert len(PoiIndexService.sync()) == 25
+    assert pages == [(0, 10), (10, 10), (20, 10)]
+
+    # A full last page is followed by an empty one
+    del points[20:]
+    pages.clear()
+    assert len(PoiIndexService.sync()) == 20
+    assert pages == [(0, 10), (10, 10), (20, 10)]
+
+    # The listeners get the points added or changed since the previous sync, none on the first one
+    assert changes == []
+    points[3] = PoiRecord(points[3].id, 'Renamed', points[3].category, points[3].coordinates)
+    points.append(PoiRecord('new', 'New point', ('Food',), (24.03, 49.84)))
+    PoiIndexService.sync()
+    assert [[item.id for item in items] for items in changes] == [[3, 'new']]
+
+
+def test_the_replica_synced_for_the_alerts_does_not_answer_searches(search_calls, monkeypatch):
+    replica = PoiIndex([PoiRecord('local-0', 'Local shelter', ('Food',), (LOCATION[1], LOCATION[0]))])
+    monkeypatch.setattr(PoiIndexService, 'index', replica)
+    monkeypatch.setattr(PrefetchService, 'prefetcher', SearchPrefetcher(PrefetchService.search_candidates, workers=1))
+
+    # Subscriptions on, index off: the searches go to the API, and are prefetched
+    monkeypatch.setattr(PoiIndexService, 'settings', Settings(_env_file=None, subscriptions_enabled=True, poi_index_enabled=False))
+    results = PoiIndexService.search_nearby(1, *LOCATION, ['Food'])
+    assert search_calls[1] == [['Food']] and results[0].name == 'poi-1-0'
+    PrefetchService.prefetch(2, *LOCATION, ['Food'])
+    assert PrefetchService.prefetcher.stats() == {"chats": 1, "searches": 1}
+
+    # Index on: answered from the replica
+    monkeypatch.setattr(PoiIndexService, 'settings', Settings(_env_file=None, subscriptions_enabled=True, poi_index_enabled=True))
+    assert [item.name for item in PoiIndexService.search_nearby(3, *LOCATION, ['Food'])] == ['Local shelter']
+    assert 3 not in search_calls
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from src.services.poi_stream_service import PoiRecord, iter_json_items
+
+ITEMS = [
+    {'id': 1, 'name': 'Café Étoile', 'categories': ['Food'], 'geo': {'coordinates': [2.35, 48.85]}, 'distance': 120.5},
+    {'id': 2, 'name': 'Shelter', 'category': 'Shelter', 'geo': {'coordinates': [24.03, 49.84]}, 'distance': 1234567},
+    {'id': 3, 'name': 'Shelter', 'categories': ['Shelter', 'Medical'], 'geo': {'coordinates': [24.04, 49.85]}},
+]
+
+
+def chunked(body: bytes, size: int):
+    return (body[start:start + size] for start in range(0, len(body), size))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_items_are_parsed_incrementally(chunk_size):
+    body = json.dumps({'count': 1234, 'items': ITEMS, 'next': None}, ensure_ascii=False, indent=1).encode()
+
+    records = [PoiRecord.from_item(item) for item in iter_json_items(chunked(body, chunk_size))]
+
+    assert [record.name for record in records] == ['Café Étoile', 'Shelter', 'Shelter']
+    assert records[1].category == ('Shelter',)
+    assert records[1].distance == 1234567
+    assert (records[2].latitude, records[2].longitude) == (49.85, 24.04)
+    assert records[2].distance is None
+
+
+def test_empty_and_truncated_responses():
+    assert list(iter_json_items([b'{"items": []}'])) == []
+    assert list(iter_json_items([b'{"count": 0}'])) == []
+
+    with pytest.raises(ValueError):
+        list(iter_json_items(chunked(json.dumps({'items': ITEMS}).encode()[:-30], 5)))
+
+
+def test_record_state_round_trip():
+    record = PoiRecord.from_item(ITEMS[0])
+    assert PoiRecord.from_state(json.loads(json.dumps(record.to_state()))) == record
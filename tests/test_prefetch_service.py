@@ -0,0 +1,112 @@
+import threading
+from queue import Queue
+
+import pytest
+from telegram import Location
+from telegram.ext import Dispatcher
+
+from src.conversations import search_conversation
+from src.services.cache_service import SingleFlightCache
+from src.services.poi_stream_service import PoiRecord
+from src.services.prefetch_service import PrefetchService, SearchPrefetcher
+from src.services.ranking_service import RankingService
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+from tests.fakes import FakeBot, make_update
+
+CATEGORIES = ['Food', 'Medical', 'Shelter']
+LOCATION = (49.84, 24.03)
+
+
+def points(category: str, latitude: float, longitude: float, count: int = 150) -> list:
+    offset = CATEGORIES.index(category)
+    return [
+        PoiRecord(f'{category}-{index}', f'{category} {index}', (category,), (longitude + (index * 3 + offset) * 1e-4, latitude))
+        for index in range(count)
+    ]
+
+
+class ApiCalls(list):
+    """Categories of the API searches; they wait while the gate is closed."""
+
+    def __init__(self):
+        super().__init__()
+        self.gate = threading.Event()
+        self.gate.set()
+
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    calls = ApiCalls()
+    gate = calls.gate
+
+    def get_points_of_interest(chat_id, categories=None, skip=0, limit=20, latitude=None, longitude=None, **kwargs):
+        gate.wait(5)
+        calls.append(sorted(categories))
+        items = sorted(
+            (item for category in categories for item in points(category, latitude, longitude)),
+            key=lambda item: item.longitude
+        )
+        return iter(items[skip:skip + limit])
+
+    monkeypatch.setattr(SafeRefugeApiService, 'get_category_list', staticmethod(lambda: list(CATEGORIES)))
+    monkeypatch.setattr(SafeRefugeApiService, 'get_points_of_interest', staticmethod(get_points_of_interest))
+    monkeypatch.setattr(SafeRefugeApiService, 'search_cache', SingleFlightCache(ttl=30))
+    monkeypatch.setattr(PrefetchService, 'prefetcher', SearchPrefetcher(PrefetchService.search_candidates, workers=2))
+    return calls
+
+
+def test_each_added_category_only_searches_the_new_one(api_calls):
+    PrefetchService.prefetch(1, *LOCATION, ['Food'])
+    PrefetchService.prefetch(1, *LOCATION, ['Food', 'Shelter'])
+    first_page = PrefetchService.search_nearby(1, *LOCATION, ['Food', 'Medical', 'Shelter'], limit=11)
+
+    # Medical was not prefetched, it is searched on its own
+    assert sorted(api_calls) == [['Food'], ['Medical'], ['Shelter']]
+
+    # Same results as a single search of the three categories
+    pool_size = RankingService.get_pool_size(11)
+    direct = list(SafeRefugeApiService.get_points_of_interest(1, CATEGORIES, limit=pool_size, latitude=LOCATION[0], longitude=LOCATION[1]))
+    assert [item.id for item in first_page] == [item.id for item in RankingService.rank(*LOCATION, direct, 11)]
+
+    # Prefetched around another location, or cancelled: not used
+    api_calls.clear()
+    PrefetchService.prefetch(2, *LOCATION, ['Food'])
+    assert PrefetchService.prefetcher.take(2, PrefetchService.get_location(50.45, 30.52), ['Food']) is None
+    api_calls.gate.clear()
+    PrefetchService.prefetch(3, 50.45, 30.52, ['Food'])
+    PrefetchService.prefetch(4, 50.45, 30.52, ['Shelter'])
+    PrefetchService.prefetch(5, 50.45, 30.52, ['Medical'])
+    PrefetchService.cancel(5)
+    api_calls.gate.set()
+    PrefetchService.prefetcher._executor.shutdown(wait=True)
+    assert ['Medical'] not in api_calls
+
+
+def test_the_new_search_of_a_chat_is_ready_when_it_sends_its_location(api_calls):
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=0, use_context=True)
+    dispatcher.add_handler(search_conversation.get_search_conv_handler())
+    dispatcher.add_handler(search_conversation.get_search_results_handler())
+
+    chat_id = 8
+    location = Location(latitude=LOCATION[0], longitude=LOCATION[1])
+    steps = [
+        {'text': '/search'}, {'text': 'Medical'}, {'text': 'No'}, {'location': location},
+        # A new search from the same place
+        {'text': 'Yes'}, {'text': 'Food'}, {'text': 'Yes'}, {'text': 'Shelter'}, {'text': 'No'}, {'location': location},
+    ]
+    for update_id, step in enumerate(steps, start=1):
+        dispatcher.process_update(make_update(bot, update_id, chat_id, **step))
+
+    assert sorted(api_calls) == [['Food'], ['Medical'], ['Shelter']]
+    assert 'Food 0' in bot.sent[chat_id][-2][0] and 'Shelter 0' in bot.sent[chat_id][-2][0]
+
+    # The merged candidates serve the next pages too
+    results = dispatcher.chat_data[chat_id][search_conversation.SEARCH_RESULTS_KEY]
+    assert search_conversation.fetch_results_page(chat_id, results, 10)
+    assert len(api_calls) == 3
+
+    # /cancel drops what was prefetched since
+    for update_id, text in enumerate(['/search', 'Medical', '/cancel'], start=len(steps) + 1):
+        dispatcher.process_update(make_update(bot, update_id, chat_id, text=text))
+    assert PrefetchService.prefetcher.stats() == {"chats": 0, "searches": 0}
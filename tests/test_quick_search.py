@@ -0,0 +1,142 @@
+import threading
+import time
+from datetime import datetime
+from queue import Queue
+
+import pytest
+from telegram import CallbackQuery, Chat, InlineQuery, Location, Message, Update, User
+from telegram.ext import Dispatcher
+
+from src.conversations import quick_search, search_conversation
+from src.services.cache_service import SingleFlightCache
+from src.services.concurrency_service import Debouncer
+from src.services.inline_search_service import InlineSearchService
+from src.services.poi_stream_service import PoiRecord
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+from tests.fakes import FakeBot
+
+CATEGORIES = ('Clothes', 'Food', 'Legal aid', 'Shelter')
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    calls = []
+
+    def get_points_of_interest(chat_id, categories=None, skip=0, limit=20, **kwargs):
+        calls.append((tuple(categories), kwargs['latitude'], kwargs['longitude']))
+        return iter([
+            PoiRecord(index, f'{categories[0]} {index}', tuple(categories), (kwargs['longitude'], kwargs['latitude']), index * 100)
+            for index in range(skip, 3)
+        ][:limit])
+
+    monkeypatch.setattr(SafeRefugeApiService, 'get_category_list', staticmethod(lambda: CATEGORIES))
+    monkeypatch.setattr(SafeRefugeApiService, 'get_points_of_interest', staticmethod(get_points_of_interest))
+    monkeypatch.setattr(SafeRefugeApiService, 'search_cache', SingleFlightCache(ttl=30))
+    monkeypatch.setattr(InlineSearchService, 'results_cache', SingleFlightCache(ttl=30))
+    monkeypatch.setattr(InlineSearchService, 'debouncer', Debouncer(0))
+    return calls
+
+
+def test_parse_query_finds_categories_and_address():
+    assert InlineSearchService.parse_query('shelter near Lviv, Ukraine', CATEGORIES) == (['Shelter'], 'Lviv, Ukraine')
+    assert InlineSearchService.parse_query('food, legal Kyiv', CATEGORIES) == (['Food', 'Legal aid'], 'Kyiv')
+    assert InlineSearchService.parse_query('aid', CATEGORIES) == (['Legal aid'], None)
+    assert InlineSearchService.parse_query('', CATEGORIES) == (list(CATEGORIES), None)
+
+
+def test_inline_queries_are_answered_from_the_cache(searches):
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=0, use_context=True)
+    for handler in quick_search.get_quick_search_handlers():
+        dispatcher.add_handler(handler)
+
+    def inline(update_id, user_id, text):
+        query = InlineQuery(str(update_id), User(user_id, 'user', False), text, '', location=Location(24.03, 49.84), bot=bot)
+        dispatcher.process_update(Update(update_id, inline_query=query))
+
+    inline(1, 1, 'shelter')
+    inline(2, 2, 'Shelter ')
+    assert len(searches) == 1
+    results, options = bot.answers[-1]
+    assert [result.title for result in results] == ['Shelter 0', 'Shelter 1', 'Shelter 2']
+    assert options['is_personal'] is True and options['cache_time'] == InlineSearchService.settings.inline_cache_time
+
+
+def test_category_buttons_answer_with_results_in_place(searches, monkeypatch):
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=0, use_context=True)
+    for handler in quick_search.get_quick_search_handlers():
+        dispatcher.add_handler(handler)
+    chat = Chat(5, Chat.PRIVATE)
+
+    message = Message(10, datetime.now(), chat, from_user=User(5, 'user', False), location=Location(24.03, 49.84), bot=bot)
+    dispatcher.process_update(Update(1, message=message))
+    text, keyboard = bot.sent[5][-1]
+    buttons = {button.text: button.callback_data for row in keyboard.inline_keyboard for button in row}
+    assert list(buttons) == sorted(CATEGORIES)
+
+    categories_message = Message(11, datetime.now(), chat, bot=bot)
+    query = CallbackQuery('1', User(5, 'user', False), 'instance', message=categories_message, data=buttons['Food'], bot=bot)
+    dispatcher.process_update(Update(2, callback_query=query))
+
+    assert searches == [(('Food',), 49.84, 24.03)]
+    assert 'Food 0' in bot.sent[5][-1][0]
+    assert dispatcher.chat_data[5][search_conversation.SEARCH_RESULTS_KEY].token == 11
+
+    # A renamed category moves the others: the buttons of the old list are refused
+    monkeypatch.setattr(SafeRefugeApiService, 'get_category_list', staticmethod(lambda: ('Clothes', 'Legal aid', 'Meals', 'Shelter')))
+    query = CallbackQuery('2', User(5, 'user', False), 'instance', message=categories_message, data=buttons['Legal aid'], bot=bot)
+    dispatcher.process_update(Update(3, callback_query=query))
+    assert len(searches) == 1
+    assert bot.answers[-1][0] == 'These categories have changed, please send your location again.'
+
+
+def test_debouncer_runs_the_last_call_of_a_burst():
+    debouncer = Debouncer(0.05)
+    calls = []
+    done = threading.Event()
+
+    for text in ('s', 'sh', 'she', 'shelter'):
+        debouncer.submit('user', lambda text: calls.append(text) or done.set(), text)
+    debouncer.submit('other user', calls.append, 'food')
+
+    assert done.wait(1)
+    time.sleep(0.1)
+    assert sorted(calls) == ['food', 'shelter']
+    assert debouncer.dropped == 3
+
+
+
+def test_debounced_answers_share_one_thread_and_run_on_the_dispatcher_workers(searches, monkeypatch):
+    class WorkerBot(FakeBot):
+        def answer_inline_query(self, inline_query_id, results, **kwargs):
+            super().answer_inline_query(inline_query_id, results, thread=threading.current_thread().name, **kwargs)
+
+    bot = WorkerBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=2, use_context=True)
+    for handler in quick_search.get_quick_search_handlers():
+        dispatcher.add_handler(handler)
+    debouncer = Debouncer(0.05)
+    monkeypatch.setattr(InlineSearchService, 'debouncer', debouncer)
+
+    ready = threading.Event()
+    threading.Thread(target=dispatcher.start, kwargs={'ready': ready}, daemon=True).start()
+    assert ready.wait(5)
+
+    threads = threading.active_count()
+    try:
+        for user_id in range(20):
+            for update_id, text in enumerate(('she', 'shelter')):
+                query = InlineQuery(f'{user_id}-{update_id}', User(user_id, 'user', False), text, '', location=Location(24.03, 49.84), bot=bot)
+                dispatcher.process_update(Update(user_id * 2 + update_id, inline_query=query))
+        # The scheduler thread of the debouncer, not a timer per keystroke
+        assert threading.active_count() <= threads + 1
+
+        deadline = time.monotonic() + 5
+        while len(bot.answers) < 20 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        dispatcher.stop()
+
+    assert len(bot.answers) == 20 and debouncer.dropped == 20
+    assert all(':worker:' in kwargs['thread'] for _, kwargs in bot.answers)
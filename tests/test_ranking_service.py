@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from src.services.cache_service import SingleFlightCache
+from src.services.poi_index_service import PoiIndexService
+from src.services.poi_stream_service import PoiRecord
+from src.services.ranking_service import RankingService, get_numpy, haversine
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+
+LATITUDE, LONGITUDE = 49.8397, 24.0297
+
+
+def poi(id, name, category, meters_north):
+    return PoiRecord(id, name, (category,), (LONGITUDE, LATITUDE + meters_north / 111195), None)
+
+
+def test_ties_vary_the_categories_and_duplicates_are_shown_once():
+    items = [
+        poi(1, 'Shelter A', 'Shelter', 10),
+        poi(2, 'Shelter B', 'Shelter', 20),
+        poi(3, 'Shelter C', 'Shelter', 30),
+        poi(4, 'Kitchen', 'Food', 40),
+        poi(5, 'shelter  a', 'Shelter', 15),  # The same point as 1, entered twice
+        poi(6, 'Far shelter', 'Shelter', 5000),
+    ]
+
+    ranked = RankingService.rank(LATITUDE, LONGITUDE, items, 4)
+    assert [item.id for item in ranked] == [1, 4, 2, 3]
+    assert ranked[0].distance == pytest.approx(10, abs=0.1)
+    assert RankingService.rank(LATITUDE, LONGITUDE, items, 10)[-1].id == 6
+
+
+def test_ranking_matches_a_full_sort_without_ties(monkeypatch):
+    monkeypatch.setattr(RankingService.settings, 'ranking_tie_meters', 0)
+    rng = random.Random(7)
+    items = [poi(index, f'poi {index}', rng.choice('ABC'), rng.uniform(0, 20000)) for index in range(500)]
+
+    expected = sorted(items, key=lambda item: haversine(LATITUDE, LONGITUDE, item.latitude, item.longitude))[:25]
+    assert [item.id for item in RankingService.rank(LATITUDE, LONGITUDE, items, 25)] == [item.id for item in expected]
+
+
+@pytest.mark.skipif(get_numpy() is None, reason='numpy is not installed')
+def test_vectorized_distances_match(monkeypatch):
+    items = [poi(index, f'poi {index}', 'A', index * 37.5) for index in range(300)]
+    monkeypatch.setattr(RankingService.settings, 'ranking_numpy_min_items', 10 ** 6)
+    expected = RankingService.distances(LATITUDE, LONGITUDE, items)
+    monkeypatch.setattr(RankingService.settings, 'ranking_numpy_min_items', 1)
+    assert RankingService.distances(LATITUDE, LONGITUDE, items) == pytest.approx(expected)
+
+
+def test_pages_share_one_candidate_search(monkeypatch):
+    calls = []
+
+    def get_points_of_interest(chat_id, skip=0, limit=20, **kwargs):
+        calls.append((skip, limit))
+        return iter([poi(index, f'poi {index}', 'Shelter', index * 100) for index in range(skip, 45)][:limit])
+
+    monkeypatch.setattr(SafeRefugeApiService, 'get_points_of_interest', staticmethod(get_points_of_interest))
+    monkeypatch.setattr(SafeRefugeApiService, 'search_cache', SingleFlightCache(ttl=30))
+    monkeypatch.setattr(PoiIndexService, 'index', None)
+
+    pages = [PoiIndexService.search_nearby(1, LATITUDE, LONGITUDE, ['Shelter'], skip=skip, limit=11) for skip in (0, 10, 20, 30, 40)]
+    assert [item.id for page in pages for item in page[:10]] == list(range(45))
+    assert calls == [(0, RankingService.settings.ranking_candidates)]
@@ -1,6 +1,16 @@
-from safe_refuge_bot import __version__
+from queue import Queue
 
+from telegram.ext import CallbackQueryHandler, ConversationHandler, Dispatcher
 
-def test_version():
-    assert __version__ == '0.1.0'
-    
\ No newline at end of file
+import main
+from config.settings import Settings
+from tests.fakes import FakeBot
+
+
+def test_add_handlers_registers_the_conversations():
+    dispatcher = Dispatcher(FakeBot(), Queue(), workers=0, use_context=True)
+    main.add_handlers(dispatcher, Settings(_env_file=None, run_async_handlers=False))
+
+    handlers = dispatcher.handlers[0]
+    assert [handler.name for handler in handlers if isinstance(handler, ConversationHandler)] == ['start', 'search']
+    assert any(isinstance(handler, CallbackQueryHandler) for handler in handlers)
@@ -0,0 +1,175 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from queue import Queue
+
+import time
+
+import pytest
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import Dispatcher
+from telegram.ext.utils.promise import Promise
+
+from src.conversations import search_conversation
+from src.services.circuit_breaker_service import CircuitOpenError
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+from tests.fakes import CATEGORIES, FakeBot, chat_script, make_update
+
+CHATS = 500
+
+
+def make_scripts(rng):
+    chosen, pending = {}, {}
+    for chat_id in range(1, CHATS + 1):
+        chosen[chat_id], pending[chat_id] = chat_script(chat_id, rng)
+    return chosen, pending
+
+
+def assert_isolated_sessions(bot, dispatcher, conv_handler, search_calls, chosen):
+    for chat_id, (first, second) in chosen.items():
+        assert search_calls[chat_id] == [sorted([first, second])]
+        assert any(f'poi-{chat_id}-0' in text for text, markup in bot.sent[chat_id])
+
+        # After the first pick, the chat is only offered its own remaining categories
+        offered = [
+            [row[0].text for row in markup.keyboard]
+            for text, markup in bot.sent[chat_id]
+            if text == 'OK, select another category.'
+        ]
+        assert offered == [[category for category in sorted(CATEGORIES) if category != first]]
+
+    assert conv_handler.conversations == {}
+    assert not any(search_conversation.SEARCH_SESSION_KEY in data for data in dispatcher.chat_data.values())
+
+
+@pytest.mark.parametrize('workers', [1, 8])
+def test_interleaved_conversations_do_not_share_categories(search_calls, workers):
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=0, use_context=True)
+    conv_handler = search_conversation.get_search_conv_handler()
+    dispatcher.add_handler(conv_handler)
+
+    rng = random.Random(workers)
+    chosen, pending = make_scripts(rng)
+
+    # Interleave every chat's updates randomly, keeping each chat's own order,
+    # and give each worker its own subset of chats, as a dispatcher does per conversation
+    streams = [[] for _ in range(workers)]
+    update_id = 0
+    while pending:
+        chat_id = rng.choice(list(pending))
+        update_id += 1
+        streams[chat_id % workers].append(make_update(bot, update_id, chat_id, **pending[chat_id].pop(0)))
+        if not pending[chat_id]:
+            del pending[chat_id]
+
+    def replay(stream):
+        for update in stream:
+            dispatcher.process_update(update)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(replay, streams))
+
+    assert update_id == CHATS * 7
+    assert_isolated_sessions(bot, dispatcher, conv_handler, search_calls, chosen)
+
+
+def test_run_async_conversations_do_not_share_categories(search_calls):
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=8, use_context=True)
+    conv_handler = search_conversation.get_search_conv_handler(run_async=True)
+    dispatcher.add_handler(conv_handler)
+    # Starts the worker threads
+    ready = threading.Event()
+    threading.Thread(target=dispatcher.start, kwargs={'ready': ready}, daemon=True).start()
+    assert ready.wait(5)
+
+    rng = random.Random(0)
+    chosen, pending = make_scripts(rng)
+
+    # Users answer one message at a time: every round sends the next step of all chats
+    # in random order, then waits for the worker threads to finish the callbacks
+    update_id = 0
+    try:
+        for _ in range(7):
+            chat_ids = list(pending)
+            rng.shuffle(chat_ids)
+            for chat_id in chat_ids:
+                update_id += 1
+                dispatcher.process_update(make_update(bot, update_id, chat_id, **pending[chat_id].pop(0)))
+
+            deadline = time.monotonic() + 30
+            while any(
+                isinstance(state, tuple) and isinstance(state[1], Promise) and not state[1].done.is_set()
+                for state in list(conv_handler.conversations.values())
+            ):
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+
+        # The last callbacks are resolved lazily by the ConversationHandler, on the next update of the chat
+        for chat_id in chosen:
+            update_id += 1
+            dispatcher.process_update(make_update(bot, update_id, chat_id, text='Thanks'))
+    finally:
+        dispatcher.stop()
+
+    assert_isolated_sessions(bot, dispatcher, conv_handler, search_calls, chosen)
+
+
+def test_results_are_paged_and_pins_sent_on_demand(search_calls):
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=0, use_context=True)
+    dispatcher.add_handler(search_conversation.get_search_conv_handler())
+    dispatcher.add_handler(search_conversation.get_search_results_handler())
+
+    chat_id = 42
+    _, steps = chat_script(chat_id, random.Random(0))
+    for update_id, step in enumerate(steps[:6], start=1):
+        dispatcher.process_update(make_update(bot, update_id, chat_id, **step))
+
+    # The first page is a single message listing the nearest points
+    results_text, results_markup = next((text, markup) for text, markup in bot.sent[chat_id] if 'poi-42-0' in text)
+    assert 'poi-42-9' in results_text and 'poi-42-10' not in results_text
+    buttons = {button.text: button.callback_data for row in results_markup.inline_keyboard for button in row}
+    assert 'Next »' in buttons
+
+    def press(update_id, data):
+        message = Message(1000, datetime.now(), Chat(chat_id, Chat.PRIVATE), bot=bot)
+        query = CallbackQuery(str(update_id), User(chat_id, 'user', False), 'instance', message=message, data=data, bot=bot)
+        dispatcher.process_update(Update(update_id, callback_query=query))
+
+    sent_before = len(bot.sent[chat_id])
+    press(100, buttons['📍2'])
+    assert bot.sent[chat_id][sent_before][0] == 'location'
+
+    press(101, buttons['Next »'])
+    page_text, _ = bot.sent[chat_id][-1]
+    assert 'poi-42-10' in page_text and 'poi-42-0<' not in page_text
+    assert search_calls[chat_id][-1] == search_calls[chat_id][0]
+
+
+def test_unavailable_search_keeps_the_location_state(search_calls, monkeypatch):
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=0, use_context=True)
+    conv_handler = search_conversation.get_search_conv_handler()
+    dispatcher.add_handler(conv_handler)
+
+    chat_id = 7
+    _, steps = chat_script(chat_id, random.Random(0))
+    for update_id, step in enumerate(steps[:5], start=1):
+        dispatcher.process_update(make_update(bot, update_id, chat_id, **step))
+
+    def unavailable(*args, **kwargs):
+        raise CircuitOpenError('safe_refuge is unavailable')
+
+    get_points_of_interest = SafeRefugeApiService.get_points_of_interest
+    monkeypatch.setattr(SafeRefugeApiService, 'get_points_of_interest', staticmethod(unavailable))
+    dispatcher.process_update(make_update(bot, 6, chat_id, **steps[5]))
+    assert bot.sent[chat_id][-1][0].startswith('Sorry, I cannot look for points of interest right now.')
+    assert conv_handler.conversations[(chat_id, chat_id)] == search_conversation.LOCATION
+
+    # Sending the location again once the API is back
+    monkeypatch.setattr(SafeRefugeApiService, 'get_points_of_interest', staticmethod(get_points_of_interest))
+    dispatcher.process_update(make_update(bot, 7, chat_id, **steps[5]))
+    assert conv_handler.conversations[(chat_id, chat_id)] == search_conversation.DONE
@@ -0,0 +1,89 @@
+import random
+import time
+from queue import Queue
+
+import pytest
+from telegram.ext import Dispatcher
+
+from src.conversations import search_conversation
+from src.services.geocode_cache_service import GeocodeCache
+from src.services.persistence_service import RespSessionStore, SessionPersistence
+from src.services.shared_store_service import RespClient, RespError, RespStandInServer, SharedCache
+from tests.fakes import FakeBot, chat_script, make_update
+
+
+@pytest.fixture
+def server():
+    server = RespStandInServer().start()
+    yield server
+    server.stop()
+
+
+def test_pipelined_commands_share_a_round_trip(server, tmp_path):
+    client = RespClient.from_url(server.url)
+    replies = client.pipeline([
+        ('SET', 'a', b'1'),
+        ('SET', 'b', 'two', 'PX', 50),
+        ('MGET', 'a', 'b', 'c'),
+        ('NOPE',),
+    ])
+    assert replies[:3] == ['OK', 'OK', [b'1', b'two', None]]
+    assert isinstance(replies[3], RespError)
+    assert client.round_trips == 1
+
+    time.sleep(0.1)
+    assert client.execute('GET', 'b') is None
+    with pytest.raises(RespError):
+        client.execute('NOPE')
+
+    # The file-backed stand-in keeps its data over a restart
+    path = str(tmp_path / 'store.json')
+    stored = RespStandInServer(path=path).start()
+    RespClient.from_url(stored.url).execute('SET', 'kept', 'yes', 'EX', 60)
+    stored.stop()
+    restarted = RespStandInServer(path=path).start()
+    assert RespClient.from_url(restarted.url).execute('GET', 'kept') == b'yes'
+    restarted.stop()
+
+
+def test_replicas_share_the_search_conversations(server, search_calls):
+    client = RespClient.from_url(server.url)
+    replicas = []
+    for _ in range(2):
+        bot = FakeBot()
+        persistence = SessionPersistence(RespSessionStore(client, 'test:', compress_min_bytes=64), flush_interval=60)
+        dispatcher = Dispatcher(bot, Queue(), workers=1, persistence=persistence, use_context=True)
+        handler = search_conversation.get_search_conv_handler(persistent=True)
+        dispatcher.add_handler(handler)
+        dispatcher.add_handler(persistence.get_prefetch_handler([handler]), group=-1)
+        replicas.append((bot, dispatcher))
+
+    chat_id = 5
+    (first, second), steps = chat_script(chat_id, random.Random(1))
+    for update_id, step in enumerate(steps, start=1):
+        # Every update reaches the other replica, and costs one read and one write
+        bot, dispatcher = replicas[update_id % 2]
+        round_trips = client.round_trips
+        dispatcher.process_update(make_update(bot, update_id, chat_id, **step))
+        assert client.round_trips - round_trips == 2
+
+    assert search_calls[chat_id] == [sorted([first, second])]
+    sent = [text for bot, _ in replicas for text, _ in bot.sent[chat_id]]
+    assert any(f'poi-{chat_id}-0' in text for text in sent)
+    assert 'I hope this information will be helpful for you.\nsee you soon!' in sent
+
+    # The ended conversation is deleted, the results are kept compressed for their buttons
+    assert client.execute('GET', f'test:conv:search:[{chat_id}, {chat_id}]') is None
+    assert client.execute('GET', f'test:chat:{chat_id}')[:1] == b'x'
+
+
+def test_geocode_results_are_shared(server):
+    client = RespClient.from_url(server.url)
+    first, second = (GeocodeCache(shared=SharedCache(client, 'geocode')) for _ in range(2))
+
+    first.set('Lviv, Ukraine', ['Lviv, Lviv Oblast, Ukraine', {"lat": 49.84, "lng": 24.03}])
+    first.set('Nowhere', [])
+    assert second.get('lviv ukraine') == ['Lviv, Lviv Oblast, Ukraine', {"lat": 49.84, "lng": 24.03}]
+    assert second.get('nowhere') == []
+    assert second.get('Kyiv') is None
+    assert second.stats()["hits"] == 2
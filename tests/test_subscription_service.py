@@ -0,0 +1,114 @@
+import random
+import threading
+from queue import Queue
+
+from telegram import Location
+from telegram.error import Unauthorized
+from telegram.ext import Dispatcher
+
+from src.conversations import subscribe_conversation
+from src.services.poi_index_service import PoiIndexService
+from src.services.poi_stream_service import PoiRecord
+from src.services.ranking_service import haversine
+from src.services.safe_refuge_api_service import SafeRefugeApiService
+from src.services.subscription_service import (
+    FanOutEngine,
+    Subscription,
+    SubscriptionIndex,
+    SubscriptionService,
+    SubscriptionStore,
+)
+from tests.fakes import FakeBot, make_update
+
+CATEGORIES = ['Food', 'Medical', 'Shelter']
+
+
+def test_points_are_matched_without_scanning_every_subscription():
+    rng = random.Random(3)
+    index = SubscriptionIndex(cell_degrees=0.25)
+    subscriptions = [
+        Subscription(chat_id, rng.uniform(44, 52), rng.uniform(20, 40), rng.sample(CATEGORIES, rng.randint(1, 2)), rng.choice([5000, 20000]))
+        for chat_id in range(30000)
+    ]
+    for subscription in subscriptions:
+        index.add(subscription)
+    index.remove(0)
+
+    for poi_id in range(20):
+        item = PoiRecord(poi_id, 'New shelter', (rng.choice(CATEGORIES),), (rng.uniform(20, 40), rng.uniform(44, 52)))
+        expected = {
+            subscription.chat_id for subscription in subscriptions[1:]
+            if item.category[0] in subscription.categories
+            and haversine(subscription.latitude, subscription.longitude, item.latitude, item.longitude) <= subscription.radius
+        }
+        assert {subscription.chat_id for subscription, _ in index.match(item)} == expected
+
+
+def test_alerts_are_sent_once_per_chat_and_blocked_chats_unsubscribed():
+    index = SubscriptionIndex()
+    for chat_id in range(1, 121):
+        index.add(Subscription(chat_id, 49.84, 24.03, ('Shelter',), 10000))
+    index.add(Subscription(500, 50.45, 30.52, ('Shelter',), 10000))
+
+    sent = {}
+    lock = threading.Lock()
+
+    def send(chat_id, text):
+        if chat_id == 7:
+            raise Unauthorized('Forbidden: bot was blocked by the user')
+        with lock:
+            sent[chat_id] = text
+
+    engine = FanOutEngine(index, send, rate=1000, batch_size=16, max_items=1, batch_window=0.05, on_blocked=index.remove)
+    engine.start()
+    engine.publish([PoiRecord(1, 'Shelter A', ('Shelter',), (24.031, 49.841))])
+    engine.publish([PoiRecord(2, 'Shelter B', ('Shelter',), (24.04, 49.85)), PoiRecord(3, 'Kitchen', ('Food',), (24.03, 49.84))])
+    engine.stop()
+
+    assert sorted(sent) == [chat_id for chat_id in range(1, 121) if chat_id != 7]
+    assert 'Shelter A' in sent[1] and '1 more' in sent[1] and 'Kitchen' not in sent[1]
+    assert index.get(7) is None
+    assert engine.stats() == {"pending": 0, "matched": 240, "sent": 119, "failed": 1}
+
+
+def test_syncs_publish_the_changed_points(monkeypatch):
+    items = [PoiRecord(index, f'poi {index}', ('Shelter',), (24.0, 49.8)) for index in range(3)]
+
+    def get_points_of_interest(chat_id, skip=0, limit=20, **kwargs):
+        return iter(items[skip:skip + limit])
+
+    published = []
+    monkeypatch.setattr(SafeRefugeApiService, 'get_points_of_interest', staticmethod(get_points_of_interest))
+    monkeypatch.setattr(PoiIndexService, 'index', None)
+    monkeypatch.setattr(PoiIndexService, '_listeners', [published.append])
+
+    PoiIndexService.sync()
+    items[1] = PoiRecord(1, 'poi 1', ('Shelter', 'Food'), (24.0, 49.8))
+    items.append(PoiRecord(3, 'poi 3', ('Food',), (24.1, 49.9)))
+    PoiIndexService.sync()
+    PoiIndexService.sync()
+
+    assert [[item.id for item in changes] for changes in published] == [[1, 3]]
+
+
+def test_subscribe_reuses_the_search_steps(monkeypatch):
+    monkeypatch.setattr(SafeRefugeApiService, 'get_category_list', staticmethod(lambda: list(CATEGORIES)))
+    monkeypatch.setattr(SubscriptionService, 'store', SubscriptionStore())
+    monkeypatch.setattr(SubscriptionService, 'index', SubscriptionIndex())
+
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=0, use_context=True)
+    for handler in subscribe_conversation.get_subscribe_handlers():
+        dispatcher.add_handler(handler)
+
+    chat_id = 11
+    steps = [{'text': '/subscribe'}, {'text': 'Shelter'}, {'text': 'No'}, {'location': Location(24.03, 49.84)}]
+    for update_id, step in enumerate(steps, start=1):
+        dispatcher.process_update(make_update(bot, update_id, chat_id, **step))
+
+    assert bot.sent[chat_id][-1][0].startswith('Done! I will let you know about new points of interest (Shelter) within 10.0 km')
+    assert SubscriptionService.store.load()[0].categories == ('Shelter',)
+    assert SubscriptionService.index.get(chat_id).latitude == 49.84
+
+    dispatcher.process_update(make_update(bot, 5, chat_id, text='/unsubscribe'))
+    assert SubscriptionService.index.get(chat_id) is None and SubscriptionService.store.load() == []
@@ -0,0 +1,29 @@
+from collections import Counter
+
+from benchmarks.fakes import message_update
+from src.services.webhook_service import HashRing, get_routing_key
+
+
+def test_conversation_updates_share_a_routing_key():
+    message = message_update(1, chat_id=77, text='/search')
+    callback_query = {
+        'update_id': 2,
+        'callback_query': {'id': '1', 'from': {'id': 77}, 'chat_instance': 'x', 'message': message['message']},
+    }
+    inline_query = {'update_id': 3, 'inline_query': {'id': '1', 'from': {'id': 77}, 'query': '', 'offset': ''}}
+
+    assert get_routing_key(message) == get_routing_key(callback_query) == get_routing_key(inline_query) == 77
+
+
+def test_hash_ring_spreads_chats_and_only_moves_the_new_workers_share():
+    chats = range(1, 20001)
+    four = HashRing(4)
+    five = HashRing(5)
+
+    load = Counter(four.node_for(chat_id) for chat_id in chats)
+    assert set(load) == {0, 1, 2, 3}
+    assert max(load.values()) < 1.3 * len(chats) / 4
+
+    moved = [chat_id for chat_id in chats if four.node_for(chat_id) != five.node_for(chat_id)]
+    assert all(five.node_for(chat_id) == 4 for chat_id in moved)
+    assert len(moved) < 1.5 * len(chats) / 5